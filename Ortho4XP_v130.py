@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import os
+import multiprocessing
 Ortho4XP_dir='..' if getattr(sys,'frozen',False) else '.'
 sys.path.append(os.path.join(Ortho4XP_dir,'src'))
 
@@ -15,9 +16,12 @@ import O4_GUI_Utils as GUI
 import O4_Config_Utils as CFG  # CFG imported last because it can modify other modules variables
 
 
-cmd_line="USAGE: Ortho4XP_v130.py lat lon imagery zl (won't read a tile config)\n   OR:  Ortho4XP_v130.py lat lon (with existing tile config file)"
+cmd_line="USAGE: Ortho4XP_v130.py lat lon imagery zl (won't read a tile config)\n   OR:  Ortho4XP_v130.py lat lon (with existing tile config file)\n"+\
+         "       add --force-mesh to build the mesh again even if its inputs did not change\n"+\
+         "       add --estimate-mesh to only predict the number of triangles of the mesh (after Step 1)"
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     if not os.path.isdir(FNAMES.Utils_dir):
         print("Missing ",FNAMES.Utils_dir,"directory, check your install. Exiting.")
         sys.exit()   
@@ -41,6 +45,11 @@ if __name__ == '__main__':
         Ortho4XP.mainloop()	    
         print("Bon vol!")
     else: # sequel is only concerned with command line 
+        if '--force-mesh' in sys.argv:
+            sys.argv.remove('--force-mesh')
+            MESH.force_mesh_rebuild=True
+        estimate_only='--estimate-mesh' in sys.argv
+        if estimate_only: sys.argv.remove('--estimate-mesh')
         if len(sys.argv)<3:
             print(cmd_line); sys.exit()
         try:
@@ -63,6 +72,9 @@ if __name__ == '__main__':
                 tile.default_zl=zoomlevel
             except:
                 print(cmd_line); sys.exit()
+        if estimate_only:
+            MESH.estimate_mesh(tile)
+            sys.exit()
         try:
             VMAP.build_poly_file(tile)
             MESH.build_mesh(tile)
@@ -11,6 +11,8 @@ import O4_Vector_Map as VMAP
 import O4_Imagery_Utils as IMG
 import O4_Tile_Utils as TILE
 import O4_Overlay_Utils as OVL
+import O4_DSF_Utils as DSF
+import O4_Mesh_Utils as MESH
 
 
 cfg_vars={
@@ -21,6 +23,11 @@ cfg_vars={
     'skip_downloads':        {'module':'TILE','type':bool,'default':False,'hint':'Will only build the DSF and TER files but not the textures (neither download nor convert). This could be useful in cases where imagery cannot be shared.'},
     'skip_converts':         {'module':'TILE','type':bool,'default':False,'hint':'Imagery will be downloaded but not converted from jpg to dds. Some user prefer to postprocess imagery with third party softwares prior to the dds conversion. In that case Step 3 needs to be run a second time after the retouch work.'}, 
     'max_convert_slots':     {'module':'TILE','type':int,'default':4,'values':(1,2,3,4,5,6,7,8),'hint':'Number of parallel threads for dds conversion. Should be mainly dictated by the number of cores in your CPU.'},
+    'max_dsf_workers':       {'module':'DSF','type':int,'default':1,'values':(1,2,3,4,5,6,7,8),'hint':'Number of processes sharing the encoding of the DSF mesh in Step 3, each of them taking care of a group of pools. The DSF file does not depend on it. With 1 the encoding stays within the main process.'},
+    'speculative_mesh':      {'module':'MESH','type':bool,'default':False,'hint':'When set, Step 2 runs Triangle4XP with min_angle=0 in parallel to the run with the configured min_angle. The latter is kept when it succeeds, otherwise the fallback is ready without a second run. Needs about twice the RAM and CPU of a single run.'},
+    'speculative_mesh_min_ram':{'module':'MESH','type':float,'default':8,'hint':'Available RAM (in GB) under which speculative_mesh is not used.'},
+    'use_mesh_cache':        {'module':'MESH','type':bool,'default':True,'hint':'When set, Step 2 records the hashes of its inputs (poly, node and DEM files, weight map and mesh settings) next to the mesh, and skips Triangle4XP and its post-processing when none of them changed. Use --force-mesh on the command line to rebuild anyway.'},
+    'use_dsf_cache':         {'module':'DSF','type':bool,'default':False,'hint':'When set, Step 3 keeps the encoded pools of the DSF next to its build manifest, so that a rebuild of the tile with the same mesh only encodes again the pools whose textures or settings changed. The cache is about the size of the DSF file itself, and is removed when unset.'},
     'check_tms_response':    {'module':'IMG','type':bool,'default':True,'hint':'When set, internal server errors (HTTP [500] and the likes) yields new requests, if not a white texture is used in place.'},
     'http_timeout':          {'module':'IMG','type':float,'default':10,'hint':'Delay before we decide that a http request is timed out.'},
     'max_connect_retries':   {'module':'IMG','type':int,'default':5,'hint':'How much times do we try again after a failed connection for imagery request. Only used if check_tms_response is set to True.'},
@@ -29,6 +36,7 @@ cfg_vars={
     'ovl_exclude_net'    :   {'module':'OVL','type':list,'default':[],'hint':'Indices of road types which one would like to left aside in the extraction of overlays. The list of these indices is can be in the roads.net file within X-Plane Resources, but some sceneries use their own corresponding net definition file. Powerlines have index 22001 in XP11 roads.net default file.'},
     'custom_scenery_dir':    {'type':str,'default':'','hint':'Your X-Plane Custom Scenery. Used only for "1-click" creation (or deletion) of symbolic links from Ortho4XP tiles to there.'},
     'custom_overlay_src':    {'module':'OVL','type':str,'default':'','hint':'The directory containing the sceneries with the overlays you would like to extract. You need to select the level of directory just _ABOVE_ Earth nav data.'},
+    'community_mirror':      {'module':'MESH','type':str,'default':'','hint':'Base url (http://, https:// or file://) or local directory of a mirror of the community server, used in place of the one from community_server.txt for Ctrl+click on "Triangulate 3D Mesh". The server may provide a SHA256SUMS manifest (sha256sum format) against which downloaded meshes are checked. Interrupted downloads are resumed.'},
     # Vector
     'apt_smoothing_pix':   {'type':int,  'default':8,'hint':"How much gaussian blur is applied to the elevation raster for the look up of altitude over airports. Unit is the evelation raster pixel size."},
     'road_level':          {'type':int,'default':1,'values':(0,1,2,3,4,5),'hint':'Allows to level the mesh along roads and railways. Zero means nothing such is included; "1" looks for banking ways among motorways, primary and secondary roads and railway tracks; "2" adds tertiary roads; "3" brings residential and unclassified roads; "4" takes service roads, and 5 finishes with tracks. Purge the small_roads.osm cached data if you change your mind in between the levels 2-5.'},
@@ -75,21 +83,23 @@ cfg_vars={
     'terrain_casts_shadows':{'type':bool,'default':True,'hint':'If unset, the terrain itself will not cast (but still receive!) shadows. This option is only meaningful if scenery shadows are opted for in the X-Plane graphics settings.','short_name':'terrain_casts_shadow'},
     'overlay_lod':         {'type':float,'default':25000,'hint':'Distance until which overlay imageries (that is orthophotos over water) are drawn. Lower distances have a positive impact on frame rate and VRAM usage, and IFR flyers will probably need a higher value than VFR ones.'},
     'use_decal_on_terrain':{'type':bool,'default':False,'hint':'Terrain files for all but water triangles will contain the maquify_1_green_key.dcl decal directive. The effect is noticeable at very low altitude and helps to overcome the orthophoto blur at such levels. Can be slightly distracting at higher altitude.'},
+    'hilbert_pools':       {'type':bool,'default':False,'hint':'When set, DSF point pools are built with the cells visited along a Hilbert curve: cells too full for a pool are split as in the default quadtree, but consecutive sibling cells are packed into the same pool as long as they fit. Pools are thus fewer and fuller (squares, rectangles or L shapes), with less boundary between them, hence fewer triangles spanning two pools, which makes the DSF file somewhat smaller.'},
+    'use_triangle_strips': {'type':bool,'default':False,'hint':'When set, the triangles of each DSF pool are written as triangle strips where possible rather than as triangle lists. The DSF file is somewhat smaller, but the encoding of Step 3 is noticeably slower.'},
     # Other
     'custom_dem':          {'type':str,'default':'','hint':'Path to an elevation data file to be used instead of the default Viewfinderpanoramas.org ones (J. de Ferranti). The raster must be in geopgraphical coordinates (EPSG:4326) but the extent need not match the tile boundary (requires Gdal). Regions of the tile that are not covered by the raster are mapped to zero altitude (can be useful for high resolution data over islands in particular).     '},
     'fill_nodata':         {'type':bool,'default':True,'hint':'When set, the no_data values in the raster will be filled by a nearest neighbour algorithm. If unset, they are turned into zero (can be useful for rasters with no_data over the whole oceanic part or partial LIDAR data).'}
 }
 
 list_app_vars=['verbosity','cleaning_level','overpass_server_choice',
-               'skip_downloads','skip_converts','max_convert_slots','check_tms_response',
-               'http_timeout','max_connect_retries','max_baddata_retries','ovl_exclude_pol','ovl_exclude_net','custom_scenery_dir','custom_overlay_src']
-gui_app_vars_short=list_app_vars[:-2]
-gui_app_vars_long=list_app_vars[-2:]
+               'skip_downloads','skip_converts','max_convert_slots','max_dsf_workers','speculative_mesh','speculative_mesh_min_ram','use_mesh_cache','use_dsf_cache','check_tms_response',
+               'http_timeout','max_connect_retries','max_baddata_retries','ovl_exclude_pol','ovl_exclude_net','custom_scenery_dir','custom_overlay_src','community_mirror']
+gui_app_vars_short=list_app_vars[:-3]
+gui_app_vars_long=list_app_vars[-3:]
 
 list_vector_vars=['apt_smoothing_pix','road_level','road_banking_limit','lane_width','max_levelled_segs','water_simplification','min_area','max_area','clean_bad_geometries','mesh_zl']
 list_mesh_vars=['curvature_tol','apt_curv_tol','apt_curv_ext','coast_curv_tol','coast_curv_ext','limit_tris','hmin','min_angle','sea_smoothing_mode','water_smoothing','iterate']
 list_mask_vars=['mask_zl','masks_width','masking_mode','use_masks_for_inland','imprint_masks_to_dds','masks_use_DEM_too','masks_custom_extent']
-list_dsf_vars=['cover_airports_with_highres','cover_extent','cover_zl','ratio_water','overlay_lod','sea_texture_blur','add_low_res_sea_ovl','experimental_water','normal_map_strength','terrain_casts_shadows','use_decal_on_terrain']
+list_dsf_vars=['cover_airports_with_highres','cover_extent','cover_zl','ratio_water','overlay_lod','sea_texture_blur','add_low_res_sea_ovl','experimental_water','normal_map_strength','terrain_casts_shadows','use_decal_on_terrain','hilbert_pools','use_triangle_strips']
 list_other_vars=['custom_dem','fill_nodata']
 list_tile_vars=list_vector_vars+list_mesh_vars+list_mask_vars+list_dsf_vars+list_other_vars+['default_website','default_zl','zone_list']
 
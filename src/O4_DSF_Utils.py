@@ -1,17 +1,20 @@
 import os
 import pickle
 import shutil
-from math import floor, ceil
-import array
+import time
 import numpy
 from PIL import Image, ImageDraw
-from collections import defaultdict
 import struct
 import hashlib
+import sys
+import multiprocessing
 import O4_File_Names as FNAMES
 import O4_Geo_Utils as GEO
+import O4_Imagery_Utils as IMG
 import O4_Mask_Utils as MASK
+import O4_Mesh_Utils as MESH
 import O4_UI_Utils as UI
+import O4_Vector_Utils as VECT
 
 quad_init_level=3
 quad_capacity_high=50000
@@ -20,87 +23,246 @@ quad_capacity_low=35000
 experimental_water_zl=14
 experimental_water_provider_code='SEA'
 
+# number of processes sharing the encoding of DSF pools, 1 for no process pool
+max_dsf_workers=1
+
+# Step 3 keeps a manifest of its inputs, and optionally the encoded pools 
+# of the last build (about a second copy of the DSF) so that a rebuild only 
+# encodes again those whose inputs changed
+use_dsf_cache=False
+manifest_version=1
+# tile settings recorded in the manifest, and those textures depend on
+manifest_tile_vars=('default_website','default_zl','mesh_zl','cover_airports_with_highres','cover_extent','cover_zl',
+        'ratio_water','overlay_lod','sea_texture_blur','add_low_res_sea_ovl','experimental_water','normal_map_strength',
+        'terrain_casts_shadows','use_decal_on_terrain','hilbert_pools','use_triangle_strips','mask_zl','masks_width','masking_mode',
+        'use_masks_for_inland','imprint_masks_to_dds','masks_use_DEM_too','masks_custom_extent')
+texture_tile_vars=('imprint_masks_to_dds','mask_zl','sea_texture_blur')
+
 # For Laminar test suite
 use_test_texture=False  
 
+# pieces of the .ter files, see terrain_template
+terrain_header='A\n800\nTERRAIN\n\nLOAD_CENTER {lat:.5f} {lon:.5f} {size} 4096\nBASE_TEX_NOWRAP ../textures/{texture}\n'
+terrain_normal_map='TEXTURE_NORMAL {scale} ../textures/water_normal_map.dds\nGLOBAL_specular 1.0\nNORMAL_METALNESS\n'
+terrain_transition='BORDER_TEX ../textures/water_transition.png\n'
+terrain_border_tex='LOAD_CENTER_BORDER {lat:.5f} {lon:.5f} {size} {mask_size}\nBORDER_TEX ../textures/{mask}\n'
+
+# how textured nodes are stored, by variant : DSF pool group (7, 9 or 5
+# planes), flat shading, constant alpha in the two last planes.
+# 0 : land (or dxt5 masked sea)          1 : sea with border_tex mask
+# 2 : X-Plane water                      3 : normal mapped water 
+# 4 : constant alpha water overlay 
+variant_offset=numpy.array([0,1,2,0,1])
+variant_flat=numpy.array([False,False,True,True,True])
+variant_alpha=numpy.array([False,False,False,False,True])
+
 ##############################################################################
-def float2qquad(x):
-    if x>=1: return '111111111111111111111111'
-    return numpy.binary_repr(int(16777216*x)).zfill(24) # 2**24=16777216
+def quad_coords(x):
+    # 24 bits quantization of tile relative coordinates in [0,1]
+    return numpy.minimum((16777216*numpy.asarray(x,dtype=numpy.float64)).astype(numpy.int64),16777215).astype(numpy.uint64) # 2**24=16777216
 ##############################################################################
 
 ##############################################################################
-class QuadTree(dict):
+def spread_bits(q):
+    # inserts a zero bit in front of each of the 24 lowest bits of q
+    q=q&numpy.uint64(0xFFFFFF)
+    for (shift,mask) in ((16,0x0000FFFF0000FFFF),(8,0x00FF00FF00FF00FF),(4,0x0F0F0F0F0F0F0F0F),(2,0x3333333333333333),(1,0x5555555555555555)):
+        q=(q|(q<<numpy.uint64(shift)))&numpy.uint64(mask)
+    return q
+##############################################################################
 
-    class Bucket(dict):
-        def __init__(self):
-            self['size']=0
-            self['idx_nodes']=set()
+##############################################################################
+def morton_codes(qx,qy):
+    # 48 bits interleaved codes, x bits first, so that the 2*level leading bits
+    # of a code are the quadtree key of its node at that level
+    return (spread_bits(qx)<<numpy.uint64(1))|spread_bits(qy)
+##############################################################################
 
-    def __init__(self,level,bucket_size):
-        self.bucket_size=bucket_size
-        if level==0:
-            self[('','')]=self.Bucket() 
-        else:
-            for i in range(2**level):
-                for j in range(2**level):
-                    key=(numpy.binary_repr(i).zfill(level),numpy.binary_repr(j).zfill(level))
-                    self[key]=self.Bucket() 
-        self.nodes={}
-        self.levels={}
-        self.last_node=0
-    
-    def split_bucket(self,key):
-        level=len(key[0])+1
-        self[(key[0]+'0',key[1]+'0')]=self.Bucket()
-        self[(key[0]+'0',key[1]+'1')]=self.Bucket()
-        self[(key[0]+'1',key[1]+'0')]=self.Bucket()
-        self[(key[0]+'1',key[1]+'1')]=self.Bucket()
-        for idx in self[key]['idx_nodes']:
-            new_key=(self.nodes[idx][0][:level],self.nodes[idx][1][:level])
-            self[new_key]['idx_nodes'].add(idx)
-            self[new_key]['size']+=1
-            self.levels[idx]+=1
-        del(self[key])
-
-    def insert(self,bx,by,level):
-        while True:
-            key=(bx[:level],by[:level])
-            if key in self:
-                break
-            level+=1
-        if self[key]['size']<self.bucket_size:
-            self[key]['idx_nodes'].add(self.last_node)
-            self[key]['size']+=1
-            self.nodes[self.last_node]=(bx,by)
-            self.levels[self.last_node]=level
-            self.last_node+=1
-        else:
-            self.split_bucket(key)
-            self.insert(bx,by,level+1)
-    
-    def clean(self):
-        for key in list(self.keys()):
-            if not self[key]['size']:
-                del(self[key])
-                
-    
-    def statistics(self):
-        lengths=numpy.array([self[key]['size'] for key in self])
-        depths=numpy.array([len(key[0]) for key in self])
-        UI.vprint(1,"     Number of buckets:",len(lengths))
-        UI.vprint(1,"     Average depth:",depths.mean(),", Average bucket size:",lengths.mean())
-        UI.vprint(1,"     Largest depth:",numpy.max(depths))
-    
+##############################################################################
+def pool_quadtree(qx,qy,init_level,capacity):
+    # The pools are the leaves of a quadtree starting at init_level in which
+    # a bucket is split as soon as it would hold more than capacity nodes. 
+    # Nodes are sorted once by their Morton code, so that each bucket is a
+    # slice of the sorted array. Pools are numbered in the order in which the
+    # former node by node insertion would have created them : initial buckets
+    # first, then children of a bucket when it receives its (capacity+1)th node.
+    # Returns the pool of each node and the (level,key_x,key_y) of each pool.
+    nbr_nodes=len(qx)
+    codes=morton_codes(qx,qy)
+    order=numpy.argsort(codes,kind='stable')
+    codes=codes[order]
+    buckets=[]
+    for i in range(2**init_level):
+        for j in range(2**init_level):
+            buckets.append((-1,init_level,i*2**init_level+j,(int(spread_bits(numpy.uint64(i)))<<1)|int(spread_bits(numpy.uint64(j))),0,nbr_nodes))
+    leaves=[]
+    while buckets:
+        (birth,level,rank,prefix,start,end)=buckets.pop()
+        shift=48-2*level
+        (start,end)=numpy.searchsorted(codes[start:end],numpy.array([prefix<<shift,(prefix+1)<<shift],dtype=numpy.uint64))+start
+        if end-start<=capacity or level==24:
+            if end>start: leaves.append((birth,level,rank,int(start),int(end)))
+            continue
+        # index of the node whose insertion would have split this bucket
+        split_time=int(numpy.partition(order[start:end],capacity)[capacity])
+        for child in range(4):
+            buckets.append((split_time,level+1,child,4*prefix+child,start,end))
+    leaves.sort()
+    node_pool=numpy.zeros(nbr_nodes,dtype=numpy.int64)
+    pool_keys=[]
+    for (idx_pool,(birth,level,rank,start,end)) in enumerate(leaves):
+        node_pool[order[start:end]]=idx_pool
+        pool_keys.append((level,int(qx[order[start]])>>(24-level),int(qy[order[start]])>>(24-level)))
+    return (node_pool,pool_keys)
+##############################################################################
+
+##############################################################################
+def hilbert_codes(qx,qy,order=24):
+    # Position of (qx,qy) along the Hilbert curve filling [0,2**order)**2
+    (x,y)=(qx.astype(numpy.int64),qy.astype(numpy.int64))
+    d=numpy.zeros(len(x),dtype=numpy.int64)
+    full=(1<<order)-1
+    s=1<<(order-1)
+    while s:
+        rx=(x & s)>0
+        ry=(y & s)>0
+        d+=s*s*((3*rx)^ry)
+        # rotate the quadrant so that the curve enters it from its corner
+        flip=(~ry) & rx
+        x=numpy.where(flip,full^x,x)
+        y=numpy.where(flip,full^y,y)
+        (x,y)=(numpy.where(ry,x,y),numpy.where(ry,y,x))
+        s>>=1
+    return d
+##############################################################################
+
+##############################################################################
+def hilbert_pools(qx,qy,init_level,capacity):
+    # Alternative to the quadtree : cells are visited in the order of a Hilbert
+    # curve, which runs through the four children of a cell one after the 
+    # other. A cell with more than capacity nodes is split as in the quadtree,
+    # but consecutive children are packed together in a same pool as long as
+    # they fit, so that pools are fewer and fuller (squares, rectangles or L 
+    # shapes) and the boundaries between them, hence cross-pool triangles, a
+    # subset of those of the quadtree. Returns the pool of each node and the
+    # (qx_min,qx_max,qy_min,qy_max) bounding box of each pool, snapped to 
+    # multiples of 2**8 so that pool scalings and offsets are exact in float32. 
+    codes=hilbert_codes(qx,qy)
+    order=numpy.argsort(codes,kind='stable')
+    codes=codes[order]
+    (cells,cell_starts)=numpy.unique(codes>>(2*(24-init_level)),return_index=True)
+    cell_ends=numpy.append(cell_starts[1:],len(codes))
+    # stack of ('cell',level,start,end) to split, or ('pool',end) to close
+    todo=[('cell',init_level,start,end) for (start,end) in zip(cell_starts.tolist(),cell_ends.tolist())][::-1]
+    bounds=[0]
+    while todo:
+        item=todo.pop()
+        if item[0]=='pool':
+            bounds.append(item[1])
+            continue
+        (level,start,end)=item[1:]
+        if end-start<=capacity or level==24:
+            bounds.append(end)
+            continue
+        shift=2*(23-level)
+        prefix=int(codes[start])>>(shift+2)
+        child_bounds=[start]+(start+numpy.searchsorted(codes[start:end],[((prefix<<2)|k)<<shift for k in (1,2,3)])).tolist()+[end]
+        items=[]
+        group_start=start
+        for (child_start,child_end) in zip(child_bounds[:-1],child_bounds[1:]):
+            if child_end-child_start>capacity:
+                if child_start>group_start: items.append(('pool',child_start))
+                items.append(('cell',level+1,child_start,child_end))
+                group_start=child_end
+            elif child_end-group_start>capacity:
+                items.append(('pool',child_start))
+                group_start=child_start
+        if end>group_start: items.append(('pool',end))
+        todo+=items[::-1]
+    bounds=numpy.array(bounds)
+    node_pool=numpy.empty(len(codes),dtype=numpy.int64)
+    node_pool[order]=numpy.repeat(numpy.arange(len(bounds)-1),numpy.diff(bounds))
+    boxes=[]
+    for q in (qx[order].astype(numpy.int64),qy[order].astype(numpy.int64)):
+        boxes.append(numpy.minimum.reduceat(q,bounds[:-1]) & ~255)
+        boxes.append((numpy.maximum.reduceat(q,bounds[:-1]) | 255)+1)
+    return (node_pool,numpy.column_stack(boxes))
+##############################################################################
+
+##############################################################################
+def box_icoords(q,q_min,q_max):
+    return numpy.round((q.astype(numpy.int64)-q_min)*65535/(q_max-q_min)).astype(numpy.uint16)
+##############################################################################
+
+##############################################################################
+def pool_icoords(q,levels):
+    # the 16 bits following the pool key, or all the remaining ones if less
+    shifts=numpy.uint64(24)-levels.astype(numpy.uint64)
+    return ((q&((numpy.uint64(1)<<shifts)-numpy.uint64(1)))>>(numpy.maximum(shifts,numpy.uint64(16))-numpy.uint64(16))).astype(numpy.uint16)
+##############################################################################
+
+##############################################################################
+def pool_slices(pools,pool_nbr):
+    # indices sorting items by pool (stably), and the bounds of each pool
+    order=numpy.argsort(pools,kind='stable')
+    return (order,numpy.searchsorted(pools[order],numpy.arange(pool_nbr+1)))
+##############################################################################
+
+##############################################################################
+def pool_statistics(node_pool,pool_keys):
+    lengths=numpy.bincount(node_pool,minlength=len(pool_keys))
+    depths=numpy.array([key[0] for key in pool_keys])
+    UI.vprint(1,"     Number of buckets:",len(lengths))
+    UI.vprint(1,"     Average depth:",depths.mean(),", Average bucket size:",lengths.mean())
+    UI.vprint(1,"     Largest depth:",numpy.max(depths))
+##############################################################################
+
+##############################################################################
+def near_polygon_edges(x,y,polygon,distance):
+    # Whether the points (x,y) are within distance of an edge of polygon
+    # [x0,y0,x1,y1,...]
+    near=numpy.zeros(numpy.shape(x),dtype=bool)
+    (poly_x,poly_y)=(polygon[::2],polygon[1::2])
+    for k in range(len(poly_x)):
+        (x0,y0,x1,y1)=(poly_x[k-1],poly_y[k-1],poly_x[k],poly_y[k])
+        (dx,dy)=(x1-x0,y1-y0)
+        t=numpy.clip(((x-x0)*dx+(y-y0)*dy)/max(dx*dx+dy*dy,1),0,1)
+        near|=numpy.hypot(x-x0-t*dx,y-y0-t*dy)<=distance
+    return near
+##############################################################################
+
+##############################################################################
+def drawn_pixel(polygon,x,y):
+    # Whether ImageDraw.polygon fills pixel (x,y) (x>=0) with polygon 
+    # [x0,y0,...] of integers, drawn on a single row image. Rows are filled
+    # from the abscissas of the edges at the row relative to their vertices,
+    # which a shift of all ordinates leaves unchanged (not so for abscissas).
+    row_im=Image.new("L",(x+1,1),0)
+    ImageDraw.Draw(row_im).polygon([(vx,vy-y) for (vx,vy) in zip(polygon[::2],polygon[1::2])],fill=1)
+    return row_im.getpixel((x,0))==1
 ##############################################################################
 
 ##############################################################################
 def zone_list_to_ortho_dico(tile):
         # tile.zone_list is a list of 3-uples of the form ([(lat0,lat0),...(latN,lonN),zoomlevel,provider_code)
         # where higher lines have priority over lower ones.
-        masks_im=Image.new("L",(4096,4096),'black')
-        masks_draw=ImageDraw.Draw(masks_im)
-        airport_array=numpy.zeros((4096,4096),dtype=numpy.bool)
+        # Each orthogrid cell at mesh_zl is given the zoomlevel and provider 
+        # of its center, cells are listed by columns of the grid. Centers are
+        # rounded to the pixels of a 4096x4096 image of the tile, in which 
+        # zones and airports are those drawn by the former rasterization
+        # (zone vertices rounded to pixels, ImageDraw.polygon) : pixels within
+        # 2 of a zone edge are drawn on their row alone, others are tested with
+        # points_in_polygon.
+        til_x_min,til_y_min=GEO.wgs84_to_orthogrid(tile.lat+1,tile.lon,tile.mesh_zl)
+        til_x_max,til_y_max=GEO.wgs84_to_orthogrid(tile.lat,tile.lon+1,tile.mesh_zl) 
+        til_xs=range(til_x_min,til_x_max+1,16)
+        til_ys=range(til_y_min,til_y_max+1,16)
+        (til_x,til_y)=[a.ravel() for a in numpy.meshgrid(til_xs,til_ys,indexing='ij')]
+        lons=numpy.clip([GEO.gtile_to_wgs84(x+8,til_y_min+8,tile.mesh_zl)[1] for x in til_xs],tile.lon,tile.lon+1)
+        lats=numpy.clip([GEO.gtile_to_wgs84(til_x_min+8,y+8,tile.mesh_zl)[0] for y in til_ys],tile.lat,tile.lat+1)
+        (lonp,latp)=[a.ravel() for a in numpy.meshgrid(lons,lats,indexing='ij')]
+        (pix_x,pix_y)=(numpy.round((lonp-tile.lon)*4095),numpy.round((tile.lat+1-latp)*4095))
+        airport_cells=numpy.zeros(len(til_x),dtype=bool)
         if tile.cover_airports_with_highres in ['True','ICAO']:
             UI.vprint(1,"-> Checking airport locations for upgraded zoomlevel.")
             try:
@@ -129,36 +291,24 @@ def zone_list_to_ortho_dico(tile):
                 (ymin,xmax)=GEO.gtile_to_wgs84(til_x_left2+16,til_y_top2+16,tile.cover_zl)
                 ymin-=tile.lat; xmax-=tile.lon
                 xmin=max(0,xmin); xmax=min(1,xmax); ymin=max(0,ymin); ymax=min(1,ymax)
-                # mark to airport_array
-                colmin=round(xmin*4095)
-                colmax=round(xmax*4095)
-                rowmax=round((1-ymin)*4095)
-                rowmin=round((1-ymax)*4095)
-                airport_array[rowmin:rowmax+1,colmin:colmax+1]=1
-        dico_customzl={}        
-        dico_tmp={}
-        til_x_min,til_y_min=GEO.wgs84_to_orthogrid(tile.lat+1,tile.lon,tile.mesh_zl)
-        til_x_max,til_y_max=GEO.wgs84_to_orthogrid(tile.lat,tile.lon+1,tile.mesh_zl) 
-        i=1
-        base_zone=((tile.lat,tile.lon,tile.lat,tile.lon+1,tile.lat+1,tile.lon+1,tile.lat+1,tile.lon,tile.lat,tile.lon),tile.default_zl,tile.default_website)
-        for region in [base_zone]+tile.zone_list[::-1]:
-            dico_tmp[i]=(region[1],region[2])
-            pol=[(round((x-tile.lon)*4095),round((tile.lat+1-y)*4095)) for (x,y) in zip(region[0][1::2],region[0][::2])]
-            masks_draw.polygon(pol,fill=i)
-            i+=1
-        for til_x in range(til_x_min,til_x_max+1,16):
-            for til_y in range(til_y_min,til_y_max+1,16):
-                (latp,lonp)=GEO.gtile_to_wgs84(til_x+8,til_y+8,tile.mesh_zl)
-                lonp=max(min(lonp,tile.lon+1),tile.lon) 
-                latp=max(min(latp,tile.lat+1),tile.lat) 
-                x=round((lonp-tile.lon)*4095)
-                y=round((tile.lat+1-latp)*4095)
-                (zoomlevel,provider_code)=dico_tmp[masks_im.getpixel((x,y))]
-                if airport_array[y,x]: 
-                    zoomlevel=max(zoomlevel,tile.cover_zl)
-                til_x_text=16*(int(til_x/2**(tile.mesh_zl-zoomlevel))//16)
-                til_y_text=16*(int(til_y/2**(tile.mesh_zl-zoomlevel))//16)
-                dico_customzl[(til_x,til_y)]=(til_x_text,til_y_text,zoomlevel,provider_code)
+                airport_cells|=(pix_x>=round(xmin*4095))&(pix_x<=round(xmax*4095))&(pix_y>=round((1-ymax)*4095))&(pix_y<=round((1-ymin)*4095))
+        # the base zone covers the tile, zones higher in zone_list have 
+        # priority over lower ones
+        regions=[(None,tile.default_zl,tile.default_website)]+tile.zone_list[::-1]
+        cell_regions=numpy.zeros(len(til_x),dtype=numpy.int64)
+        for (i,region) in enumerate(regions[1:],1):
+            polygon=[pixel for (lat,lon) in zip(region[0][::2],region[0][1::2]) for pixel in (round((lon-tile.lon)*4095),round((tile.lat+1-lat)*4095))]
+            inside=VECT.points_in_polygon(pix_x,pix_y,polygon)
+            for k in numpy.flatnonzero(near_polygon_edges(pix_x,pix_y,polygon,2)).tolist():
+                inside[k]=drawn_pixel(polygon,int(pix_x[k]),int(pix_y[k]))
+            cell_regions[inside]=i
+        cell_zoomlevels=numpy.array([region[1] for region in regions])[cell_regions]
+        cell_zoomlevels[airport_cells]=numpy.maximum(cell_zoomlevels[airport_cells],tile.cover_zl)
+        til_x_text=16*((til_x/2.0**(tile.mesh_zl-cell_zoomlevels)).astype(numpy.int64)//16)
+        til_y_text=16*((til_y/2.0**(tile.mesh_zl-cell_zoomlevels)).astype(numpy.int64)//16)
+        providers=[region[2] for region in regions]
+        dico_customzl={(x,y):(x_text,y_text,zoomlevel,providers[region]) for (x,y,x_text,y_text,zoomlevel,region) in \
+                zip(til_x.tolist(),til_y.tolist(),til_x_text.tolist(),til_y_text.tolist(),cell_zoomlevels.tolist(),cell_regions.tolist())}
         if tile.cover_airports_with_highres=='Existing':
             # what we find in the texture folder of the existing tile
             for f in os.listdir(os.path.join(tile.build_dir,'textures')):
@@ -175,102 +325,819 @@ def zone_list_to_ortho_dico(tile):
 ##############################################################################
 
 ##############################################################################
-def create_terrain_file(tile,texture_file_name,til_x_left,til_y_top,zoomlevel,provider_code,tri_type,is_overlay):
-    if not os.path.exists(os.path.join(tile.build_dir,'terrain')):
-        os.makedirs(os.path.join(tile.build_dir,'terrain'))
+def terrain_template(tile,tri_type,is_overlay):
+    # The content of the .ter files of a kind of terrain as a format string, 
+    # and the files from Utils it refers to. 
+    template=terrain_header
+    assets=()
+    if tri_type in (1,2) and not is_overlay: # experimental water
+        template+=terrain_normal_map
+        assets=('water_normal_map.dds',)
+    elif tri_type==1 or (tri_type==2 and is_overlay=='ratio_water'): #constant transparency level       
+        template+=terrain_transition
+        assets=('water_transition.png',)
+    elif tri_type==2 and not tile.imprint_masks_to_dds: #border_tex mask
+        template+=terrain_border_tex
+    elif tri_type==2 and tile.imprint_masks_to_dds and (tile.experimental_water & 2): #dxt5 with normal map
+        template+=terrain_normal_map
+        assets=('water_normal_map.dds',)
+    if not tri_type and tile.use_decal_on_terrain:
+        template+='DECAL_LIB lib/g10/decals/maquify_2_green_key.dcl\n'
+    template+='WET\n' if tri_type in (1,2) else 'NO_ALPHA\n'
+    if tri_type in (1,2) or not tile.terrain_casts_shadows:
+        template+='NO_SHADOW\n'
+    return (template,assets)
+##############################################################################
+
+##############################################################################
+def terrain_file(tile,template,texture_file_name,til_x_left,til_y_top,zoomlevel,provider_code,tri_type,is_overlay):
+    # The name and the content of a .ter file
     suffix='_water' if tri_type==1 else '_sea' if tri_type==2 else ''
     if is_overlay: suffix+='_overlay'
     ter_file_name=texture_file_name[:-4]+suffix+'.ter'
     if use_test_texture: texture_file_name='test_texture.dds'
-    with open(os.path.join(tile.build_dir,'terrain',ter_file_name),'w') as f:
-        f.write('A\n800\nTERRAIN\n\n')
-        [lat_med,lon_med]=GEO.gtile_to_wgs84(til_x_left+8,til_y_top+8,zoomlevel)
-        texture_approx_size=int(GEO.webmercator_pixel_size(lat_med,zoomlevel)*4096)
-        f.write('LOAD_CENTER '+'{:.5f}'.format(lat_med)+' '\
-               +'{:.5f}'.format(lon_med)+' '\
-               +str(texture_approx_size)+' 4096\n')
-        f.write('BASE_TEX_NOWRAP ../textures/'+texture_file_name+'\n')
-        if tri_type in (1,2) and not is_overlay: # experimental water
-            f.write('TEXTURE_NORMAL '+str(2**(17-zoomlevel))+' ../textures/water_normal_map.dds\n')
-            f.write('GLOBAL_specular 1.0\n')
-            f.write('NORMAL_METALNESS\n')
-            if not os.path.exists(os.path.join(tile.build_dir,'textures','water_normal_map.dds')):
-                shutil.copy(os.path.join(FNAMES.Utils_dir,'water_normal_map.dds'),os.path.join(tile.build_dir,'textures'))
-        elif tri_type==1 or (tri_type==2 and is_overlay=='ratio_water'): #constant transparency level       
-            f.write('BORDER_TEX ../textures/water_transition.png\n')
-            if not os.path.exists(os.path.join(tile.build_dir,'textures','water_transition.png')):
-                shutil.copy(os.path.join(FNAMES.Utils_dir,'water_transition.png'),os.path.join(tile.build_dir,'textures'))
-        elif tri_type==2 and not tile.imprint_masks_to_dds: #border_tex mask
-            f.write('LOAD_CENTER_BORDER '+'{:.5f}'.format(lat_med)+' '\
-               +'{:.5f}'.format(lon_med)+' '+str(texture_approx_size)+' '+str(4096//2**(zoomlevel-tile.mask_zl))+'\n')
-            f.write('BORDER_TEX ../textures/'+FNAMES.mask_file(til_x_left,til_y_top,zoomlevel,provider_code)+'\n')
-        elif tri_type==2 and tile.imprint_masks_to_dds and (tile.experimental_water & 2): #dxt5 with normal map
-            f.write('TEXTURE_NORMAL '+str(2**(17-zoomlevel))+' ../textures/water_normal_map.dds\n')
-            f.write('GLOBAL_specular 1.0\n')
-            f.write('NORMAL_METALNESS\n')
-            if not os.path.exists(os.path.join(tile.build_dir,'textures','water_normal_map.dds')):
-                shutil.copy(os.path.join(FNAMES.Utils_dir,'water_normal_map.dds'),os.path.join(tile.build_dir,'textures'))
-            pass
-        if not tri_type and tile.use_decal_on_terrain:
-            f.write('DECAL_LIB lib/g10/decals/maquify_2_green_key.dcl\n')
-        if tri_type in (1,2):
-            f.write('WET\n')
+    [lat_med,lon_med]=GEO.gtile_to_wgs84(til_x_left+8,til_y_top+8,zoomlevel)
+    texture_approx_size=int(GEO.webmercator_pixel_size(lat_med,zoomlevel)*4096)
+    return (ter_file_name,template.format(lat=lat_med,lon=lon_med,size=texture_approx_size,texture=texture_file_name,\
+            scale=2**(17-zoomlevel),mask_size=4096//2**(zoomlevel-tile.mask_zl),mask=FNAMES.mask_file(til_x_left,til_y_top,zoomlevel,provider_code)))
+##############################################################################
+
+##############################################################################
+def write_terrain_files(tile,terrain_files,assets):
+    # All .ter files of the tile at once, with the files from Utils they 
+    # refer to copied once.
+    terrain_dir=os.path.join(tile.build_dir,'terrain')
+    os.makedirs(terrain_dir,exist_ok=True)
+    for asset in sorted(assets):
+        if not os.path.exists(os.path.join(tile.build_dir,'textures',asset)):
+            shutil.copy(os.path.join(FNAMES.Utils_dir,asset),os.path.join(tile.build_dir,'textures'))
+    for (ter_file_name,content) in terrain_files:
+        with open(os.path.join(terrain_dir,ter_file_name),'w') as f:
+            f.write(content)
+    return len(terrain_files)
+##############################################################################
+
+##############################################################################
+def texture_indices(til_x,til_y,attributes,textures):
+    # The index in the list textures, extended when needed, of the texture 
+    # attributes(key) of each orthogrid key (til_x,til_y) of the input arrays. 
+    (keys,inverse)=numpy.unique((til_x<<32)|til_y,return_inverse=True)
+    dico_textures={texture_attributes:idx for (idx,texture_attributes) in enumerate(textures)}
+    key_textures=numpy.zeros(len(keys),dtype=numpy.int64)
+    for (k,key) in enumerate(keys.tolist()):
+        texture_attributes=attributes((key>>32,key&0xFFFFFFFF))
+        if texture_attributes not in dico_textures:
+            dico_textures[texture_attributes]=len(textures)
+            textures.append(texture_attributes)
+        key_textures[k]=dico_textures[texture_attributes]
+    return key_textures[inverse]
+##############################################################################
+
+##############################################################################
+def texture_is_missing(tile,texture_attributes):
+    texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
+    if os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name)):
+        return False
+    return 'g2xpl' not in texture_attributes[3] or \
+           not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name.replace('dds','partial.dds')))
+##############################################################################
+
+##############################################################################
+def space_filling_order(texture_list):
+    # Textures sorted along the Morton curve of their centers, so that 
+    # consecutive downloads (and conversions) deal with neighbouring areas.
+    if not texture_list: return []
+    til=numpy.array([texture_attributes[:3] for texture_attributes in texture_list],dtype=numpy.int64)
+    (qx,qy)=(((til[:,i]+8)<<(24-til[:,2])).astype(numpy.uint64) for i in (0,1))
+    return [texture_list[i] for i in numpy.argsort(morton_codes(qx,qy),kind='stable').tolist()]
+##############################################################################
+
+##############################################################################
+def md5_hex(data):
+    return hashlib.md5(data).hexdigest()
+##############################################################################
+
+##############################################################################
+def build_manifest(tile):
+    # Hashes of the inputs of Step 3 : the mesh file, the tile settings and 
+    # each zone of zone_list. Those of textures and masks are added along the
+    # build.
+    settings=[getattr(tile,var,None) for var in manifest_tile_vars]+[quad_init_level,quad_capacity_high,quad_capacity_low,\
+             experimental_water_zl,experimental_water_provider_code,use_test_texture]
+    return {'version':manifest_version,'mesh':MESH.file_md5(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)),\
+            'settings':md5_hex(repr(settings).encode()),'zones':[md5_hex(repr(zone).encode()) for zone in tile.zone_list],\
+            'textures':{},'masks':{}}
+##############################################################################
+
+##############################################################################
+def read_manifest(tile):
+    # The manifest of the last completed build, if any
+    try:
+        with open(FNAMES.build_manifest_file(tile),'rb') as f:
+            manifest=pickle.load(f)
+        return manifest if manifest['version']==manifest_version else None
+    except:
+        return None
+##############################################################################
+
+##############################################################################
+def activate_manifest(tile,failed_textures):
+    # The manifest written by build_dsf becomes that of the last completed 
+    # build once the DSF is activated. Textures which could not be downloaded
+    # or converted get None as texture and mask hashes (which are then seen
+    # as changed, whereas missing entries would not) to be made again by the
+    # next build.
+    manifest_file=FNAMES.build_manifest_file(tile)
+    try:
+        with open(manifest_file+'.tmp','rb') as f:
+            manifest=pickle.load(f)
+        for texture_attributes in failed_textures:
+            manifest['textures'][FNAMES.dds_file_name_from_attributes(*texture_attributes)]=None
+            manifest['masks'][FNAMES.mask_file(*texture_attributes)]=None
+        with open(manifest_file+'.tmp','wb') as f:
+            pickle.dump(manifest,f)
+        os.replace(manifest_file+'.tmp',manifest_file)
+    except Exception as e:
+        UI.lvprint(0,"ERROR : could not activate the build manifest, the next build will not rely on it.")
+        UI.vprint(2,"  ",e)
+        try: os.remove(manifest_file)
+        except: pass
+        return 0
+    if failed_textures:
+        UI.vprint(1,"   "+str(len(failed_textures))+" texture(s) could not be made, they will be again at the next build.")
+    return 1
+##############################################################################
+
+##############################################################################
+def report_changes(old_manifest,manifest):
+    if not old_manifest:
+        UI.vprint(1,"   No manifest of a previous build, the DSF is built from scratch.")
+        return
+    changes=[label for (label,key) in (('mesh','mesh'),('tile settings','settings')) if old_manifest[key]!=manifest[key]]
+    new_zones=len([zone for zone in manifest['zones'] if zone not in old_manifest['zones']])
+    old_zones=len([zone for zone in old_manifest['zones'] if zone not in manifest['zones']])
+    if new_zones: changes.append(str(new_zones)+" new or modified zone(s)")
+    if old_zones: changes.append(str(old_zones)+" removed or modified zone(s)")
+    UI.vprint(1,"   Changes since the previous build : "+(", ".join(changes) if changes else "none")+".")
+##############################################################################
+
+##############################################################################
+def provider_signature(provider_code):
+    # The plain settings of a provider and its color filters
+    provider=IMG.providers_dict.get(provider_code,{})
+    return (sorted((key,value) for (key,value) in provider.items() if isinstance(value,(str,int,float))),\
+            IMG.color_filters_dict.get(provider.get('color_filters')))
+##############################################################################
+
+##############################################################################
+def refresh_textures(tile,texture_list,old_manifest,manifest):
+    # Records in the manifest what textures are made of : their provider, or
+    # the layers of a combined provider, and the tile settings used when 
+    # converting them. Those whose inputs changed since the previous build 
+    # are removed so as to be downloaded again, their number is returned.
+    settings=[getattr(tile,var,None) for var in texture_tile_vars]
+    signatures={}
+    refreshed=0
+    for texture_attributes in texture_list:
+        texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
+        if texture_file_name in manifest['textures']: continue
+        provider_code=texture_attributes[3]
+        if provider_code not in signatures:
+            signatures[provider_code]=(provider_signature(provider_code),[(layer.get('layer_code'),layer.get('extent_code'),\
+                    layer.get('priority'),IMG.color_filters_dict.get(layer.get('color_code')),provider_signature(layer.get('layer_code')))\
+                    for layer in IMG.local_combined_providers_dict.get(provider_code,[])])
+        texture_md5=md5_hex(repr((texture_attributes,signatures[provider_code],settings)).encode())
+        manifest['textures'][texture_file_name]=texture_md5
+        if not old_manifest or old_manifest['textures'].get(texture_file_name,texture_md5)==texture_md5:
+            continue
+        for file_name in (texture_file_name,texture_file_name.replace('dds','partial.dds')):
+            if os.path.isfile(os.path.join(tile.build_dir,'textures',file_name)):
+                UI.vprint(1,"   Texture file "+file_name+" is outdated and is removed.")
+                os.remove(os.path.join(tile.build_dir,'textures',file_name))
+                refreshed+=1
+    return refreshed
+##############################################################################
+
+##############################################################################
+def pool_job_key(job,terrain_ids):
+    # Hash of everything the encoding of a pool depends on, terrains being
+    # identified by their name rather than by their index, which changes when
+    # other terrains come or go. ref_keys only tell which references share a 
+    # textured node, which follows from the rest.
+    (ref_keys,ref_nodes,ref_variants,ref_terrains,tris,tri_terrains,node_pool,node_icoords,node_lat,node_lon,terrain_tex,pool_nbr,ratio_water,strips)=job
+    md5=hashlib.md5(repr((manifest_version,pool_nbr,ratio_water,strips)).encode())
+    for array in (ref_nodes,ref_variants,terrain_ids[ref_terrains],tris,terrain_ids[tri_terrains],node_pool,node_icoords,node_lat,node_lon):
+        md5.update(repr(array.shape).encode())
+        md5.update(numpy.ascontiguousarray(array).tobytes())
+    return md5.hexdigest()
+##############################################################################
+
+##############################################################################
+def pool_atom(pool,planes):
+    # LOOP atom of a point pool given as a node by node interleaved uint16 
+    # array, the DSF stores it plane by plane, each plane being prefixed by 
+    # its (raw) encoding byte.
+    data=numpy.frombuffer(pool,dtype=numpy.uint16).astype('<u2').reshape(-1,planes)
+    atom=numpy.zeros((planes,1+2*len(data)),dtype=numpy.uint8)
+    atom[:,1:]=numpy.ascontiguousarray(data.T).view(numpy.uint8)
+    return b'LOOP'+struct.pack('<IIB',13+atom.size,len(data),planes)+atom.tobytes()
+##############################################################################
+
+##############################################################################
+def scal_atom(param,planes):
+    return b'LACS'+struct.pack('<I',8+8*planes)+numpy.array(param[:2*planes],dtype='<f4').tobytes()
+##############################################################################
+
+##############################################################################
+def patch_commands(command,coords):
+    # coords is a (nbr_coords,k) uint16 array, it is emitted as a sequence 
+    # of (command,count,coords) with at most 255 coordinates each.
+    nbr_coords=len(coords)
+    data=numpy.ascontiguousarray(coords,dtype='<u2').view(numpy.uint8).reshape(nbr_coords,-1)
+    blocks=nbr_coords//255
+    remaining=nbr_coords%255
+    full=numpy.empty((blocks,2+255*data.shape[1]),dtype=numpy.uint8)
+    full[:,0]=command
+    full[:,1]=255
+    full[:,2:]=data[:255*blocks].reshape(blocks,255*data.shape[1])
+    if not remaining:
+        return full.tobytes()
+    return full.tobytes()+bytes((command,remaining))+data[255*blocks:].tobytes()
+##############################################################################
+
+##############################################################################
+def triangle_strips(tris):
+    # Greedy decomposition of consistently oriented (nbr_tris,3) triangles into
+    # strips following the OpenGL convention, which preserves their winding.
+    # Neighbours through edges are found once with numpy, strips are then 
+    # walked from the triangles with the fewest neighbours on. Returns the
+    # concatenated vertices of the strips, their lengths, and the triangles
+    # which could not be joined to any other. 
+    nbr_tris=len(tris)
+    (tails,heads)=(tris.ravel().astype(numpy.int64),tris[:,[1,2,0]].ravel().astype(numpy.int64))
+    keys=tails*65536+heads
+    order=numpy.argsort(keys,kind='stable')
+    twin_keys=heads*65536+tails
+    pos=numpy.minimum(numpy.searchsorted(keys[order],twin_keys),len(keys)-1)
+    # the edge 3*nbr_tris (of the always used triangle nbr_tris) stands for none
+    twin=numpy.append(numpy.where(keys[order[pos]]==twin_keys,order[pos],3*nbr_tris),3*nbr_tris)
+    valence=(twin[:-1]<3*nbr_tris).reshape(-1,3).sum(axis=1)
+    edges=numpy.arange(3*nbr_tris)
+    (next1,next2)=(edges-edges%3+(edges+1)%3,edges-edges%3+(edges+2)%3)
+    # for the edge through which a strip enters a triangle : the vertex it adds,
+    # and the edge through which the strip enters the next triangle, for
+    # triangles of odd or even rank in the strip
+    third=tails[next2].tolist()
+    after_odd=numpy.append(twin[next2],3*nbr_tris).tolist()
+    after_even=numpy.append(twin[next1],3*nbr_tris).tolist()
+    del(tails,heads,keys,order,twin_keys,pos,twin,edges,next1,next2)
+    used=bytearray(nbr_tris+1)
+    used[nbr_tris]=1
+    (vertices,lengths,singles)=([],[],[])
+    for t in numpy.argsort(valence,kind='stable').tolist():
+        if used[t]: continue
+        used[t]=1
+        for s in range(3):
+            e=after_even[3*t+s]
+            if not used[e//3]: break
         else:
-            f.write('NO_ALPHA\n')
-        if tri_type in (1,2) or not tile.terrain_casts_shadows:
-            f.write('NO_SHADOW\n')
-        return ter_file_name
+            singles.append(t)
+            continue
+        start=len(vertices)
+        vertices+=(third[3*t+(s+1)%3],third[3*t+(s+2)%3],third[3*t+s])
+        while True:
+            used[e//3]=1
+            vertices.append(third[e])
+            e=after_odd[e]
+            if used[e//3]: break
+            used[e//3]=1
+            vertices.append(third[e])
+            e=after_even[e]
+            if used[e//3]: break
+        lengths.append(len(vertices)-start)
+    return (numpy.array(vertices,dtype=numpy.int64),numpy.array(lengths,dtype=numpy.int64),tris[singles])
+##############################################################################
+
+##############################################################################
+def strip_commands(vertices,lengths):
+    # PATCH TRIANGLE STRIP commands for strips given by their concatenated 
+    # vertices and their lengths. Strips longer than 255 vertices are cut 
+    # every 252 triangles (an even number, to keep the winding), the pieces 
+    # sharing two vertices.
+    pieces=numpy.maximum(lengths-3,0)//252+1
+    piece_rank=numpy.arange(int(pieces.sum()))-numpy.repeat(numpy.cumsum(pieces)-pieces,pieces)
+    piece_start=numpy.repeat(numpy.cumsum(lengths)-lengths,pieces)+252*piece_rank
+    piece_count=numpy.minimum(254,numpy.repeat(lengths,pieces)-252*piece_rank)
+    sizes=2+2*piece_count
+    cmds=numpy.zeros(int(sizes.sum()),dtype=numpy.uint8)
+    headers=numpy.cumsum(sizes)-sizes
+    cmds[headers]=26
+    cmds[headers+1]=piece_count
+    body=numpy.ones(len(cmds),dtype=bool)
+    body[headers]=body[headers+1]=False
+    points=numpy.repeat(piece_start,piece_count)+numpy.arange(int(piece_count.sum()))-numpy.repeat(numpy.cumsum(piece_count)-piece_count,piece_count)
+    cmds[body]=vertices[points].astype('<u2').view(numpy.uint8)
+    return cmds.tobytes()
+##############################################################################
+
+##############################################################################
+def in_pool_commands(tris,strips):
+    # PATCH TRIANGLE (STRIP) commands for (nbr_tris,3) in-pool positions
+    if not strips:
+        return patch_commands(23,tris.reshape(-1,1))
+    (vertices,lengths,singles)=triangle_strips(tris)
+    cmds=strip_commands(vertices,lengths) if len(lengths) else b''
+    return cmds+patch_commands(23,singles.reshape(-1,1)) if len(singles) else cmds
+##############################################################################
+
+##############################################################################
+def terrain_commands(textured_tris,overlay_terrains,dico_new_dsf_pool,overlay_lod):
+    # The CMDS atom content (without header) for the DSF mesh, in-pool blocks
+    # are already encoded commands and cross-pool ones (pool,position) pairs.
+    cmds=bytearray()
+    new_dsf_pool=numpy.zeros(max(dico_new_dsf_pool,default=0)+1,dtype=numpy.uint16)
+    for (k,v) in dico_new_dsf_pool.items():
+        new_dsf_pool[k]=v
+    for terrain_idx in textured_tris:
+        if len(textured_tris[terrain_idx])==0:
+            continue
+        cmds+=struct.pack('<BH',4,terrain_idx)                  # SET DEFINITION 16
+        flag=1 if terrain_idx not in overlay_terrains else 2   # physical or overlay
+        lod=-1 if flag==1 else overlay_lod
+        for idx_dsfpool in textured_tris[terrain_idx]:
+            if idx_dsfpool != 'cross-pool':
+                cmds+=struct.pack('<BH',1,dico_new_dsf_pool[idx_dsfpool])    # POOL SELECT
+                cmds+=struct.pack('<BBff',18,flag,0,lod)                      # TERRAIN PATCH FLAGS AND LOD
+                cmds+=textured_tris[terrain_idx][idx_dsfpool]                 # PATCH TRIANGLE (STRIP)
+            else:  # (pool idx,pos in pool idx) pairs
+                coords=numpy.frombuffer(textured_tris[terrain_idx][idx_dsfpool],dtype=numpy.uint16)
+                cmds+=struct.pack('<BH',1,dico_new_dsf_pool[int(coords[0])]) # POOL SELECT
+                cmds+=struct.pack('<BBff',18,flag,0,lod)                      # TERRAIN PATCH FLAGS AND LOD
+                coords=coords.reshape(-1,2).copy()
+                coords[:,0]=new_dsf_pool[coords[:,0]]
+                cmds+=patch_commands(24,coords)                               # PATCH TRIANGLE CROSS-POOL
+    return cmds
+##############################################################################
+
+##############################################################################
+def encode_pool_group(ref_keys,ref_nodes,ref_variants,ref_terrains,tris,tri_terrains,node_pool,node_icoords,node_lat,node_lon,terrain_tex,pool_nbr,ratio_water,strips):
+    # Textured nodes and in-pool DSF triangles of a pool (or of a group of 
+    # pools), which do not depend on the other pools. The ref_* arrays describe
+    # the references to nodes (local to the pool) in encoding order, and tris
+    # are the in-pool DSF triangles as triples of such references. Returns the
+    # position of each reference in its DSF pool, the (DSF pool,length,LOOP
+    # atom) of its non empty DSF pools, its (terrain,DSF pool,first triangle
+    # in tris,commands) triangle blocks, and its number of textured nodes. 
+    (first_seen,ref_to_node)=numpy.unique(ref_keys,return_index=True,return_inverse=True)[1:]
+    nodes=ref_nodes[first_seen]
+    variants=ref_variants[first_seen]
+    terrains=ref_terrains[first_seen]
+    idx_dsfpools=node_pool[nodes]+pool_nbr*variant_offset[variants]
+    nbr_textured_nodes=len(nodes)
+    # position in DSF pools by order of first appearance
+    order=numpy.lexsort((first_seen,idx_dsfpools))
+    del(first_seen)
+    (dsfpools,dsf_pool_start,dsf_pool_length)=numpy.unique(idx_dsfpools[order],return_index=True,return_counts=True)
+    pos_in_pools=numpy.zeros(nbr_textured_nodes,dtype=numpy.int64)
+    pos_in_pools[order]=numpy.arange(nbr_textured_nodes)-numpy.repeat(dsf_pool_start,dsf_pool_length)
+    # pool planes, sorted by pool and position 
+    (nodes,variants,terrains)=(nodes[order],variants[order],terrains[order])
+    del(order)
+    planes=numpy.zeros((nbr_textured_nodes,9),dtype=numpy.uint16)
+    planes[:,0:3]=node_icoords[nodes,0:3]
+    planes[:,3:5]=numpy.where(variant_flat[variants][:,None],32768,node_icoords[nodes,3:5])
+    textured=terrains>0
+    (s,t)=GEO.st_coord_array(node_lat[nodes[textured]],node_lon[nodes[textured]],*terrain_tex[terrains[textured]].T)
+    st=numpy.round(numpy.column_stack((s,t))*65535).astype(numpy.uint16)
+    del(s,t)
+    planes[textured,5:7]=st
+    planes[textured,7:9]=numpy.where(variant_alpha[variants[textured]][:,None],numpy.array([0,int(round(ratio_water*65535))],dtype=numpy.uint16),st)
+    del(st,nodes,variants,terrains,textured)
+    pools=[]
+    for (idx_dsfpool,start,length) in zip(dsfpools.tolist(),dsf_pool_start.tolist(),dsf_pool_length.tolist()):
+        plane=(7,9,5)[idx_dsfpool//pool_nbr]
+        pools.append((idx_dsfpool,length,pool_atom(planes[start:start+length,:plane].ravel(),plane)))
+    del(planes)
+    # in-pool triangles, grouped by terrain and by pool 
+    tris=ref_to_node[tris]
+    tri_pos=pos_in_pools[tris]
+    group_keys=tri_terrains*(3*pool_nbr)+idx_dsfpools[tris[:,0]]
+    (group_keys,group_first,tri_group)=numpy.unique(group_keys,return_index=True,return_inverse=True)
+    tri_order=numpy.argsort(tri_group,kind='stable')
+    group_end=numpy.cumsum(numpy.bincount(tri_group,minlength=len(group_keys)))
+    blocks=[]
+    for g in range(len(group_keys)):
+        (terrain_idx,idx_dsfpool)=divmod(int(group_keys[g]),3*pool_nbr)
+        block=in_pool_commands(tri_pos[tri_order[(group_end[g-1] if g else 0):group_end[g]]].astype(numpy.uint16),strips)
+        blocks.append((terrain_idx,idx_dsfpool,int(group_first[g]),block))
+    return (pos_in_pools[ref_to_node].astype(numpy.uint16),pools,blocks,nbr_textured_nodes)
+##############################################################################
+
+##############################################################################
+class MD5Writer():
+    # A write only binary file which hashes what goes through it, closing it
+    # appends the MD5 footer of DSF files without reading the file back.
+
+    def __init__(self,file_name):
+        self.f=open(file_name,'wb')
+        self.md5=hashlib.md5()
+
+    def write(self,data):
+        self.md5.update(data)
+        return self.f.write(data)
+
+    def close(self):
+        self.f.write(self.md5.digest())
+        self.f.close()
+##############################################################################
+
+##############################################################################
+def check_dsf_file(dsf_file_name,chunk_size=2**24):
+    # Checks the MD5 footer of an uncompressed DSF file. Returns True or False,
+    # or None if the file is not a raw DSF (e.g. a 7z archive). 
+    f=open(dsf_file_name,'rb')
+    if f.read(8)!=b'XPLNEDSF':
+        f.close()
+        return None
+    f.seek(0,2)
+    to_hash=f.tell()-16
+    f.seek(0)
+    m=hashlib.md5()
+    while to_hash>0:
+        data=f.read(min(chunk_size,to_hash))
+        if not data: break
+        m.update(data)
+        to_hash-=len(data)
+    footer=f.read(16)
+    f.close()
+    return m.digest()==footer
+##############################################################################
+
+##############################################################################
+dsf_super_atoms=(b'DAEH',b'NFED',b'DOEG',b'SMED')
+dsf_string_tables={b'PORP':'properties',b'TRET':'terrains',b'TJBO':'objects',b'YLOP':'polygons',b'WTEN':'networks',b'NMED':'rasters'}
+##############################################################################
+
+##############################################################################
+def dsf_atoms(data,start,end):
+    # (atom id,payload start,payload end) of the atoms in data[start:end],
+    # super atoms being replaced by their content.
+    while start<end:
+        atom_id=bytes(data[start:start+4])
+        (length,)=struct.unpack_from('<I',data,start+4)
+        if length<8 or start+length>end:
+            raise ValueError("Bad length for atom "+str(atom_id)+" at offset "+str(start))
+        if atom_id in dsf_super_atoms:
+            yield from dsf_atoms(data,start+8,start+length)
+        else:
+            yield (atom_id,start+8,start+length)
+        start+=length
+##############################################################################
+
+##############################################################################
+def decode_pool(data,start,end,dtype):
+    # The (nbr_points,nbr_planes) array of a POOL or PO32 atom. Planes can be
+    # raw, differenced, run length encoded or both.
+    (nbr_points,nbr_planes)=struct.unpack_from('<IB',data,start)
+    pos=start+5
+    size=numpy.dtype(dtype).itemsize
+    if end-pos==nbr_planes*(1+size*nbr_points):
+        # raw planes only, as written by build_dsf
+        planes=numpy.frombuffer(data,dtype=numpy.uint8,count=end-pos,offset=pos).reshape(nbr_planes,-1)
+        if not planes[:,0].any():
+            return numpy.ascontiguousarray(planes[:,1:]).view(dtype).T
+    pool=numpy.zeros((nbr_points,nbr_planes),dtype=dtype)
+    for plane in range(nbr_planes):
+        encoding=data[pos]
+        pos+=1
+        if encoding & 2:
+            runs=[]
+            count=0
+            while count<nbr_points:
+                code=data[pos]
+                pos+=1
+                if code & 128:
+                    runs.append(numpy.repeat(numpy.frombuffer(data,dtype=dtype,count=1,offset=pos),code & 127))
+                    pos+=size
+                else:
+                    runs.append(numpy.frombuffer(data,dtype=dtype,count=code,offset=pos))
+                    pos+=size*code
+                count+=code & 127
+            values=numpy.concatenate(runs) if runs else numpy.zeros(0,dtype=dtype)
+        else:
+            values=numpy.frombuffer(data,dtype=dtype,count=nbr_points,offset=pos)
+            pos+=size*nbr_points
+        if len(values)!=nbr_points:
+            raise ValueError("Bad run length encoding in pool atom at offset "+str(start))
+        pool[:,plane]=numpy.cumsum(values,dtype=dtype) if encoding & 1 else values
+    if pos!=end:
+        raise ValueError("Bad length for pool atom at offset "+str(start))
+    return pool
+##############################################################################
+
+##############################################################################
+def patch_triangles(nbr_vertices,shape):
+    # (nbr_tris,3) vertex indices of a list, strip or fan of nbr_vertices
+    if shape==0:
+        if nbr_vertices%3:
+            raise ValueError("Triangle list with "+str(nbr_vertices)+" vertices")
+        return numpy.arange(nbr_vertices).reshape(-1,3)
+    i=numpy.arange(max(0,nbr_vertices-2))
+    if shape==1:
+        return numpy.column_stack((i+(i&1),i+1-(i&1),i+2))
+    return numpy.column_stack((numpy.zeros_like(i),i+1,i+2))
+##############################################################################
+
+##############################################################################
+def gather_vertices(data,runs,width):
+    # Vertices of PATCH TRIANGLE (width 1) or PATCH TRIANGLE CROSS-POOL 
+    # (width 2) commands given as (offset of first vertex,nbr of vertices,
+    # first triangle) runs, as a (nbr_vertices,width) array and the position
+    # of their triangles among all. 
+    (counts,first_tris)=(numpy.array(column,dtype=numpy.int64) for column in list(zip(*runs))[1:])
+    if (counts%3).any():
+        raise ValueError("Triangle list with "+str(int(counts[(counts%3)>0][0]))+" vertices")
+    vertices=numpy.frombuffer(b''.join([data[offset:offset+2*width*count] for (offset,count,first_tri) in runs]),dtype='<u2').reshape(-1,width)
+    tris=counts//3
+    tri_idx=numpy.arange(int(tris.sum()))+numpy.repeat(first_tris-(numpy.cumsum(tris)-tris),tris)
+    return (vertices,tri_idx)
+##############################################################################
+
+##############################################################################
+def gather_strips(data,runs):
+    # Triangles of PATCH TRIANGLE STRIP (shape 1) or FAN (shape 2) commands 
+    # given as (offset of first vertex,nbr of vertices,first triangle,shape)
+    # runs, as a (nbr_tris,3) array of points and the position of the 
+    # triangles among all. 
+    (counts,first_tris,shapes)=(numpy.array(column,dtype=numpy.int64) for column in list(zip(*runs))[1:])
+    points=numpy.frombuffer(b''.join([data[offset:offset+2*count] for (offset,count,first_tri,shape) in runs]),dtype='<u2')
+    tris=numpy.maximum(counts-2,0)
+    run=numpy.repeat(numpy.arange(len(runs)),tris)
+    i=numpy.arange(int(tris.sum()))-numpy.repeat(numpy.cumsum(tris)-tris,tris)
+    odd=(i&1)*(shapes[run]==1)
+    vertices=numpy.column_stack((numpy.where(shapes[run]==2,0,i+odd),i+1-odd,i+2))+(numpy.cumsum(counts)-counts)[run][:,None]
+    return (points[vertices],first_tris[run]+i)
+##############################################################################
+
+##############################################################################
+def decode_commands(data,start,end):
+    # Terrain patches and their triangles in a CMDS atom, the other commands
+    # (objects, networks, polygons) are skipped. Patches are (terrain index,
+    # flags, near LOD, far LOD, first triangle, end triangle) tuples, and 
+    # triangles are given by the (pool,point) of their vertices. The most
+    # common commands, PATCH TRIANGLE, its CROSS-POOL version, and in-pool
+    # strips and fans, are only located in the loop and decoded all at once
+    # afterwards.
+    patches=[]
+    (runs,cross_runs,strip_runs,others)=([],[],[],[])
+    (pool,definition,flags,near,far)=(-1,None,1,0.0,-1.0)
+    nbr_tris=0
+    pos=start
+    while pos<end:
+        command=data[pos]
+        pos+=1
+        if 23<=command<=31 and not patches:
+            raise ValueError("Patch triangle command outside of a terrain patch at offset "+str(pos-1))
+        if command==23:
+            count=data[pos]
+            runs.append((pos+1,count,nbr_tris,pool))
+            nbr_tris+=count//3
+            pos+=1+2*count
+        elif command==24:
+            count=data[pos]
+            cross_runs.append((pos+1,count,nbr_tris))
+            nbr_tris+=count//3
+            pos+=1+4*count
+        elif command in (26,29):
+            count=data[pos]
+            strip_runs.append((pos+1,count,nbr_tris,(command-23)//3,pool))
+            nbr_tris+=max(0,count-2)
+            pos+=1+2*count
+        elif command==1:
+            (pool,)=struct.unpack_from('<H',data,pos); pos+=2
+        elif command==3:
+            definition=data[pos]; pos+=1
+        elif command==4:
+            (definition,)=struct.unpack_from('<H',data,pos); pos+=2
+        elif command==5:
+            (definition,)=struct.unpack_from('<I',data,pos); pos+=4
+        elif command in (16,17,18):
+            if command==17:
+                flags=data[pos]; pos+=1
+            elif command==18:
+                (flags,near,far)=struct.unpack_from('<Bff',data,pos); pos+=9
+            if patches: patches[-1][-1]=nbr_tris
+            patches.append([definition,flags,near,far,nbr_tris,nbr_tris])
+        elif 25<=command<=31:
+            # ranges, strips and fans 
+            (shape,kind)=divmod(command-23,3)
+            if kind==0:
+                count=data[pos]
+                points=numpy.frombuffer(data,dtype='<u2',count=count,offset=pos+1)
+                pools=numpy.full(count,pool)
+                pos+=1+2*count
+            elif kind==1:
+                count=data[pos]
+                pairs=numpy.frombuffer(data,dtype='<u2',count=2*count,offset=pos+1).reshape(-1,2)
+                (pools,points)=(pairs[:,0],pairs[:,1])
+                pos+=1+4*count
+            else:
+                (first,last)=struct.unpack_from('<HH',data,pos)
+                points=numpy.arange(first,last)
+                pools=numpy.full(len(points),pool)
+                pos+=4
+            vertices=patch_triangles(len(points),shape)
+            others.append((pools[vertices],points[vertices],nbr_tris,kind==1))
+            nbr_tris+=len(vertices)
+        elif command in (2,8,10,13):
+            pos+=(4,4,4,6)[(2,8,10,13).index(command)]
+        elif command in (6,7):
+            pos+=command-5
+        elif command in (9,11):
+            pos+=1+(command-7)*data[pos]
+        elif command==12:
+            pos+=3+2*data[pos+2]
+        elif command==14:
+            windings=data[pos+2]
+            pos+=3
+            for _ in range(windings):
+                pos+=1+2*data[pos]
+        elif command==15:
+            pos+=3+2*(data[pos+2]+1)
+        elif command==32:
+            pos+=1+data[pos]
+        elif command==33:
+            pos+=2+struct.unpack_from('<H',data,pos)[0]
+        elif command==34:
+            pos+=4+struct.unpack_from('<I',data,pos)[0]
+        else:
+            raise ValueError("Unknown command "+str(command)+" at offset "+str(pos-1))
+    if pos!=end:
+        raise ValueError("Truncated command at the end of the CMDS atom")
+    if patches: patches[-1][-1]=nbr_tris
+    tri_pools=numpy.zeros((nbr_tris,3),dtype=numpy.int64)
+    tri_points=numpy.zeros((nbr_tris,3),dtype=numpy.int64)
+    tri_cross_pool=numpy.zeros(nbr_tris,dtype=bool)
+    if runs:
+        (points,tri_idx)=gather_vertices(data,[run[:3] for run in runs],1)
+        tri_points[tri_idx]=points.reshape(-1,3)
+        counts=numpy.array([run[1] for run in runs])
+        tri_pools[tri_idx]=numpy.repeat(numpy.array([run[3] for run in runs]),counts).reshape(-1,3)
+    if cross_runs:
+        (pairs,tri_idx)=gather_vertices(data,cross_runs,2)
+        tri_pools[tri_idx]=pairs[:,0].reshape(-1,3)
+        tri_points[tri_idx]=pairs[:,1].reshape(-1,3)
+        tri_cross_pool[tri_idx]=True
+    if strip_runs:
+        (points,tri_idx)=gather_strips(data,[run[:4] for run in strip_runs])
+        tri_points[tri_idx]=points
+        tri_pools[tri_idx]=numpy.repeat(numpy.array([run[4] for run in strip_runs]),numpy.maximum(0,numpy.array([run[1] for run in strip_runs])-2))[:,None]
+    for (pools,points,first_tri,cross_pool) in others:
+        tri_pools[first_tri:first_tri+len(pools)]=pools
+        tri_points[first_tri:first_tri+len(points)]=points
+        tri_cross_pool[first_tri:first_tri+len(pools)]=cross_pool
+    return ([tuple(patch) for patch in patches],tri_pools,tri_points,tri_cross_pool)
+##############################################################################
+
+##############################################################################
+def decode_dsf(data):
+    # A dict with the string tables, the pools (as uint16 or uint32 arrays),
+    # their scalings (a (scale,offset) row per plane) and the terrain patches
+    # of DSF data (without MD5 footer).
+    if bytes(data[:8])!=b'XPLNEDSF':
+        raise ValueError("Not a DSF file")
+    dsf={'version':struct.unpack_from('<I',data,8)[0],'pools':[],'scalings':[],'pools32':[],'scalings32':[],\
+         'patches':[],'tri_pools':numpy.zeros((0,3),dtype=numpy.int64),'tri_points':numpy.zeros((0,3),dtype=numpy.int64),\
+         'tri_cross_pool':numpy.zeros(0,dtype=bool)}
+    for table in dsf_string_tables.values():
+        dsf[table]=[]
+    for (atom_id,start,end) in dsf_atoms(data,12,len(data)):
+        if atom_id in dsf_string_tables:
+            dsf[dsf_string_tables[atom_id]]=[string.decode('utf-8','replace') for string in bytes(data[start:end]).split(b'\0')[:-1]]
+        elif atom_id==b'LOOP':
+            dsf['pools'].append(decode_pool(data,start,end,'<u2'))
+        elif atom_id==b'23OP':
+            dsf['pools32'].append(decode_pool(data,start,end,'<u4'))
+        elif atom_id in (b'LACS',b'23CS'):
+            dsf['scalings' if atom_id==b'LACS' else 'scalings32'].append(numpy.frombuffer(data,dtype='<f4',count=(end-start)//4,offset=start).reshape(-1,2))
+        elif atom_id==b'SDMC':
+            (dsf['patches'],dsf['tri_pools'],dsf['tri_points'],dsf['tri_cross_pool'])=decode_commands(data,start,end)
+    dsf['properties']=list(zip(dsf['properties'][0::2],dsf['properties'][1::2]))
+    return dsf
+##############################################################################
+
+##############################################################################
+def read_dsf(dsf_file_name):
+    # The decoded content of an uncompressed DSF file, or None if the file is
+    # not a raw DSF (e.g. a 7z archive). Also records how long it took.
+    timer=time.time()
+    with open(dsf_file_name,'rb') as f:
+        data=f.read()
+    if data[:8]!=b'XPLNEDSF':
+        return None
+    dsf=decode_dsf(memoryview(data)[:-16])
+    dsf['size']=len(data)
+    dsf['decode_time']=time.time()-timer
+    return dsf
+##############################################################################
+
+##############################################################################
+def validate_dsf(dsf):
+    # Consistency checks of a decoded DSF, returns a list of error messages.
+    errors=[]
+    pools=dsf['pools']
+    if len(pools)!=len(dsf['scalings']):
+        errors.append(str(len(pools))+" pools but "+str(len(dsf['scalings']))+" scalings.")
+    for (k,(pool,scaling)) in enumerate(zip(pools,dsf['scalings'])):
+        if pool.shape[1]!=len(scaling):
+            errors.append("Pool "+str(k)+" has "+str(pool.shape[1])+" planes but "+str(len(scaling))+" scalings.")
+    # pool bounds, points are expected within the tile
+    properties=dict(dsf['properties'])
+    try:
+        (west,east,south,north)=(float(properties['sim/'+side]) for side in ('west','east','south','north'))
+    except Exception:
+        errors.append("Missing or bad tile boundaries in the properties.")
+    else:
+        for (k,(pool,scaling)) in enumerate(zip(pools,dsf['scalings'])):
+            if len(pool)==0 or pool.shape[1]<2 or len(scaling)<2: continue
+            (raw_min,raw_max)=(pool[:,:2].min(axis=0)/65535,pool[:,:2].max(axis=0)/65535)
+            (low,high)=(scaling[:2,1]+raw_min*scaling[:2,0],scaling[:2,1]+raw_max*scaling[:2,0])
+            if low[0]<west-1e-6 or high[0]>east+1e-6 or low[1]<south-1e-6 or high[1]>north+1e-6:
+                errors.append("Pool "+str(k)+" spans lon "+str(low[0])+" to "+str(high[0])+", lat "+str(low[1])+" to "+str(high[1])+", outside of the tile.")
+    # triangle references
+    (tri_pools,tri_points,cross_pool)=(dsf['tri_pools'],dsf['tri_points'],dsf['tri_cross_pool'])
+    pool_lengths=numpy.array([len(pool) for pool in pools]+[0],dtype=numpy.int64)
+    bad_pools=(tri_pools<0)|(tri_pools>=len(pools))
+    bad_points=tri_points>=pool_lengths[numpy.where(bad_pools,len(pools),tri_pools)]
+    for (label,tris) in (("In-pool",~cross_pool),("Cross-pool",cross_pool)):
+        if bad_pools[tris].any():
+            errors.append(label+" triangles : "+str(int(bad_pools[tris].sum()))+" vertices refer to a missing pool.")
+        if (bad_points&~bad_pools)[tris].any():
+            errors.append(label+" triangles : "+str(int((bad_points&~bad_pools)[tris].sum()))+" vertices refer to a point beyond the end of their pool.")
+    # terrain indices
+    bad_terrains=sorted(set(patch[0] for patch in dsf['patches'] if patch[0] is None or patch[0]>=len(dsf['terrains'])),key=str)
+    if bad_terrains:
+        errors.append("Terrain patches refer to undefined terrain(s) "+", ".join(str(t) for t in bad_terrains)+" ("+str(len(dsf['terrains']))+" terrains defined).")
+    return errors
 ##############################################################################
 
 ##############################################################################
 def build_dsf(tile,download_queue):
+    old_manifest=read_manifest(tile)
+    manifest=build_manifest(tile)
+    report_changes(old_manifest,manifest)
     dico_customzl=zone_list_to_ortho_dico(tile)
     dsf_file_name=os.path.join(tile.build_dir,'Earth nav data',FNAMES.long_latlon(tile.lat,tile.lon)+'.dsf')
-    UI.vprint(1,"-> Computing the pool quadtree")
     if tile.add_low_res_sea_ovl or tile.use_masks_for_inland:
        quad_capacity=quad_capacity_low
     else:
        quad_capacity=quad_capacity_high
-    pool_quadtree=QuadTree(quad_init_level,quad_capacity)
-    f_mesh=open(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon),"r")
-    mesh_version=float(f_mesh.readline().strip().split()[-1])
-    for i in range(3):
-        f_mesh.readline()
-    nbr_nodes=int(f_mesh.readline())
+    (mesh_version,vertices,normals,triangles,tri_attributes)=MESH.load_mesh(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))
+    nbr_nodes=len(vertices)
     node_coords=numpy.zeros(5*nbr_nodes,'float')
-    for i in range(nbr_nodes):
-        node_coords[5*i:5*i+3]=[float(x) for x in f_mesh.readline().split()[:3]]
-        pool_quadtree.insert(float2qquad(node_coords[5*i]-tile.lon),float2qquad(node_coords[5*i+1]-tile.lat),quad_init_level)
-    pool_quadtree.clean()
-    pool_quadtree.statistics()
-    # 
-    pool_nbr=len(pool_quadtree)
-    idx_node_to_idx_pool={}
-    idx_pool=0
-    key_to_idx_pool={}
-    for key in pool_quadtree:
-        key_to_idx_pool[key]=idx_pool
-        for idx_node in pool_quadtree[key]['idx_nodes']:
-            idx_node_to_idx_pool[idx_node]=idx_pool
-        idx_pool+=1
-    #
-    for i in range(3):
-        f_mesh.readline()
-    for i in range(nbr_nodes):
-        node_coords[5*i+3:5*i+5]=[float(x) for x in f_mesh.readline().split()[:2]]
-    # altitutes are encoded in .mesh files with a 100000 scaling factor 
-    node_coords[2::5]*=100000
+    node_coords[0::5]=vertices[:,0]
+    node_coords[1::5]=vertices[:,1]
+    node_coords[2::5]=vertices[:,2]
+    node_coords[3::5]=normals[:,0]
+    node_coords[4::5]=normals[:,1]
+    del(vertices,normals)
+    (qx,qy)=(quad_coords(node_coords[0::5]-tile.lon),quad_coords(node_coords[1::5]-tile.lat))
     # pools params and nodes uint16 coordinates in pools 
     pool_param={}
     node_icoords = numpy.zeros(5*nbr_nodes,'uint16')
-    for key in pool_quadtree:
-        level=len(key[0])
-        plist=sorted(list(pool_quadtree[key]['idx_nodes']))
-        node_icoords[[5*idx_node for idx_node in plist]]=[int(pool_quadtree.nodes[idx_node][0][level:level+16],2) for idx_node in plist]
-        node_icoords[[5*idx_node+1 for idx_node in plist]]=[int(pool_quadtree.nodes[idx_node][1][level:level+16],2) for idx_node in plist]
-        altitudes=numpy.array([node_coords[5*idx_node+2] for idx_node in plist])
-        altmin=floor(altitudes.min())
-        altmax=ceil(altitudes.max())
+    if tile.hilbert_pools:
+        UI.vprint(1,"-> Computing the Hilbert curve pools")
+        (node_pool,pool_boxes)=hilbert_pools(qx,qy,quad_init_level,quad_capacity)
+        pool_nbr=len(pool_boxes)
+        UI.vprint(1,"     Number of pools:",pool_nbr,", Average pool size:",nbr_nodes/pool_nbr)
+        node_icoords[0::5]=box_icoords(qx,pool_boxes[node_pool,0],pool_boxes[node_pool,1])
+        node_icoords[1::5]=box_icoords(qy,pool_boxes[node_pool,2],pool_boxes[node_pool,3])
+        # (scal_x,lon_min,scal_y,lat_min) of each pool
+        pool_frames=[((x1-x0)/2**24,tile.lon+x0/2**24,(y1-y0)/2**24,tile.lat+y0/2**24) for (x0,x1,y0,y1) in pool_boxes.tolist()]
+        del(pool_boxes)
+    else:
+        UI.vprint(1,"-> Computing the pool quadtree")
+        (node_pool,pool_keys)=pool_quadtree(qx,qy,quad_init_level,quad_capacity)
+        pool_statistics(node_pool,pool_keys)
+        pool_nbr=len(pool_keys)
+        levels=numpy.array([key[0] for key in pool_keys])[node_pool]
+        node_icoords[0::5]=pool_icoords(qx,levels)
+        node_icoords[1::5]=pool_icoords(qy,levels)
+        del(levels)
+        pool_frames=[(2**(-level),tile.lon+key_x*2**(-level),2**(-level),tile.lat+key_y*2**(-level)) for (level,key_x,key_y) in pool_keys]
+    del(qx,qy)
+    # altitutes are encoded in .mesh files with a 100000 scaling factor 
+    node_coords[2::5]*=100000
+    # nodes sharing the same snapped position within the same pool 
+    node_snap=(node_pool<<32)|(node_icoords[0::5].astype(numpy.int64)<<16)|node_icoords[1::5]
+    pool_order=numpy.argsort(node_pool,kind='stable')
+    pool_starts=numpy.searchsorted(node_pool[pool_order],numpy.arange(pool_nbr))
+    pool_altmin=numpy.floor(numpy.minimum.reduceat(node_coords[2::5][pool_order],pool_starts))
+    pool_altmax=numpy.ceil(numpy.maximum.reduceat(node_coords[2::5][pool_order],pool_starts))
+    pool_inv_stp=numpy.zeros(pool_nbr)
+    for idx_pool in range(pool_nbr):
+        altmin=int(pool_altmin[idx_pool])
+        altmax=int(pool_altmax[idx_pool])
         if altmax-altmin < 770:
             scale_z=771   # 65535=771*85
             inv_stp=85
@@ -283,329 +1150,330 @@ def build_dsf(tile,download_queue):
         else:
             scale_z=13107 # 65535=13107*5
             inv_stp=5
-        scal_x=scal_y=2**(-level)    
-        node_icoords[[5*idx_node+2 for idx_node in plist]]=numpy.round((altitudes-altmin)*inv_stp)
-        pool_param[key_to_idx_pool[key]]=(scal_x,tile.lon+int(key[0],2)*scal_x,scal_y,tile.lat+int(key[1],2)*scal_y,scale_z,altmin,2,-1,2,-1,1,0,1,0,1,0,1,0)
+        pool_inv_stp[idx_pool]=inv_stp
+        pool_param[idx_pool]=(*pool_frames[idx_pool],scale_z,altmin,2,-1,2,-1,1,0,1,0,1,0,1,0)
+    node_icoords[2::5]=numpy.round((node_coords[2::5]-pool_altmin[node_pool])*pool_inv_stp[node_pool])
+    del(pool_order,pool_starts,pool_altmin,pool_altmax,pool_inv_stp)
     node_icoords[3::5]=numpy.round((1+tile.normal_map_strength*node_coords[3::5])/2*65535)
     node_icoords[4::5]=numpy.round((1-tile.normal_map_strength*node_coords[4::5])/2*65535)
-    node_icoords=array.array('H',node_icoords)
     
     ##########################
     dico_terrains={}
     overlay_terrains=set()
     treated_textures=set()
-    skipped_terrains_for_masking=set()
     dsf_pools={}
     # we need more pools for textured nodes than for nodes,
     # one for each number of coordinates [7 (land or experimental water), 9 (water masks) and 5 (X-Plane water)]
     dsf_pool_nbr=3*pool_nbr
-    for idx_dsfpool in range(dsf_pool_nbr):
-        dsf_pools[idx_dsfpool]=array.array('H')
-    dsf_pool_length=numpy.zeros(dsf_pool_nbr,'int')
     dsf_pool_plane=7*numpy.ones(dsf_pool_nbr,'int')
     dsf_pool_plane[pool_nbr:2*pool_nbr]=9
     dsf_pool_plane[2*pool_nbr:3*pool_nbr]=5
-    textured_nodes={}
-    len_textured_nodes=0
     textured_tris={}
-    total_cross_pool=0
     ##########################
         
     bPROP=bTERT=bOBJT=bPOLY=bNETW=bDEMN=bGEOD=bDEMS=bCMDS=b'' 
     nbr_dsfpools_yet_in=0
     dico_terrains={'terrain_Water':0}
     bTERT=bytes("terrain_Water\0",'ascii')
-    textured_tris[0]=defaultdict(lambda: array.array('H'))
+    terrain_names=['terrain_Water']
+    textured_tris[0]={}
     
     # Next, we go through the Triangle section of the mesh file and build DSF 
     # mesh points (these take into accound texture as well), point pools, etc. 
     has_water = 7 if mesh_version>=1.3 else 3
     
-    for i in range(0,2): # skip 2 lines
-        f_mesh.readline()
-    nbr_tris=int(f_mesh.readline()) # read nbr of tris
-    step=nbr_tris//100+1
+    # Triangles of mixed types are set for water in priority (to avoid water cut by solid roads), and others are set for type=0 
+    tri_types=tri_attributes & has_water
+    tri_types=numpy.where(tri_types==0,0,numpy.where((tri_types>1) | bool(tile.use_masks_for_inland),2,1))
+    del(tri_attributes)
     
-    tri_list=[]
-    for i in range(nbr_tris):
-        # look for the texture that will possibly cover the tri
-        (n1,n2,n3,tri_type)=[int(x)-1 for x in f_mesh.readline().split()[:4]]
-        tri_type+=1
-        # Triangles of mixed types are set for water in priority (to avoid water cut by solid roads), and others are set for type=0 
-        tri_type = (tri_type & has_water) and (2*((tri_type & has_water)>1 or tile.use_masks_for_inland) or 1)
-        tri_list.append((n1,n2,n3,tri_type))
-    f_mesh.close()
-    
-    i=0
-    # First sea water (or equivalent) tris 
-    for tri in [tri for tri in tri_list if tri[3]==2]:
-        (n1,n2,n3,tri_type)=tri
-        if i%step==0:
-            UI.progress_bar(1,int(i/step*0.9))
-            if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
-        i+=1   
-        bary_lon=(node_coords[5*n1]+node_coords[5*n2]+node_coords[5*n3])/3
-        bary_lat=(node_coords[5*n1+1]+node_coords[5*n2+1]+node_coords[5*n3+1])/3
-        texture_attributes=dico_customzl[GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mesh_zl)]
-        # The entries for the terrain and texture main dictionnaries
-        terrain_attributes=(texture_attributes,tri_type)
-        # Do we need to build new terrain file(s) ?       
-        if terrain_attributes in dico_terrains: 
-            terrain_idx=dico_terrains[terrain_attributes]
+    ##########################
+    # Textures and terrains of all triangles, computed beforehand from their
+    # barycenters. Terrain indices, terrain files and texture downloads follow
+    # the order in which the triangle by triangle encoding meets them.
+    timer=time.time()
+    sea_ovl=(tile.experimental_water & 2) or tile.add_low_res_sea_ovl
+    sea_tris=numpy.nonzero(tri_types==2)[0]
+    land_tris=numpy.nonzero(tri_types<2)[0]
+    (node_lon,node_lat)=(node_coords[0::5],node_coords[1::5])
+    bary_lon=(node_lon[triangles[:,0]]+node_lon[triangles[:,1]]+node_lon[triangles[:,2]])/3
+    bary_lat=(node_lat[triangles[:,0]]+node_lat[triangles[:,1]]+node_lat[triangles[:,2]])/3
+    textures=[]
+    tri_textures=texture_indices(*GEO.wgs84_to_orthogrid_array(bary_lat,bary_lon,tile.mesh_zl),lambda key: dico_customzl[key],textures)
+    sea_keys=3*tri_textures[sea_tris]+2
+    land_keys=3*tri_textures[land_tris]+tri_types[land_tris]
+    refreshed=refresh_textures(tile,textures,old_manifest,manifest)
+    # Textures of land triangles only are needed anyway, they are queued at
+    # once. Others have to wait for the masks. 
+    land_textures=numpy.setdiff1d(tri_textures[land_tris],tri_textures[sea_tris]).tolist()
+    queued_textures=set(texture_attributes for texture_attributes in (textures[idx] for idx in land_textures) if texture_is_missing(tile,texture_attributes))
+    for texture_attributes in space_filling_order(sorted(queued_textures)):
+        download_queue.put(texture_attributes)
+    UI.vprint(2,"     Textures queued for download before masks : "+str(len(queued_textures)))
+    # Sea terrains only exist when there is a mask to apply 
+    masked_keys=[]
+    for key in numpy.unique(sea_keys).tolist():
+        if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
+        texture_attributes=textures[key//3]
+        mask_im=MASK.needs_mask(tile,*texture_attributes)
+        if mask_im:
+            UI.vprint(2,"      Use of an alpha mask.")
+            masked_keys.append(key)
+            mask_im.save(os.path.join(tile.build_dir,"textures",FNAMES.mask_file(*texture_attributes)))
+            manifest['masks'][FNAMES.mask_file(*texture_attributes)]=md5_hex(mask_im.tobytes())
         else:
-            needs_new_terrain=False
-            # if not we need to check with masks values
-            if terrain_attributes not in skipped_terrains_for_masking:
-                mask_im=MASK.needs_mask(tile,*texture_attributes)
-                if mask_im:
-                    UI.vprint(2,"      Use of an alpha mask.")
-                    needs_new_terrain=True
-                    mask_im.save(os.path.join(tile.build_dir,"textures",FNAMES.mask_file(*texture_attributes)))
-                else:
-                    skipped_terrains_for_masking.add(terrain_attributes)
-                    # clean up potential old masks in the tile dir   
-                    try: os.remove(os.path.join(tile.build_dir,"textures",FNAMES.mask_file(*texture_attributes)))
-                    except: pass
-            if needs_new_terrain:
-                terrain_idx=len(dico_terrains)
-                textured_tris[terrain_idx]=defaultdict(lambda: array.array('H'))
-                dico_terrains[terrain_attributes]=terrain_idx
-                is_overlay=tri_type==2 or (tri_type==1 and not (tile.experimental_water & 1))
-                if is_overlay: overlay_terrains.add(terrain_idx)
-                texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
-                # do we need to download a new texture ?       
-                if texture_attributes not in treated_textures:
-                    if (not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name))) or (tile.imprint_masks_to_dds):
-                        if  'g2xpl' not in texture_attributes[3]:
-                            download_queue.put(texture_attributes)
-                        elif os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name.replace('dds','partial.dds'))):
-                            texture_file_name=texture_file_name.replace('dds','partial.dds')
-                            UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
-                        else:
-                            UI.vprint(1,"   Missing a required texture, conversion from g2xpl requires texture download.")
-                            download_queue.put(texture_attributes)
-                    else:
-                        UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
-                    treated_textures.add(texture_attributes)
-                terrain_file_name=create_terrain_file(tile,texture_file_name,*texture_attributes,tri_type,is_overlay)
-                bTERT+=bytes('terrain/'+terrain_file_name+'\0','ascii') 
-            else:
-                terrain_idx=0
-        # We put the tri in the right terrain   
-        # First the ones associated to the dico_customzl 
-        if terrain_idx:
-            tri_p=array.array('H')
-            for n in (n1,n3,n2):     # beware of ordering for orientation ! 
-                idx_pool=idx_node_to_idx_pool[n]
-                node_hash=(idx_pool,*node_icoords[5*n:5*n+2],terrain_idx)
-                if node_hash in textured_nodes:
-                    (idx_dsfpool,pos_in_pool)=textured_nodes[node_hash]
-                else:
-                    (s,t)=GEO.st_coord(node_coords[5*n+1],node_coords[5*n],*texture_attributes)
-                    # BEWARE : normal coordinates are pointing (EAST,SOUTH) in X-Plane, not (EAST,NORTH) ! (cfr DSF specs), so v -> -v
-                    if not tile.imprint_masks_to_dds: # border_tex
-                        idx_dsfpool=idx_pool+pool_nbr
-                        # border_tex masks with original normal
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+5])
-                        dsf_pools[idx_dsfpool].extend((int(round(s*65535)),int(round(t*65535)),int(round(s*65535)),int(round(t*65535))))
-                    else: # dtx5 dds with mask included
-                        idx_dsfpool=idx_pool
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+5])
-                        dsf_pools[idx_dsfpool].extend((int(round(s*65535)),int(round(t*65535))))
-                    len_textured_nodes+=1
-                    pos_in_pool=dsf_pool_length[idx_dsfpool]
-                    textured_nodes[node_hash]=(idx_dsfpool,pos_in_pool)
-                    dsf_pool_length[idx_dsfpool]+=1
-                tri_p.extend((idx_dsfpool,pos_in_pool))
-            # some triangles could be reduced to nothing by the pool snapping,
-            # we skip thme (possible killer to X-Plane's drapping of roads ?)    
-            if tri_p[:2]==tri_p[2:4] or tri_p[2:4]==tri_p[4:] or tri_p[4:]==tri_p[:2]:
-                continue
-            if tri_p[0]==tri_p[2]==tri_p[4]:
-                textured_tris[terrain_idx][tri_p[0]].extend((tri_p[1],tri_p[3],tri_p[5]))    
-            else:
-                total_cross_pool+=1
-                textured_tris[terrain_idx]['cross-pool'].extend(tri_p)
-        # I. X-Plane water
-        if not (tile.experimental_water & tri_type) :   
-            tri_p=array.array('H')
-            for n in (n1,n3,n2):     # beware of ordering for orientation ! 
-                node_hash=(n,0)
-                if node_hash in textured_nodes:
-                    (idx_dsfpool,pos_in_pool)=textured_nodes[node_hash]
-                else:
-                    idx_dsfpool=idx_node_to_idx_pool[n]+2*pool_nbr
-                    len_textured_nodes+=1
-                    pos_in_pool=dsf_pool_length[idx_dsfpool]
-                    textured_nodes[node_hash]=[idx_dsfpool,pos_in_pool]
-                    #in some cases we might prefer to use normal shading for some sea triangles too (albedo continuity with elevation derived masks) 
-                    #dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+5])
-                    dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                    dsf_pools[idx_dsfpool].extend((32768,32768))
-                    dsf_pool_length[idx_dsfpool]+=1
-                tri_p.extend((idx_dsfpool,pos_in_pool))
-            if tri_p[0]==tri_p[2]==tri_p[4]:
-                textured_tris[0][tri_p[0]].extend((tri_p[1],tri_p[3],tri_p[5]))    
-            else:
-                total_cross_pool+=1
-                textured_tris[0]['cross-pool'].extend(tri_p)
-        # II. Low resolution texture with global coverage        
-        if ((tile.experimental_water & 2) or tile.add_low_res_sea_ovl): # experimental water over sea
-            #sea_zl=int(IMG.providers_dict['SEA']['max_zl'])
-            sea_zl=experimental_water_zl
-            (til_x_left,til_y_top)=GEO.wgs84_to_orthogrid(bary_lat,bary_lon,sea_zl)
-            texture_attributes=(til_x_left,til_y_top,sea_zl,'SEA')
-            terrain_attributes=(texture_attributes,tri_type)
-            if terrain_attributes in dico_terrains:
-                terrain_idx=dico_terrains[terrain_attributes]
-            else:
-                terrain_idx=len(dico_terrains)
-                is_overlay= not(tile.experimental_water & 2) and 'ratio_water'
-                if is_overlay: overlay_terrains.add(terrain_idx)
-                textured_tris[terrain_idx]=defaultdict(lambda: array.array('H'))
-                dico_terrains[terrain_attributes]=terrain_idx
-                texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
-                # do we need to download a new texture ?       
-                if texture_attributes not in treated_textures:
-                    if not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name)):
-                        download_queue.put(texture_attributes)
-                    else:
-                        UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
-                    treated_textures.add(texture_attributes)
-                terrain_file_name=create_terrain_file(tile,texture_file_name,*texture_attributes,tri_type,is_overlay)
-                bTERT+=bytes('terrain/'+terrain_file_name+'\0','ascii') 
-            # We put the tri in the right terrain   
-            tri_p=array.array('H')
-            for n in (n1,n3,n2):     # beware of ordering for orientation ! 
-                idx_pool=idx_node_to_idx_pool[n]
-                node_hash=(idx_pool,*node_icoords[5*n:5*n+2],terrain_idx)
-                if node_hash in textured_nodes:
-                    (idx_dsfpool,pos_in_pool)=textured_nodes[node_hash]
+            # clean up potential old masks in the tile dir   
+            try: os.remove(os.path.join(tile.build_dir,"textures",FNAMES.mask_file(*texture_attributes)))
+            except: pass
+    sea_keys[~numpy.isin(sea_keys,masked_keys)]=-1
+    if sea_ovl:
+        sea_ovl_keys=3*texture_indices(*GEO.wgs84_to_orthogrid_array(bary_lat[sea_tris],bary_lon[sea_tris],experimental_water_zl),\
+                lambda key: (*key,experimental_water_zl,'SEA'),textures)+2
+        refreshed+=refresh_textures(tile,textures,old_manifest,manifest)
+        # the low resolution overlay of a sea triangle is skipped when its 
+        # textured version is reduced to nothing by the pool snapping
+        snapped=node_snap[triangles[sea_tris]]
+        degenerate=(snapped[:,0]==snapped[:,1])|(snapped[:,1]==snapped[:,2])|(snapped[:,2]==snapped[:,0])
+        del(snapped)
+        sea_ovl_keys[(sea_keys!=-1) & degenerate]=-1
+        del(degenerate)
+        terrain_stream=numpy.concatenate((numpy.column_stack((sea_keys,sea_ovl_keys)).ravel(),land_keys))
+    else:
+        terrain_stream=numpy.concatenate((sea_keys,land_keys))
+    del(bary_lon,bary_lat,tri_textures)
+    (keys,first_seen)=numpy.unique(terrain_stream,return_index=True)
+    del(terrain_stream)
+    key_terrain=numpy.zeros(3*len(textures),dtype=numpy.int64)
+    terrain_textures=[None]
+    downloads=[]
+    terrain_templates={}
+    terrain_files=[]
+    terrain_assets=set()
+    for (key,position) in sorted(zip(keys.tolist(),first_seen.tolist()),key=lambda x:x[1]):
+        if key==-1: continue
+        texture_attributes=textures[key//3]
+        tri_type=key%3
+        terrain_idx=len(dico_terrains)
+        textured_tris[terrain_idx]={}
+        dico_terrains[(texture_attributes,tri_type)]=terrain_idx
+        key_terrain[key]=terrain_idx
+        terrain_textures.append(texture_attributes)
+        texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
+        if sea_ovl and position<2*len(sea_tris) and position%2:
+            # II. Low resolution texture with global coverage        
+            is_overlay= not(tile.experimental_water & 2) and 'ratio_water'
+            if is_overlay: overlay_terrains.add(terrain_idx)
+            # do we need to download a new texture ?       
+            if texture_attributes not in treated_textures:
+                if not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name)):
+                    downloads.append(texture_attributes)
                 else:
-                    (s,t)=GEO.st_coord(node_coords[5*n+1],node_coords[5*n],*texture_attributes)
-                    # BEWARE : normal coordinates are pointing (EAST,SOUTH) in X-Plane, not (EAST,NORTH) ! (cfr DSF specs), so v -> -v
-                    if (tile.experimental_water & 2):
-                        idx_dsfpool=idx_pool
-                        # normal map texture over flat shading - no overlay
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                        dsf_pools[idx_dsfpool].extend((32768,32768,int(round(s*65535)),int(round(t*65535))))    
-                    else:
-                        idx_dsfpool=idx_pool+pool_nbr
-                        # constant alpha overlay with flat shading
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                        dsf_pools[idx_dsfpool].extend((32768,32768,int(round(s*65535)),int(round(t*65535)),0,int(round(tile.ratio_water*65535))))
-                    len_textured_nodes+=1
-                    pos_in_pool=dsf_pool_length[idx_dsfpool]
-                    textured_nodes[node_hash]=(idx_dsfpool,pos_in_pool)
-                    dsf_pool_length[idx_dsfpool]+=1
-                tri_p.extend((idx_dsfpool,pos_in_pool))
-            if tri_p[0]==tri_p[2]==tri_p[4]:
-                textured_tris[terrain_idx][tri_p[0]].extend((tri_p[1],tri_p[3],tri_p[5]))    
-            else:
-                total_cross_pool+=1
-                textured_tris[terrain_idx]['cross-pool'].extend(tri_p)
-    # Second land and inland water tris 
-    for tri in [tri for tri in tri_list if tri[3]<2]:
-        (n1,n2,n3,tri_type)=tri
-        if i%step==0:
-            UI.progress_bar(1,int(i/step*0.9))
-            if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
-        i+=1   
-        bary_lon=(node_coords[5*n1]+node_coords[5*n2]+node_coords[5*n3])/3
-        bary_lat=(node_coords[5*n1+1]+node_coords[5*n2+1]+node_coords[5*n3+1])/3
-        texture_attributes=dico_customzl[GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mesh_zl)]
-        # The entries for the terrain and texture main dictionnaries
-        terrain_attributes=(texture_attributes,tri_type)
-        # Do we need to build new terrain file(s) ?       
-        if terrain_attributes in dico_terrains: 
-            terrain_idx=dico_terrains[terrain_attributes]
+                    UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
+                treated_textures.add(texture_attributes)
         else:
-            terrain_idx=len(dico_terrains)
-            textured_tris[terrain_idx]=defaultdict(lambda: array.array('H'))
-            dico_terrains[terrain_attributes]=terrain_idx
-            is_overlay=(tri_type==1 and not (tile.experimental_water & 1))
+            is_overlay=tri_type==2 or (tri_type==1 and not (tile.experimental_water & 1))
             if is_overlay: overlay_terrains.add(terrain_idx)
-            texture_file_name=FNAMES.dds_file_name_from_attributes(*texture_attributes)
             # do we need to download a new texture ?       
             if texture_attributes not in treated_textures:
-                if (not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name))):
+                # masks imprinted in textures require a new conversion when they change
+                mask_file_name=FNAMES.mask_file(*texture_attributes)
+                mask_changed=not old_manifest or old_manifest['masks'].get(mask_file_name)!=manifest['masks'].get(mask_file_name)
+                if (not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name))) or (tri_type==2 and tile.imprint_masks_to_dds and mask_changed):
                     if  'g2xpl' not in texture_attributes[3]:
-                        download_queue.put(texture_attributes)
+                        downloads.append(texture_attributes)
                     elif os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name.replace('dds','partial.dds'))):
                         texture_file_name=texture_file_name.replace('dds','partial.dds')
                         UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
                     else:
                         UI.vprint(1,"   Missing a required texture, conversion from g2xpl requires texture download.")
-                        download_queue.put(texture_attributes)
+                        downloads.append(texture_attributes)
                 else:
                     UI.vprint(1,"   Texture file "+texture_file_name+" already present.")
                 treated_textures.add(texture_attributes)
-            terrain_file_name=create_terrain_file(tile,texture_file_name,*texture_attributes,tri_type,is_overlay)
-            bTERT+=bytes('terrain/'+terrain_file_name+'\0','ascii') 
-        # We put the tri in the right terrain   
-        # First the ones associated to the dico_customzl 
-        tri_p=array.array('H')
-        for n in (n1,n3,n2):     # beware of ordering for orientation ! 
-            idx_pool=idx_node_to_idx_pool[n]
-            node_hash=(idx_pool,*node_icoords[5*n:5*n+2],terrain_idx)
-            if node_hash in textured_nodes:
-                (idx_dsfpool,pos_in_pool)=textured_nodes[node_hash]
-            else:
-                (s,t)=GEO.st_coord(node_coords[5*n+1],node_coords[5*n],*texture_attributes)
-                # BEWARE : normal coordinates are pointing (EAST,SOUTH) in X-Plane, not (EAST,NORTH) ! (cfr DSF specs), so v -> -v
-                if not tri_type: # land
-                    idx_dsfpool=idx_pool
-                    dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+5])
-                    dsf_pools[idx_dsfpool].extend((int(round(s*65535)),int(round(t*65535))))
-                else: # inland water
-                    if not (tile.experimental_water & 1):
-                        idx_dsfpool=idx_pool+pool_nbr
-                        # constant alpha overlay with flat shading
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                        dsf_pools[idx_dsfpool].extend((32768,32768,int(round(s*65535)),int(round(t*65535)),0,int(round(tile.ratio_water*65535))))
-                    else:
-                        idx_dsfpool=idx_pool
-                        # normal map texture over flat shading - no overlay
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                        dsf_pools[idx_dsfpool].extend((32768,32768,int(round(s*65535)),int(round(t*65535))))
-                len_textured_nodes+=1
-                pos_in_pool=dsf_pool_length[idx_dsfpool]
-                textured_nodes[node_hash]=(idx_dsfpool,pos_in_pool)
-                dsf_pool_length[idx_dsfpool]+=1
-            tri_p.extend((idx_dsfpool,pos_in_pool))
-        # some triangles could be reduced to nothing by the pool snapping,
-        # we skip thme (possible killer to X-Plane's drapping of roads ?)    
-        if tri_p[:2]==tri_p[2:4] or tri_p[2:4]==tri_p[4:] or tri_p[4:]==tri_p[:2]:
-            continue
-        if tri_p[0]==tri_p[2]==tri_p[4]:
-            textured_tris[terrain_idx][tri_p[0]].extend((tri_p[1],tri_p[3],tri_p[5]))    
+        if (tri_type,is_overlay) not in terrain_templates:
+            terrain_templates[(tri_type,is_overlay)]=terrain_template(tile,tri_type,is_overlay)
+        (template,assets)=terrain_templates[(tri_type,is_overlay)]
+        terrain_assets.update(assets)
+        (terrain_file_name,content)=terrain_file(tile,template,texture_file_name,*texture_attributes,tri_type,is_overlay)
+        terrain_files.append((terrain_file_name,content))
+        bTERT+=bytes('terrain/'+terrain_file_name+'\0','ascii') 
+        terrain_names.append('terrain/'+terrain_file_name)
+    del(keys,first_seen)
+    write_terrain_files(tile,terrain_files,terrain_assets)
+    del(terrain_files)
+    dico_terrain_names={name:terrain_idx for (terrain_idx,name) in enumerate(terrain_names)}
+    if refreshed: UI.vprint(1,"   Textures removed because their inputs changed : "+str(refreshed))
+    downloads=[texture_attributes for texture_attributes in downloads if texture_attributes not in queued_textures]
+    for texture_attributes in space_filling_order(downloads):
+        download_queue.put(texture_attributes)
+    UI.vprint(2,"     Textures queued for download after masks : "+str(len(downloads)))
+    del(downloads,queued_textures)
+    sea_terrains=key_terrain[numpy.maximum(sea_keys,0)]*(sea_keys!=-1)
+    sea_ovl_terrains=key_terrain[numpy.maximum(sea_ovl_keys,0)]*(sea_ovl_keys!=-1) if sea_ovl else numpy.zeros(len(sea_tris),dtype=numpy.int64)
+    land_terrains=key_terrain[land_keys]
+    del(key_terrain,sea_keys,land_keys)
+    if sea_ovl: del(sea_ovl_keys)
+    UI.vprint(2,"     Texture and terrain assignment : "+UI.nicer_timer(time.time()-timer))
+    
+    ##########################
+    # Each mesh triangle gives rise to up to three DSF triangles (textured, 
+    # X-Plane water and low resolution sea overlay) whose vertices refer to
+    # textured nodes. A textured node is identified by its terrain and its 
+    # snapped position in its pool, or by its mesh node for X-Plane water 
+    # (terrain 0). References are listed in the order of the former triangle
+    # by triangle encoding, so that nodes get their position in their DSF pool
+    # by order of first appearance. 
+    timer=time.time()
+    UI.progress_bar(1,10)
+    snap_rank=numpy.unique(node_snap,return_inverse=True)[1]
+    del(node_snap)
+    # beware of ordering for orientation ! 
+    sea_nodes=triangles[sea_tris][:,[0,2,1]]
+    land_nodes=triangles[land_tris][:,[0,2,1]]
+    del(triangles)
+    # some triangles could be reduced to nothing by the pool snapping,
+    # we skip them (possible killer to X-Plane's drapping of roads ?)    
+    snapped=snap_rank[sea_nodes]
+    sea_degenerate=(snapped[:,0]==snapped[:,1])|(snapped[:,1]==snapped[:,2])|(snapped[:,2]==snapped[:,0])
+    snapped=snap_rank[land_nodes]
+    land_degenerate=(snapped[:,0]==snapped[:,1])|(snapped[:,1]==snapped[:,2])|(snapped[:,2]==snapped[:,0])
+    del(snapped)
+    # sea tris : textured (with mask), X-Plane water, low resolution overlay
+    masked=sea_terrains!=0
+    sea_present=numpy.column_stack((masked,numpy.full(len(sea_tris),not (tile.experimental_water & 2))&~(masked&sea_degenerate),sea_ovl_terrains!=0)).ravel()
+    sea_terrain=numpy.column_stack((sea_terrains,numpy.zeros(len(sea_tris),dtype=numpy.int64),sea_ovl_terrains)).ravel()
+    sea_variant=numpy.tile([0 if tile.imprint_masks_to_dds else 1,2,3 if (tile.experimental_water & 2) else 4],len(sea_tris))
+    sea_emit=numpy.column_stack((~sea_degenerate,numpy.ones((len(sea_tris),2),dtype=bool))).ravel()
+    # land and inland water tris : textured, X-Plane water 
+    land_types=tri_types[land_tris]
+    land_present=numpy.column_stack((numpy.ones(len(land_tris),dtype=bool),(land_types==1)&(not (tile.experimental_water & 1))&~land_degenerate)).ravel()
+    land_terrain=numpy.column_stack((land_terrains,numpy.zeros(len(land_tris),dtype=numpy.int64))).ravel()
+    land_variant=numpy.column_stack((numpy.where(land_types==0,0,3 if (tile.experimental_water & 1) else 4),numpy.full(len(land_tris),2))).ravel()
+    land_emit=numpy.column_stack((~land_degenerate,numpy.ones(len(land_tris),dtype=bool))).ravel()
+    del(sea_terrains,sea_ovl_terrains,land_terrains,land_types,sea_degenerate,land_degenerate,masked)
+    ref_terrain=numpy.concatenate((sea_terrain[sea_present],land_terrain[land_present]))
+    ref_variant=numpy.concatenate((sea_variant[sea_present],land_variant[land_present]))
+    ref_emit=numpy.concatenate((sea_emit[sea_present],land_emit[land_present]))
+    ref_nodes=numpy.concatenate((numpy.repeat(sea_nodes,3,axis=0)[sea_present],numpy.repeat(land_nodes,2,axis=0)[land_present]))
+    del(sea_terrain,sea_variant,sea_emit,sea_present,land_terrain,land_variant,land_emit,land_present,sea_nodes,land_nodes)
+    ref_keys=numpy.where(ref_terrain[:,None]>0,ref_terrain[:,None]*nbr_nodes+snap_rank[ref_nodes],ref_nodes)
+    del(snap_rank)
+    UI.progress_bar(1,30)
+    if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
+    # Pools are independent from here on : each is encoded on its own, possibly
+    # in parallel, unless the cache of the previous build already has it. 
+    ref_pools=node_pool[ref_nodes]
+    ref_dsfpools=ref_pools+pool_nbr*variant_offset[ref_variant][:,None]
+    tri_refs=numpy.nonzero(ref_emit)[0]
+    cross_pool=(ref_pools[tri_refs,0]!=ref_pools[tri_refs,1])|(ref_pools[tri_refs,1]!=ref_pools[tri_refs,2])
+    in_pool_tris=tri_refs[~cross_pool]
+    in_pool_ranks=numpy.nonzero(~cross_pool)[0]
+    (ref_order,ref_bounds)=pool_slices(ref_pools.ravel(),pool_nbr)
+    (node_order,node_bounds)=pool_slices(node_pool,pool_nbr)
+    (tri_order,tri_bounds)=pool_slices(ref_pools[in_pool_tris,0],pool_nbr)
+    del(ref_pools)
+    (ref_keys,ref_nodes)=(ref_keys.ravel(),ref_nodes.ravel())
+    (ref_variants,ref_terrains)=(numpy.repeat(ref_variant,3),numpy.repeat(ref_terrain,3))
+    node_icoords=node_icoords.reshape(-1,5)
+    terrain_tex=numpy.array([(0,0,0)]+[texture_attributes[:3] for texture_attributes in terrain_textures[1:]],dtype=numpy.int64)
+    terrain_ids=numpy.array([int(md5_hex(name.encode())[:16],16) for name in terrain_names],dtype=numpy.uint64)
+    dsf_cache={}
+    if use_dsf_cache and old_manifest and old_manifest['mesh']==manifest['mesh']:
+        try:
+            with open(FNAMES.dsf_cache_file(tile),'rb') as f:
+                dsf_cache=pickle.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            UI.vprint(1,"   WARNING: The DSF cache of the previous build could not be read, it is ignored.")
+            UI.vprint(2,"  ",e)
+    node_local=numpy.zeros(nbr_nodes,dtype=numpy.int64)
+    ref_local=numpy.zeros(len(ref_keys),dtype=numpy.int64)
+    (jobs,missing_keys,job_keys,job_refs,job_ranks)=([],[],[],[],[])
+    (results,new_cache)=({},{})
+    for idx_pool in range(pool_nbr):
+        refs=ref_order[ref_bounds[idx_pool]:ref_bounds[idx_pool+1]]
+        if not len(refs): continue
+        nodes=node_order[node_bounds[idx_pool]:node_bounds[idx_pool+1]]
+        node_local[nodes]=numpy.arange(len(nodes))
+        ref_local[refs]=numpy.arange(len(refs))
+        tris=tri_order[tri_bounds[idx_pool]:tri_bounds[idx_pool+1]]
+        job=(ref_keys[refs],node_local[ref_nodes[refs]],ref_variants[refs],ref_terrains[refs],\
+             ref_local[3*in_pool_tris[tris,None]+numpy.arange(3)],ref_terrain[in_pool_tris[tris]],\
+             node_pool[nodes],node_icoords[nodes],node_lat[nodes],node_lon[nodes],terrain_tex,pool_nbr,tile.ratio_water,tile.use_triangle_strips)
+        key=pool_job_key(job,terrain_ids)
+        if key in dsf_cache:
+            (pos,pools,blocks,nbr_textured_nodes)=dsf_cache[key]
+            results[key]=(pos,pools,[(dico_terrain_names[name],idx_dsfpool,first,block) for (name,idx_dsfpool,first,block) in blocks],nbr_textured_nodes)
         else:
-            total_cross_pool+=1
-            textured_tris[terrain_idx]['cross-pool'].extend(tri_p)
-        if tri_type: # All water effects not related to the full resolution texture 
-            # I. X-Plane water
-            if not (tile.experimental_water & tri_type) :   
-                tri_p=array.array('H')
-                for n in (n1,n3,n2):     # beware of ordering for orientation ! 
-                    node_hash=(n,0)
-                    if node_hash in textured_nodes:
-                        (idx_dsfpool,pos_in_pool)=textured_nodes[node_hash]
-                    else:
-                        idx_dsfpool=idx_node_to_idx_pool[n]+2*pool_nbr
-                        len_textured_nodes+=1
-                        pos_in_pool=dsf_pool_length[idx_dsfpool]
-                        textured_nodes[node_hash]=[idx_dsfpool,pos_in_pool]
-                        #in some cases we might prefer to use normal shading for some sea triangles too (albedo continuity with elevation derived masks) 
-                        #dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+5])
-                        dsf_pools[idx_dsfpool].extend(node_icoords[5*n:5*n+3])
-                        dsf_pools[idx_dsfpool].extend((32768,32768))
-                        dsf_pool_length[idx_dsfpool]+=1
-                    tri_p.extend((idx_dsfpool,pos_in_pool))
-                if tri_p[0]==tri_p[2]==tri_p[4]:
-                    textured_tris[0][tri_p[0]].extend((tri_p[1],tri_p[3],tri_p[5]))    
-                else:
-                    total_cross_pool+=1
-                    textured_tris[0]['cross-pool'].extend(tri_p)
+            jobs.append(job)
+            missing_keys.append(key)
+        job_keys.append(key)
+        job_refs.append(refs)
+        job_ranks.append(in_pool_ranks[tris])
+    del(ref_keys,ref_nodes,ref_variants,ref_terrains,ref_order,ref_bounds,node_order,node_bounds,tri_order,tri_bounds,node_local,ref_local,in_pool_tris,in_pool_ranks,dsf_cache)
+    UI.vprint(1,"     Pools reused from the previous build: "+str(len(job_keys)-len(jobs))+" / "+str(len(job_keys)))
+    UI.progress_bar(1,40)
+    if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
+    workers=max(1,min(max_dsf_workers,len(jobs)))
+    if workers>1:
+        UI.vprint(2,"     Encoding "+str(len(jobs))+" pools with "+str(workers)+" processes.")
+        with multiprocessing.Pool(workers) as pool_workers:
+            encoded=pool_workers.starmap(encode_pool_group,jobs)
+    else:
+        encoded=[encode_pool_group(*job) for job in jobs]
+    results.update(zip(missing_keys,encoded))
+    del(jobs,missing_keys,encoded)
+    UI.progress_bar(1,70)
+    if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
+    ref_pos=numpy.zeros(3*len(ref_emit),dtype=numpy.uint16)
+    dsf_pool_length=numpy.zeros(dsf_pool_nbr,dtype=numpy.int64)
+    len_textured_nodes=0
+    blocks=[]
+    for (key,refs,ranks) in zip(job_keys,job_refs,job_ranks):
+        (pos,pools,pool_blocks,nbr_textured_nodes)=results[key]
+        ref_pos[refs]=pos
+        for (idx_dsfpool,length,atom) in pools:
+            dsf_pool_length[idx_dsfpool]=length
+            dsf_pools[idx_dsfpool]=atom
+        blocks+=[(terrain_idx,idx_dsfpool,int(ranks[first]),block) for (terrain_idx,idx_dsfpool,first,block) in pool_blocks]
+        len_textured_nodes+=nbr_textured_nodes
+        if use_dsf_cache: new_cache[key]=(pos,pools,[(terrain_names[terrain_idx],idx_dsfpool,first,block) for (terrain_idx,idx_dsfpool,first,block) in pool_blocks],nbr_textured_nodes)
+    del(job_keys,job_refs,job_ranks,results)
+    if use_dsf_cache:
+        try:
+            with open(FNAMES.dsf_cache_file(tile),'wb') as f:
+                pickle.dump(new_cache,f,protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            UI.vprint(1,"   WARNING: The DSF cache could not be written.")
+            UI.vprint(2,"  ",e)
+    else:
+        # that of a former build with the cache
+        try: os.remove(FNAMES.dsf_cache_file(tile))
+        except: pass
+    del(new_cache)
+    if dsf_pool_length.max()>65536:
+        UI.vprint(0,"ERROR: Too many points in a DSF pool, quad_capacity_high/low should be decreased.")
+        return 0
+    # cross-pool triangles, grouped by terrain
+    cross_tris=tri_refs[cross_pool]
+    cross_ranks=numpy.nonzero(cross_pool)[0]
+    total_cross_pool=len(cross_tris)
+    cross_coords=numpy.stack((ref_dsfpools[cross_tris],ref_pos.reshape(-1,3)[cross_tris]),axis=2).astype(numpy.uint16)
+    (terrains,terrain_first,tri_terrain)=numpy.unique(ref_terrain[cross_tris],return_index=True,return_inverse=True)
+    tri_order=numpy.argsort(tri_terrain,kind='stable')
+    terrain_end=numpy.cumsum(numpy.bincount(tri_terrain,minlength=len(terrains)))
+    for g in range(len(terrains)):
+        tris=tri_order[(terrain_end[g-1] if g else 0):terrain_end[g]]
+        blocks.append((int(terrains[g]),'cross-pool',int(cross_ranks[terrain_first[g]]),cross_coords[tris].ravel()))
+    del(ref_terrain,ref_variant,ref_emit,ref_dsfpools,ref_pos,tri_refs,cross_pool,cross_tris,cross_ranks,cross_coords,tri_terrain,tri_order)
+    # DSF triangles, grouped by terrain and by pool (or cross-pool), in order 
+    # of first appearance
+    for (terrain_idx,idx_dsfpool,first_rank,block) in sorted(blocks,key=lambda block:(block[0],block[2])):
+        textured_tris[terrain_idx][idx_dsfpool]=block
+    del(blocks)
+    UI.progress_bar(1,90)
+    UI.vprint(2,"     Triangles encoding : "+UI.nicer_timer(time.time()-timer))
     
     download_queue.put('quit')
     
@@ -637,7 +1505,7 @@ def build_dsf(tile,download_queue):
             size_of_geod_atom+=21+dsf_pool_plane[k]*(9+2*dsf_pool_length[k])
     UI.vprint(2,"     Size of DEFN atom : "+str(size_of_defn_atom)+" bytes.")    
     UI.vprint(2,"     Size of GEOD atom : "+str(size_of_geod_atom)+" bytes.")    
-    f=open(dsf_file_name+'.tmp','wb')
+    f=MD5Writer(dsf_file_name+'.tmp')
     f.write(b'XPLNEDSF')
     f.write(struct.pack('<I',1))
     
@@ -674,21 +1542,11 @@ def build_dsf(tile,download_queue):
     for k in range(dsf_pool_nbr):
         if dsf_pool_length[k]==0:
             continue
-        f.write(b'LOOP')
-        f.write(struct.pack('<I',13+dsf_pool_plane[k]+2*dsf_pool_plane[k]*dsf_pool_length[k]))
-        f.write(struct.pack('<I',dsf_pool_length[k]))
-        f.write(struct.pack('<B',dsf_pool_plane[k]))
-        for l in range(dsf_pool_plane[k]):
-            f.write(struct.pack('<B',0))
-            for m in range(dsf_pool_length[k]):
-                f.write(struct.pack('<H',dsf_pools[k][dsf_pool_plane[k]*m+l]))
+        f.write(dsf_pools[k])
     for k in range(dsf_pool_nbr):
         if dsf_pool_length[k]==0:
             continue
-        f.write(b'LACS')
-        f.write(struct.pack('<I',8+8*dsf_pool_plane[k]))
-        for l in range(2*dsf_pool_plane[k]):
-            f.write(struct.pack('<f',pool_param[k%pool_nbr][l]))
+        f.write(scal_atom(pool_param[k%pool_nbr],dsf_pool_plane[k]))
    
     UI.progress_bar(1,95)
     if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
@@ -712,94 +1570,67 @@ def build_dsf(tile,download_queue):
         f.write(bDEMS)
 
     # Commands atom
-    
-    # we first compute its size :
+    bCMDS+=terrain_commands(textured_tris,overlay_terrains,dico_new_dsf_pool,tile.overlay_lod)
     size_of_cmds_atom=8+len(bCMDS)
-    for terrain_idx in textured_tris:
-        if len(textured_tris[terrain_idx])==0:
-            continue
-        size_of_cmds_atom+=3
-        for idx_dsfpool in textured_tris[terrain_idx]:
-            if idx_dsfpool != 'cross-pool':
-                size_of_cmds_atom+= 13+2*(len(textured_tris[terrain_idx][idx_dsfpool])+\
-                        ceil(len(textured_tris[terrain_idx][idx_dsfpool])/255))
-            else:
-                size_of_cmds_atom+= 13+2*(len(textured_tris[terrain_idx][idx_dsfpool])+\
-                        ceil(len(textured_tris[terrain_idx][idx_dsfpool])/510))
     UI.vprint(2,"     Size of CMDS atom : "+str(size_of_cmds_atom)+" bytes.")
     f.write(b'SDMC')                               # CMDS header 
     f.write(struct.pack('<I',size_of_cmds_atom))   # CMDS length
     f.write(bCMDS)
-    for terrain_idx in textured_tris:
-        if len(textured_tris[terrain_idx])==0:
-            continue
-        #print("terrain_idx = "+str(terrain_idx))
-        f.write(struct.pack('<B',4))           # SET DEFINITION 16
-        f.write(struct.pack('<H',terrain_idx)) # TERRAIN INDEX
-        flag=1 if terrain_idx not in overlay_terrains else 2   # physical or overlay
-        lod=-1 if flag==1 else tile.overlay_lod
-        for idx_dsfpool in textured_tris[terrain_idx]:
-            if idx_dsfpool != 'cross-pool':
-                f.write(struct.pack('<B',1))                                 # POOL SELECT
-                f.write(struct.pack('<H',dico_new_dsf_pool[idx_dsfpool]))    # POOL INDEX
-                
-                f.write(struct.pack('<B',18))    # TERRAIN PATCH FLAGS AND LOD
-                f.write(struct.pack('<B',flag))  # FLAG
-                f.write(struct.pack('<f',0))     # NEAR LOD
-                f.write(struct.pack('<f',lod))   # FAR LOD
-                
-                blocks=floor(len(textured_tris[terrain_idx][idx_dsfpool])/255)
-                for j in range(blocks):
-                    f.write(struct.pack('<B',23))   # PATCH TRIANGLE
-                    f.write(struct.pack('<B',255))  # COORDINATE COUNT
-
-                    for k in range(255):
-                        f.write(struct.pack('<H',textured_tris[terrain_idx][idx_dsfpool][255*j+k]))  # COORDINATE IDX
-                remaining_tri_p=len(textured_tris[terrain_idx][idx_dsfpool])%255
-                if remaining_tri_p != 0:
-                    f.write(struct.pack('<B',23))               # PATCH TRIANGLE
-                    f.write(struct.pack('<B',remaining_tri_p))  # COORDINATE COUNT
-                    for k in range(remaining_tri_p):
-                        f.write(struct.pack('<H',textured_tris[terrain_idx][idx_dsfpool][255*blocks+k]))  # COORDINATE IDX
-            else:  # idx_dsfpool == 'cross-pool'
-                pool_idx_init=textured_tris[terrain_idx][idx_dsfpool][0]
-                f.write(struct.pack('<B',1))                                   # POOL SELECT
-                f.write(struct.pack('<H',dico_new_dsf_pool[pool_idx_init]))    # POOL INDEX
-                f.write(struct.pack('<B',18))    # TERRAIN PATCH FLAGS AND LOD
-                f.write(struct.pack('<B',flag))  # FLAG
-                f.write(struct.pack('<f',0))     # NEAR LOD
-                f.write(struct.pack('<f',lod))   # FAR LOD
-                
-                blocks=floor(len(textured_tris[terrain_idx][idx_dsfpool])/510)
-                for j in range(blocks):
-                    f.write(struct.pack('<B',24))   # PATCH TRIANGLE CROSS-POOL
-                    f.write(struct.pack('<B',255))  # COORDINATE COUNT
-                    for k in range(255):
-                        f.write(struct.pack('<H',dico_new_dsf_pool[textured_tris[terrain_idx][idx_dsfpool][510*j+2*k]]))    # POOL IDX
-                        f.write(struct.pack('<H',textured_tris[terrain_idx][idx_dsfpool][510*j+2*k+1]))                     # POS_IN_POOL IDX
-                remaining_tri_p=int((len(textured_tris[terrain_idx][idx_dsfpool])%510)/2)
-                if remaining_tri_p != 0:
-                    f.write(struct.pack('<B',24))               # PATCH TRIANGLE CROSS-POOL
-                    f.write(struct.pack('<B',remaining_tri_p))  # COORDINATE COUNT
-                    for k in range(remaining_tri_p):
-                        f.write(struct.pack('<H',dico_new_dsf_pool[textured_tris[terrain_idx][idx_dsfpool][510*blocks+2*k]]))   # POOL IDX
-                        f.write(struct.pack('<H',textured_tris[terrain_idx][idx_dsfpool][510*blocks+2*k+1]))                    # POS_IN_PO0L IDX
     
     UI.progress_bar(1,98)
     if UI.red_flag: UI.vprint(1,"DSF construction interrupted."); return 0   
     
-    f.close()
-    f=open(dsf_file_name+'.tmp','rb')
-    data=f.read()
-    m=hashlib.md5()
-    m.update(data)
-    md5sum=m.digest()
-    f.close()
-    f=open(dsf_file_name+'.tmp','ab')
-    f.write(md5sum)
     f.close()
     UI.progress_bar(1,100)
     size_of_dsf=28+size_of_head_atom+size_of_defn_atom+size_of_geod_atom+size_of_cmds_atom
     UI.vprint(1,"     DSF file encoded, total size is :",size_of_dsf,"bytes","("+UI.human_print(size_of_dsf)+")")
+    # the manifest is activated together with the DSF, once textures are done
+    # (see activate_manifest)
+    with open(FNAMES.build_manifest_file(tile)+'.tmp','wb') as f:
+        pickle.dump(manifest,f)
     return 1
 ##############################################################################
+
+if __name__ == '__main__':
+    Syntax='Syntax :\n--------\n(PYTHON) src/O4_DSF_Utils.py check|validate [dsf_file_or_directory ...]\n\n'+\
+           'check    : validates the MD5 footer of existing DSF files,\n'+\
+           'validate : also decodes them and checks pool bounds, triangle references\n'+\
+           '           and terrain indices, reporting the decoding throughput.\n'+\
+           'Directories are searched recursively, the default is the Tiles directory.'
+    if len(sys.argv)<2 or sys.argv[1] not in ('check','validate'):
+        print(Syntax)
+        sys.exit(1)
+    targets=sys.argv[2:] or [FNAMES.Tile_dir]
+    dsf_files=[]
+    for target in targets:
+        if os.path.isdir(target):
+            for (dirpath,dirnames,filenames) in os.walk(target):
+                dsf_files+=[os.path.join(dirpath,f) for f in sorted(filenames) if f[-4:]=='.dsf']
+        else:
+            dsf_files.append(target)
+    nbr_errors=0
+    (total_size,total_time)=(0,0)
+    for dsf_file in dsf_files:
+        report=''
+        try:
+            result=check_dsf_file(dsf_file)
+            if result is True and sys.argv[1]=='validate':
+                dsf=read_dsf(dsf_file)
+                errors=validate_dsf(dsf)
+                if errors: result='; '.join(errors)
+                total_size+=dsf['size']
+                total_time+=dsf['decode_time']
+                report="("+str(len(dsf['pools']))+" pools, "+str(len(dsf['terrains']))+" terrains, "+str(len(dsf['tri_pools']))+\
+                       " triangles, decoded at "+UI.human_print(dsf['size']/max(dsf['decode_time'],1e-6),'B')+"/s)"
+        except Exception as e:
+            result=e
+        if result is True:
+            print("OK         :",dsf_file,report)
+        elif result is None:
+            print("Skipped    :",dsf_file,"(not a raw DSF, possibly 7z compressed)")
+        else:
+            nbr_errors+=1
+            print("ERROR      :",dsf_file,result if result is not False else "MD5 footer mismatch")
+    if total_time:
+        print("Decoded",UI.human_print(total_size,'B'),"in",UI.nicer_timer(total_time),"("+UI.human_print(total_size/total_time,'B')+"/s)")
+    sys.exit(1 if nbr_errors else 0)
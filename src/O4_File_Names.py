@@ -20,6 +20,7 @@ Utils_dir     =  os.path.join(Ortho4XP_dir, 'Utils')
 Tile_dir      =  os.path.join(Ortho4XP_dir, 'Tiles')
 Tmp_dir       =  os.path.join(Ortho4XP_dir, 'tmp')
 Overlay_dir  =   os.path.join(Ortho4XP_dir, 'yOrtho4XP_Overlays')
+Mesh_history_file = os.path.join(Ortho4XP_dir, 'Ortho4XP_mesh_history')
 ##############################################################################
 def short_latlon(lat,lon):
     strlat='{:+.0f}'.format(lat).zfill(3)
@@ -78,6 +79,8 @@ def output_poly_file(tile):
     return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.'+str(tile.iterate+1)+'.poly')
 def output_ele_file(tile):
     return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.'+str(tile.iterate+1)+'.ele')
+def speculative_mesh_dir(tile):
+    return os.path.join(tile.build_dir,'Speculative_mesh')
 def alt_file(tile):
     if tile.iterate:
         return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.'+str(tile.iterate)+'.alt')
@@ -87,8 +90,18 @@ def apt_file(tile):
     return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.apt')
 def weight_file(tile):
     return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.weight')
+def build_manifest_file(tile):
+    return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.manifest')
+def mesh_manifest_file(tile):
+    return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.mesh_manifest')
+def dsf_cache_file(tile):
+    return os.path.join(tile.build_dir,'Data'+short_latlon(tile.lat,tile.lon)+'.dsf_cache')
 def mesh_file(build_dir,lat,lon):
     return os.path.join(build_dir,'Data'+short_latlon(lat,lon)+'.mesh')
+def binary_mesh_file(mesh_file):
+    return mesh_file+'.bin'
+def mesh_index_file(mesh_file):
+    return mesh_file+'.idx'
 def obj_file(til_x_left,til_y_top,zoomlevel,provider_code):    
     return os.path.join(Geotiff_dir,str(til_y_top)+"_"+str(til_x_left)+"_"+provider_code+str(zoomlevel)+'.obj')
 def mtl_file(til_x_left,til_y_top,zoomlevel,provider_code):    
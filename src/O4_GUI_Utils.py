@@ -135,6 +135,15 @@ class Ortho4XP_GUI(tk.Tk):
         build_masks_button.bind("<Shift-ButtonPress-1>", self.build_masks) 
         ttk.Button(self.frame_steps, text=" Build Imagery/DSF ",command=self.build_tile).grid(row=0,column=3, padx=5, pady=0,sticky=N+S+E+W)
         ttk.Button(self.frame_steps, text="    All in one     ",command=self.build_all).grid(row=0,column=4, padx=5, pady=0,sticky=N+S+E+W)
+        # Below Step 2
+        self.frame_mesh_options=tk.Frame(self.frame_steps,border=0,padx=0,pady=0,bg="light green")
+        self.frame_mesh_options.grid(row=1,column=1,padx=5,pady=0,sticky=N+S+E+W)
+        self.force_mesh_rebuild=tk.IntVar()
+        self.force_mesh_rebuild.set(int(MESH.force_mesh_rebuild))
+        self.force_mesh_rebuild.trace("w",self.update_force_mesh_rebuild)
+        ttk.Button(self.frame_mesh_options,text="Estimate",command=self.estimate_mesh).grid(row=0,column=1,padx=0,pady=0,sticky=N+S+E)
+        self.frame_mesh_options.columnconfigure(0,weight=1)
+        tk.Checkbutton(self.frame_mesh_options,text='Force rebuild',anchor=W,variable=self.force_mesh_rebuild,bg="light green",activebackground="light green",highlightthickness=0).grid(row=0,column=0,padx=0,pady=0,sticky=N+S+W)
         
         # Fourth row (Progress bars and controls)
         #Label(self.frame_left,anchor=W,text="DSF/Masks progress",bg="light green")
@@ -271,6 +280,20 @@ class Ortho4XP_GUI(tk.Tk):
         self.working_thread=threading.Thread(target=MESH.build_mesh,args=[tile])
         self.working_thread.start()
         
+    def estimate_mesh(self):
+        # the number of triangles Step 2 would make, after Step 1
+        try: 
+            tile=self.tile_from_interface()
+            tile.make_dirs()
+        except: 
+            UI.vprint(1,"Process aborted.\n"); return 0
+        self.working_thread=threading.Thread(target=MESH.estimate_mesh,args=[tile])
+        self.working_thread.start()
+        
+    def update_force_mesh_rebuild(self,*args):
+        # bypasses the mesh cache (see use_mesh_cache) for the next builds
+        MESH.force_mesh_rebuild=bool(self.force_mesh_rebuild.get())
+        
     def sort_mesh(self,event):
         try: 
             tile=self.tile_from_interface()
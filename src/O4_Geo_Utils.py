@@ -1,5 +1,6 @@
 from math import log, tan, pi, atan, exp, cos, sin, sqrt, atan2
 import pyproj
+import numpy
 
 earth_radius = 6378137
 lat_to_m      = pi*earth_radius/180
@@ -64,6 +65,29 @@ def wgs84_to_pix(lat,lon,zoomlevel):
     return (pix_x,pix_y)
 ##############################################################################
 
+##############################################################################
+def scalar_near_borders(result,values,border,lat,lon,scalar):
+    # Numpy and math may round log and tan differently, the results of the 
+    # few points whose values (array counterparts of those of the scalar 
+    # function) lie within rounding distance of a border (an integer plus 
+    # border) are thus redone with scalar(lat,lon).
+    shifted=values-border
+    for i in numpy.flatnonzero(numpy.abs(shifted-numpy.round(shifted))<1e-6).tolist():
+        result.flat[i]=scalar(float(lat.flat[i]),float(lon.flat[i]))
+    return result
+##############################################################################
+
+##############################################################################
+def wgs84_to_pix_array(lat,lon,zoomlevel):
+    # same as wgs84_to_pix for numpy arrays of points
+    rat_x=lon/180           
+    rat_y=numpy.log(numpy.tan((90+lat)*pi/360))/pi
+    pix_x=numpy.round((rat_x+1)*(2**(zoomlevel+7))).astype(numpy.int64)
+    y=(1-rat_y)*(2**(zoomlevel+7))
+    pix_y=scalar_near_borders(numpy.round(y).astype(numpy.int64),y,0.5,lat,lon,lambda lat,lon: wgs84_to_pix(lat,lon,zoomlevel)[1])
+    return (pix_x,pix_y)
+##############################################################################
+
 ##############################################################################
 def pix_to_wgs84(pix_x,pix_y,zoomlevel):
     rat_x=(pix_x/(2**(zoomlevel+7))-1)
@@ -101,6 +125,18 @@ def wgs84_to_orthogrid(lat,lon,zoomlevel):
     return (til_x,til_y)
 ##############################################################################
 
+##############################################################################
+def wgs84_to_orthogrid_array(lat,lon,zoomlevel):
+    # same as above for numpy arrays of points
+    ratio_x=lon/180           
+    ratio_y=numpy.log(numpy.tan((90+lat)*pi/360))/pi
+    mult=2**(zoomlevel-5)
+    til_x=((ratio_x+1)*mult).astype(numpy.int64)*16
+    y=(1-ratio_y)*mult
+    til_y=scalar_near_borders(y.astype(numpy.int64)*16,y,0,lat,lon,lambda lat,lon: wgs84_to_orthogrid(lat,lon,zoomlevel)[1])
+    return (til_x,til_y)
+##############################################################################
+
 ##############################################################################
 def st_coord(lat,lon,tex_x,tex_y,zoomlevel,provider_code):                        
     """
@@ -117,3 +153,15 @@ def st_coord(lat,lon,tex_x,tex_y,zoomlevel,provider_code):
     t = t if t<=1 else 1
     return (s,t)
 ##############################################################################
+
+##############################################################################
+def st_coord_array(lat,lon,tex_x,tex_y,zoomlevel):
+    # same as above for numpy arrays of points, textures attributes being 
+    # either scalars or arrays of the same length
+    ratio_x=lon/180           
+    ratio_y=numpy.log(numpy.tan((90+lat)*pi/360))/pi
+    mult=2.0**(numpy.asarray(zoomlevel)-5)
+    s=numpy.clip((ratio_x+1)*mult-(numpy.asarray(tex_x)//16),0,1)
+    t=numpy.clip(1-((1-ratio_y)*mult-numpy.asarray(tex_y)//16),0,1)
+    return (s,t)
+##############################################################################
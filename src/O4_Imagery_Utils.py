@@ -1437,15 +1437,17 @@ def convert_texture(tile,til_x_left,til_y_top,zoomlevel,provider_code,type='dds'
                 UI.vprint(1,"ERROR: Could not geotag texture (gdal not present ?) ",os.path.join(tile.build_dir,'textures',out_file_name))
                 try: os.remove(os.path.join(UI.Ortho4XP_dir,'tmp',png_file_name))
                 except: pass  
-                return
+                return 0
             conv_cmd=[gdalwarp_cmd,'-of','Gtiff','-co','COMPRESS=JPEG','-s_srs','epsg:3857','-t_srs','epsg:4326','-ts','4096','4096','-rb',tmp_tif_file_name,os.path.join(FNAMES.Geotiff_dir,out_file_name)] 
     tentative=0
+    converted=1
     while True:
         if not subprocess.call(conv_cmd,stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT):
             break
         tentative+=1
         if tentative==10:
             UI.lvprint(1,"ERROR: Could not convert texture",os.path.join(tile.build_dir,'textures',out_file_name),"(10 tries)")
+            converted=0
             break
         UI.lvprint(1,"WARNING: Could not convert texture",os.path.join(tile.build_dir,'textures',out_file_name))
         time.sleep(1)
@@ -1455,7 +1457,7 @@ def convert_texture(tile,til_x_left,til_y_top,zoomlevel,provider_code,type='dds'
     if erase_tmp_tif:
         try: os.remove(os.path.join(UI.Ortho4XP_dir,'tmp',png_file_name))
         except: pass
-    return 
+    return converted
 ###############################################################################################################################
 
 def geotag(input_file_name):
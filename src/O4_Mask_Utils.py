@@ -13,6 +13,7 @@ import O4_Imagery_Utils as IMG
 import O4_OSM_Utils as OSM
 import O4_Vector_Utils as VECT
 import O4_Mesh_Utils as MESH
+import O4_Triangle_Utils as TRI
 from O4_Parallel_Utils import parallel_execute
 
 mask_altitude_above=0.5
@@ -40,6 +41,109 @@ def needs_mask(tile, til_x_left,til_y_top,zoomlevel,*args):
         return small_img
 ##############################################################################
 
+##############################################################################
+def mask_quarters(lat,lon,mask_zl):
+    # Same as GEO.wgs84_to_orthogrid(lat,lon,mask_zl+2)//16 for arrays of 
+    # points, i.e. the orthogrid tile at mask_zl of each point is 16 times
+    # this over 4 and its quarter within it this modulo 4.
+    (quarter_x,quarter_y)=GEO.wgs84_to_orthogrid_array(lat,lon,mask_zl+2)
+    return (quarter_x//16,quarter_y//16)
+##############################################################################
+
+##############################################################################
+def group_by_key(dico,keys_x,keys_y,triangles):
+    # Appends each of the triangles to dico[(key_x,key_y)], keys being added 
+    # in the order of their first occurrence and triangles kept in order.
+    if not len(keys_x): return
+    keys=keys_x*2**32+(keys_y-keys_y.min())
+    order=numpy.argsort(keys,kind='stable')
+    (unique_keys,first,counts)=numpy.unique(keys[order],return_index=True,return_counts=True)
+    first_occurrence=order[first]
+    triangles=numpy.asarray(triangles)[order].tolist()
+    for k in numpy.argsort(first_occurrence,kind='stable').tolist():
+        key=(int(keys_x[first_occurrence[k]]),int(keys_y[first_occurrence[k]]))
+        dico.setdefault(key,[]).extend(map(tuple,triangles[first[k]:first[k]+counts[k]]))
+##############################################################################
+
+##############################################################################
+def water_triangle_buckets(tile,mesh_file_name_list,til_x_min,til_y_min,til_x_max,til_y_max):
+    # For each mask tile (til_x,til_y) at tile.mask_zl, the water triangles
+    # (lat1,lon1,lat2,lon2,lat3,lon3) of the meshes whose barycenter is in 
+    # it, or in a neighbour and within a quarter of tile of their common 
+    # side(s), and (unless use_masks_for_inland) the inland water triangles
+    # of the mask tiles which had sea water triangles, the latter being the 
+    # only water in the first dict otherwise. None if interrupted.
+    dico_masks={}
+    dico_masks_inland={}
+    percent=0
+    for mesh_file_name in mesh_file_name_list:
+        try:
+            (mesh_version,vertices,normals,triangles,tri_attributes)=MESH.load_mesh(mesh_file_name)
+            UI.vprint(1,"   * ",mesh_file_name)
+        except:
+            UI.lvprint(1,"Mesh file ",mesh_file_name," could not be read. Skipped.")
+            continue
+        has_water = 7 if mesh_version>=1.3 else 3
+        UI.vprint(2," Attribution process of masks buffers to water triangles for "+str(mesh_file_name)+".")
+        # only the triangles of the cells around the masks extent
+        (latmax,lonmin)=GEO.gtile_to_wgs84(til_x_min-16,til_y_min-16,tile.mask_zl)
+        (latmin,lonmax)=GEO.gtile_to_wgs84(til_x_max+32,til_y_max+32,tile.mask_zl)
+        selection=MESH.query_mesh_index(MESH.load_mesh_index(mesh_file_name,vertices,triangles),latmin,latmax,lonmin,lonmax)
+        water=numpy.asarray(tri_attributes[selection]).astype(numpy.int64) & has_water
+        sea=(water>=2) if not tile.use_masks_for_inland else (water>0)
+        inland=(water==1) if not tile.use_masks_for_inland else numpy.zeros(len(water),dtype=bool)
+        selection=selection[sea|inland]
+        (sea,inland)=(sea[sea|inland],inland[sea|inland])
+        # (lat1,lon1,lat2,lon2,lat3,lon3) of each triangle 
+        corners=numpy.asarray(vertices)[numpy.asarray(triangles)[selection],:2]
+        coords=corners[:,:,::-1].reshape((-1,6))
+        del(vertices,normals,triangles,tri_attributes,corners)
+        bary_lat=(coords[:,0]+coords[:,2]+coords[:,4])/3
+        bary_lon=(coords[:,1]+coords[:,3]+coords[:,5])/3
+        (quarter_x,quarter_y)=mask_quarters(bary_lat,bary_lon,tile.mask_zl)
+        (til_x,til_y)=(quarter_x//4*16,quarter_y//4*16)
+        (a,b)=(quarter_x%4,quarter_y%4)
+        inside=(til_x>=til_x_min-16)&(til_x<=til_x_max+16)&(til_y>=til_y_min-16)&(til_y<=til_y_max+16)
+        percent+=50/len(mesh_file_name_list)
+        UI.progress_bar(1,int(percent))
+        if UI.red_flag: return None
+        # Sea water : (til_x,til_y), then the neighbours along x, diagonal and 
+        # along y as needed, with offsets of -16/+16 in the first and last 
+        # quarters.
+        tris=numpy.nonzero(sea&inside)[0]
+        dx=numpy.where(a[tris]==0,-16,numpy.where(a[tris]==3,16,0))
+        dy=numpy.where(b[tris]==0,-16,numpy.where(b[tris]==3,16,0))
+        offsets_x=numpy.column_stack((numpy.zeros(len(tris),dtype=numpy.int64),dx,dx,numpy.zeros(len(tris),dtype=numpy.int64)))
+        offsets_y=numpy.column_stack((numpy.zeros(len(tris),dtype=numpy.int64),numpy.zeros(len(tris),dtype=numpy.int64),dy,dy))
+        used=numpy.column_stack((numpy.ones(len(tris),dtype=bool),dx!=0,(dx!=0)&(dy!=0),dy!=0))
+        pairs=numpy.repeat(tris,4)[used.ravel()]
+        group_by_key(dico_masks,til_x[pairs]+offsets_x[used],til_y[pairs]+offsets_y[used],coords[pairs])
+        # Inland water is added ONLY where sea water tris were already added for this mask extent
+        tris=numpy.nonzero(inland&inside)[0]
+        if len(tris):
+            keys=til_x[tris]*2**32+til_y[tris]
+            sea_keys=numpy.array([key_x*2**32+key_y for (key_x,key_y) in dico_masks],dtype=numpy.int64)
+            tris=tris[numpy.isin(keys,sea_keys)]
+            group_by_key(dico_masks_inland,til_x[tris],til_y[tris],coords[tris])
+    return (dico_masks,dico_masks_inland)
+##############################################################################
+
+##############################################################################
+def triangles_to_pixels(triangles,zoomlevel,px0,py0):
+    # (lat1,lon1,lat2,lon2,lat3,lon3) triangles to (N,3) pixel arrays px and
+    # py relative to (px0,py0) 
+    coords=numpy.array(triangles,dtype=numpy.float64).reshape((-1,6))
+    (px,py)=GEO.wgs84_to_pix_array(coords[:,0::2],coords[:,1::2],zoomlevel)
+    return (px-px0,py-py0)
+##############################################################################
+
+##############################################################################
+def draw_triangles(mask_draw,px,py,fill):
+    # Draws the triangles of the (N,3) pixel arrays px and py 
+    for (tri_x,tri_y) in zip(px.tolist(),py.tolist()):
+        mask_draw.polygon([(tri_x[0],tri_y[0]),(tri_x[1],tri_y[1]),(tri_x[2],tri_y[2])],fill=fill)
+##############################################################################
+
 ##############################################################################
 def build_masks(tile,for_imagery=False):
     if UI.is_working: return 0
@@ -74,10 +178,6 @@ def build_masks(tile,for_imagery=False):
             close_mesh_file_name=FNAMES.mesh_file(close_build_dir,close_lat,close_lon)
             if os.path.isfile(close_mesh_file_name):
                 mesh_file_name_list.append(close_mesh_file_name)
-    ####################
-    dico_masks={}
-    dico_masks_inland={}
-    ####################
     [til_x_min,til_y_min]=GEO.wgs84_to_orthogrid(tile.lat+1,tile.lon,tile.mask_zl)
     [til_x_max,til_y_max]=GEO.wgs84_to_orthogrid(tile.lat,tile.lon+1,tile.mask_zl)
     UI.vprint(1,"-> Deleting existing masks")
@@ -88,134 +188,9 @@ def build_masks(tile,for_imagery=False):
             except:
                 pass
     UI.vprint(1,"-> Reading mesh data")
-    for mesh_file_name in mesh_file_name_list:
-        try:
-            f_mesh=open(mesh_file_name,"r")
-            UI.vprint(1,"   * ",mesh_file_name)
-        except:
-            UI.lvprint(1,"Mesh file ",mesh_file_name," could not be read. Skipped.")
-            continue
-        mesh_version=float(f_mesh.readline().strip().split()[-1])
-        has_water = 7 if mesh_version>=1.3 else 3
-        for i in range(3):
-            f_mesh.readline()
-        nbr_pt_in=int(f_mesh.readline())
-        pt_in=numpy.zeros(5*nbr_pt_in,'float')
-        for i in range(0,nbr_pt_in):
-            pt_in[5*i:5*i+3]=[float(x) for x in f_mesh.readline().split()[:3]]
-        for i in range(0,3):
-            f_mesh.readline()
-        for i in range(0,nbr_pt_in):
-            pt_in[5*i+3:5*i+5]=[float(x) for x in f_mesh.readline().split()[:2]]
-        for i in range(0,2): # skip 2 lines
-            f_mesh.readline()
-        nbr_tri_in=int(f_mesh.readline()) # read nbr of tris
-        step_stones=nbr_tri_in//100
-        percent=-1
-        UI.vprint(2," Attribution process of masks buffers to water triangles for "+str(mesh_file_name)+".")
-        for i in range(0,nbr_tri_in):
-            if i%step_stones==0:
-                percent+=1
-                UI.progress_bar(1, int(percent*5/10))
-                if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
-            (n1,n2,n3,tri_type)=[int(x)-1 for x in f_mesh.readline().split()[:4]]
-            tri_type+=1
-            if (not tri_type) or (not (tri_type & has_water)) or ((tri_type & has_water)<2 and not tile.use_masks_for_inland):
-                continue
-            (lon1,lat1)=pt_in[5*n1:5*n1+2]
-            (lon2,lat2)=pt_in[5*n2:5*n2+2]
-            (lon3,lat3)=pt_in[5*n3:5*n3+2]
-            bary_lat=(lat1+lat2+lat3)/3
-            bary_lon=(lon1+lon2+lon3)/3
-            (til_x,til_y)=GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mask_zl)
-            if til_x < til_x_min-16 or til_x > til_x_max+16 or til_y < til_y_min-16 or til_y>til_y_max+16:
-                continue
-            (til_x2,til_y2)=GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mask_zl+2)
-            a=(til_x2//16)%4
-            b=(til_y2//16)%4
-            if (til_x,til_y) in dico_masks:
-                dico_masks[(til_x,til_y)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-            else:
-                dico_masks[(til_x,til_y)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-            if a==0: 
-                if (til_x-16,til_y) in dico_masks:
-                    dico_masks[(til_x-16,til_y)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                else:
-                    dico_masks[(til_x-16,til_y)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-                if b==0: 
-                    if (til_x-16,til_y-16) in dico_masks:
-                        dico_masks[(til_x-16,til_y-16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                    else:
-                        dico_masks[(til_x-16,til_y-16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-                elif b==3:
-                    if (til_x-16,til_y+16) in dico_masks:
-                        dico_masks[(til_x-16,til_y+16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                    else:
-                        dico_masks[(til_x-16,til_y+16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-            elif a==3:
-                if (til_x+16,til_y) in dico_masks:
-                    dico_masks[(til_x+16,til_y)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                else:
-                    dico_masks[(til_x+16,til_y)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-                if b==0: 
-                    if (til_x+16,til_y-16) in dico_masks:
-                        dico_masks[(til_x+16,til_y-16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                    else:
-                        dico_masks[(til_x+16,til_y-16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-                elif b==3:
-                    if (til_x+16,til_y+16) in dico_masks:
-                        dico_masks[(til_x+16,til_y+16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                    else:
-                        dico_masks[(til_x+16,til_y+16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-            if b==0: 
-                if (til_x,til_y-16) in dico_masks:
-                    dico_masks[(til_x,til_y-16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                else:
-                    dico_masks[(til_x,til_y-16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-            elif b==3:
-                if (til_x,til_y+16) in dico_masks:
-                    dico_masks[(til_x,til_y+16)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                else:
-                    dico_masks[(til_x,til_y+16)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-        f_mesh.close()
-        if not tile.use_masks_for_inland:
-            UI.vprint(2,"   Taking care of inland water near shoreline")
-            f_mesh=open(mesh_file_name,"r")
-            for i in range(0,4):
-                f_mesh.readline()
-            nbr_pt_in=int(f_mesh.readline())
-            for i in range(0,2*nbr_pt_in+5):
-                f_mesh.readline()
-            nbr_tri_in=int(f_mesh.readline()) # read nbr of tris
-            step_stones=nbr_tri_in//100
-            percent=-1
-            for i in range(0,nbr_tri_in):
-                if i%step_stones==0:
-                    percent+=1
-                    UI.progress_bar(1, int(percent*5/10))
-                    if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
-                (n1,n2,n3,tri_type)=[int(x)-1 for x in f_mesh.readline().split()[:4]]
-                tri_type+=1
-                if not (tri_type & has_water)==1:
-                    continue
-                (lon1,lat1)=pt_in[5*n1:5*n1+2]
-                (lon2,lat2)=pt_in[5*n2:5*n2+2]
-                (lon3,lat3)=pt_in[5*n3:5*n3+2]
-                bary_lat=(lat1+lat2+lat3)/3
-                bary_lon=(lon1+lon2+lon3)/3
-                (til_x,til_y)=GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mask_zl)
-                if til_x < til_x_min-16 or til_x > til_x_max+16 or til_y < til_y_min-16 or til_y>til_y_max+16:
-                    continue
-                (til_x2,til_y2)=GEO.wgs84_to_orthogrid(bary_lat,bary_lon,tile.mask_zl+2)
-                a=(til_x2//16)%4
-                b=(til_y2//16)%4
-                # Here an inland water tri is added ONLY if sea water tri were already added for this mask extent
-                if (til_x,til_y) in dico_masks:
-                    if (til_x,til_y) in dico_masks_inland:
-                        dico_masks_inland[(til_x,til_y)].append((lat1,lon1,lat2,lon2,lat3,lon3))
-                    else:
-                        dico_masks_inland[(til_x,til_y)]=[(lat1,lon1,lat2,lon2,lat3,lon3)]
-            f_mesh.close()
+    buckets=water_triangle_buckets(tile,mesh_file_name_list,til_x_min,til_y_min,til_x_max,til_y_max)
+    if buckets is None: UI.exit_message_and_bottom_line(); return 0
+    (dico_masks,dico_masks_inland)=buckets
     UI.vprint(1,"-> Construction of the masks")
     if tile.masks_use_DEM_too:
         try:
@@ -252,19 +227,9 @@ def build_masks(tile,for_imagery=False):
             mask_draw.polygon([(px1,py1),(px2,py2),(px3,py3),(px4,py4)],fill='white')
         # 3a)  We overwrite the white part of the mask with grey (ratio_water dependent) where inland water was detected in the first part above   
         if (til_x,til_y) in dico_masks_inland:    
-            for (lat1,lon1,lat2,lon2,lat3,lon3) in dico_masks_inland[(til_x,til_y)]:
-                (px1,py1)=GEO.wgs84_to_pix(lat1,lon1,tile.mask_zl)
-                (px2,py2)=GEO.wgs84_to_pix(lat2,lon2,tile.mask_zl)
-                (px3,py3)=GEO.wgs84_to_pix(lat3,lon3,tile.mask_zl)
-                px1-=px0; px2-=px0; px3-=px0; py1-=py0; py2-=py0; py3-=py0
-                mask_draw.polygon([(px1,py1),(px2,py2),(px3,py3)],fill=sea_level) #int(255*(1-tile.ratio_water)))   
+            draw_triangles(mask_draw,*triangles_to_pixels(dico_masks_inland[(til_x,til_y)],tile.mask_zl,px0,py0),sea_level) #int(255*(1-tile.ratio_water)))   
         # 3b) We overwrite the white + grey part of the mask with black where sea water was detected in the first part above
-        for (lat1,lon1,lat2,lon2,lat3,lon3) in dico_masks[(til_x,til_y)]:
-            (px1,py1)=GEO.wgs84_to_pix(lat1,lon1,tile.mask_zl)
-            (px2,py2)=GEO.wgs84_to_pix(lat2,lon2,tile.mask_zl)
-            (px3,py3)=GEO.wgs84_to_pix(lat3,lon3,tile.mask_zl)
-            px1-=px0; px2-=px0; px3-=px0; py1-=py0; py2-=py0; py3-=py0
-            mask_draw.polygon([(px1,py1),(px2,py2),(px3,py3)],fill='black')
+        draw_triangles(mask_draw,*triangles_to_pixels(dico_masks[(til_x,til_y)],tile.mask_zl,px0,py0),'black')
         del(mask_draw)
         #mask_im=mask_im.convert("L") 
         img_array=numpy.array(mask_im,dtype=numpy.uint8)
@@ -401,17 +366,11 @@ def build_masks(tile,for_imagery=False):
 
 ##############################################################################
 def triangulation_to_image(name,pixel_size,grid_size_or_bbox):
-    f_node = open(name+'.1.node','r')
-    nbr_pt=int(f_node.readline().split()[0])
-    vertices=numpy.zeros(2*nbr_pt)
-    for i in range(0,nbr_pt):
-        # Triangle .node files have the node number in front
-        vertices[2*i:2*i+2]=[float(x) for x in f_node.readline().split()[1:3]]
-    f_node.close()
-    xmin=vertices[::2].min()
-    xmax=vertices[::2].max()
-    ymin=vertices[1::2].min()
-    ymax=vertices[1::2].max()
+    vertices=TRI.read_node_file(name+'.1.node')[0][:,:2]
+    xmin=vertices[:,0].min()
+    xmax=vertices[:,0].max()
+    ymin=vertices[:,1].min()
+    ymax=vertices[:,1].max()
     if isinstance(grid_size_or_bbox,tuple): # bbox
         bbox = grid_size_or_bbox
         (xmin,ymin,xmax,ymax)=bbox
@@ -423,23 +382,15 @@ def triangulation_to_image(name,pixel_size,grid_size_or_bbox):
         ymax=ceil((ymax+grid_size)/grid_size)*grid_size
     mask_im=Image.new("1",(int((xmax-xmin)/pixel_size),int((ymax-ymin)/pixel_size)))
     mask_draw=ImageDraw.Draw(mask_im)
-    f_ele  = open(name+'.1.ele','r')
-    nbr_tri=int(f_ele.readline().split()[0])
-    for i in range(nbr_tri):
-        (n1,n2,n3,tritype)=[int(x)-1 for x in f_ele.readline().split()[1:5]]
-        tritype+=1
-        if not tritype: continue
-        (x1,y1)=vertices[2*n1:2*n1+2]
-        (x2,y2)=vertices[2*n2:2*n2+2]
-        (x3,y3)=vertices[2*n3:2*n3+2]
-        (px1,py1)=[round((x1-xmin)/pixel_size),round((y1-ymin)/pixel_size)]
-        (px2,py2)=[round((x2-xmin)/pixel_size),round((y2-ymin)/pixel_size)]
-        (px3,py3)=[round((x3-xmin)/pixel_size),round((y3-ymin)/pixel_size)]
+    (triangles,tritypes)=TRI.read_ele_file(name+'.1.ele')
+    # same rounding (half to even) as round()
+    pixels=numpy.column_stack((numpy.round((vertices[:,0]-xmin)/pixel_size),numpy.round((vertices[:,1]-ymin)/pixel_size))).astype(numpy.int64)
+    for (p1,p2,p3) in pixels[triangles[tritypes!=0]].tolist():
         try:
-            mask_draw.polygon([(px1,py1),(px2,py2),(px3,py3)],fill='white')
+            mask_draw.polygon([tuple(p1),tuple(p2),tuple(p3)],fill='white')
         except:
             pass
-    f_ele.close()
+    TRI.clear_cache()
     return ((xmin,ymin,xmax,ymax),ImageOps.flip(mask_im).convert("L"))
 ##############################################################################
 
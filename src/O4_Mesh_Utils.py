@@ -3,8 +3,20 @@ import sys
 import os
 import pickle
 import subprocess
+import shutil
+import struct
+import threading
+import hashlib
+import pathlib
+import urllib.parse
+import urllib.request
 import numpy
 import requests
+try:
+    import py7zr
+    has_py7zr=True
+except:
+    has_py7zr=False
 from math import sqrt, cos, pi
 import O4_DEM_Utils as DEM
 import O4_UI_Utils as UI
@@ -12,6 +24,7 @@ import O4_File_Names as FNAMES
 import O4_Geo_Utils as GEO
 import O4_Vector_Utils as VECT
 import O4_OSM_Utils as OSM
+import O4_Triangle_Utils as TRI
 import O4_Version
 
 if 'dar' in sys.platform:
@@ -30,6 +43,33 @@ else:
     sort_mesh_cmd   = os.path.join(FNAMES.Utils_dir,"moulinette ")
     unzip_cmd       = "7z "
 
+# When set, Step 2 starts Triangle4XP with min_angle=0 alongside the run with
+# the configured min_angle, the first being kept only when the second fails.
+# Not done when less than speculative_mesh_min_ram GB of RAM are available. 
+speculative_mesh=False
+speculative_mesh_min_ram=8
+speculative_mesh_stats={'runs':0,'saves':0,'saved_time':0}
+
+# Step 2 records the hashes of its inputs next to the mesh, and does not run
+# Triangle4XP and its post-processing again when none of them changed since
+# (unless force_mesh_rebuild is set, from the command line or the GUI).
+use_mesh_cache=True
+force_mesh_rebuild=False
+mesh_manifest_version=1
+# tile settings recorded in the manifest, besides the mesh command
+mesh_tile_vars=('curvature_tol','apt_curv_tol','apt_curv_ext','coast_curv_tol','coast_curv_ext','limit_tris','hmin','min_angle',
+        'sea_smoothing_mode','water_smoothing','iterate','custom_dem','fill_nodata')
+
+# Before Triangle4XP is run, the number of triangles it will make is 
+# predicted from the curvature of the DEM and the number of input nodes,
+# with coefficients fitted to the previous builds (kept in a history file)
+# once there are mesh_history_min_fit of them. The default coefficients are
+# uncalibrated : set on the synthetic tiles of the mesh_estimate check of 
+# tools/O4_Checks.py, they only give an order of magnitude until the history
+# has been filled.
+mesh_history_size=500
+mesh_history_min_fit=5
+default_estimate_coefficients=(22.5,5.0)
 
 community_server=False
 if os.path.exists(os.path.join(FNAMES.Ortho4XP_dir,"community_server.txt")):
@@ -48,38 +88,173 @@ if os.path.exists(os.path.join(FNAMES.Ortho4XP_dir,"community_server.txt")):
     except:
         pass
 
+# A mirror of the community server (http(s):// or file:// base url, or a 
+# local directory), used in its place when set. Archives are downloaded by
+# chunks to a .part file, resumed (HTTP Range) after a broken connection or
+# an interrupted session, and checked against the SHA-256 manifest of the
+# server (sha256sum format) when it provides one.
+community_mirror=''
+community_manifest='SHA256SUMS'
+# bytes of an unfinished chunk are lost when the connection breaks
+community_chunk_size=2**16
+community_max_retries=3
+
+##############################################################################
+def community_base_url():
+    if community_mirror:
+        base_url=community_mirror
+        if os.path.isdir(base_url):
+            base_url=pathlib.Path(os.path.abspath(base_url)).as_uri()
+        return base_url if base_url[-1]=='/' else base_url+'/'
+    return community_prefix if community_server else None
+##############################################################################
+
+##############################################################################
+def local_file(url):
+    # The path behind a file:// url, None for other urls.
+    parsed_url=urllib.parse.urlparse(url)
+    return urllib.request.url2pathname(parsed_url.path) if parsed_url.scheme=='file' else None
+##############################################################################
+
+##############################################################################
+def download_file(url,file_name,progress=None):
+    # Downloads url to file_name through file_name+'.part', resuming from the 
+    # bytes already there. Returns the HTTP status (200 when the file is
+    # complete, -1 if interrupted by the user, the .part is then kept).
+    part_file=file_name+'.part'
+    offset=os.path.getsize(part_file) if os.path.isfile(part_file) else 0
+    source=local_file(url)
+    if source is not None:
+        if not os.path.isfile(source): return 404
+        r=None
+        total=os.path.getsize(source)
+        if offset>total: offset=0
+        data=open(source,'rb')
+        data.seek(offset)
+        chunks=iter(lambda: data.read(community_chunk_size),b'')
+    else:
+        r=requests.get(url,headers={'Range':'bytes='+str(offset)+'-'} if offset else {},stream=True,timeout=30)
+        if r.status_code==416:
+            # nothing left to download, unless the .part is not the right file
+            r.close()
+            if r.headers.get('Content-Range','').split('/')[-1]==str(offset):
+                os.replace(part_file,file_name)
+                return 200
+            os.remove(part_file)
+            return download_file(url,file_name,progress)
+        if r.status_code not in (200,206):
+            r.close()
+            return r.status_code
+        if r.status_code==200: offset=0
+        total=offset+int(r.headers['Content-Length']) if 'Content-Length' in r.headers else None
+        chunks=r.iter_content(community_chunk_size)
+    if offset: UI.vprint(1,"   Resuming the download after",UI.human_print(offset,'B')+".")
+    try:
+        with open(part_file,'ab' if offset else 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                offset+=len(chunk)
+                if progress is not None and total: UI.progress_bar(progress,int(100*offset/total))
+                if UI.red_flag: return -1
+    finally:
+        if r is not None: r.close()
+        else: data.close()
+    if total is not None and offset!=total:
+        raise Exception("Connection closed after "+str(offset)+" of "+str(total)+" bytes.")
+    os.replace(part_file,file_name)
+    return 200
+##############################################################################
+
+##############################################################################
+def read_community_manifest(base_url):
+    # {file name: sha256} from the manifest of the server, None if there is none.
+    url=base_url+community_manifest
+    try:
+        source=local_file(url)
+        if source is not None:
+            with open(source,'r') as f: content=f.read()
+        else:
+            r=requests.get(url,timeout=30)
+            if r.status_code!=200: return None
+            content=r.text
+    except:
+        return None
+    manifest={}
+    for line in content.splitlines():
+        items=line.split()
+        if len(items)==2: manifest[items[1].lstrip('*')]=items[0].lower()
+    return manifest
+##############################################################################
+
+##############################################################################
+def extract_archive(archive,dest_dir):
+    # Same as 7z e (the files of the archive land in dest_dir, whatever their
+    # path inside it), in process when py7zr is available.
+    if not has_py7zr:
+        return not subprocess.call([unzip_cmd.strip(),'e','-y','-o'+dest_dir,archive])
+    tmp_dir=archive+'.dir'
+    try:
+        with py7zr.SevenZipFile(archive,'r') as z:
+            z.extractall(path=tmp_dir)
+        for (dir_path,dir_names,file_names) in os.walk(tmp_dir):
+            for file_name in file_names:
+                os.replace(os.path.join(dir_path,file_name),os.path.join(dest_dir,file_name))
+    except Exception as e:
+        UI.vprint(1,"   ",e)
+        return False
+    finally:
+        shutil.rmtree(tmp_dir,ignore_errors=True)
+    return True
+##############################################################################
+
+##############################################################################
 def community_mesh(tile):
-    if not community_server:
+    base_url=community_base_url()
+    if not base_url:
         UI.exit_message_and_bottom_line("\nERROR: No community server defined in community_server.txt")
         return 0
-    url=community_prefix+os.path.basename(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))+'.7z'
+    mesh_file=FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)
+    archive_name=os.path.basename(mesh_file)+'.7z'
+    url=base_url+archive_name
     timer=time.time()
     UI.vprint(0,"Querying",url,"...")
-    try:
-        r=requests.get(url,timeout=30)
-        if '[200]' in str(r):
-            UI.vprint(0,"We've got something !")
-            f=open(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)+'.7z','wb')
-            f.write(r.content)
-            f.close()
-            if subprocess.call([unzip_cmd.strip(),'e','-y','-o'+tile.build_dir,FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)+".7z"]):
-                UI.exit_message_and_bottom_line("\nERROR: Could not extract community_mesh from archive.")
+    attempt=0
+    while True:
+        try:
+            status=download_file(url,mesh_file+'.7z',progress=1)
+            break
+        except Exception as e:
+            attempt+=1
+            if attempt>community_max_retries:
+                UI.exit_message_and_bottom_line("\nERROR: Network or server unreachable:\n"+str(e))
                 return 0
-            os.remove(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)+'.7z')
-            UI.timings_and_bottom_line(timer)
-            return 1
-        elif '[40' in str(r):
-            UI.exit_message_and_bottom_line("\nSORRY: Community server does not propose that mesh: "+str(r))
-            return 0
-        elif '[50' in str(r):
-            UI.exit_message_and_bottom_line("\nSORRY: Community server seems to be down or struggling: "+str(r))
-            return 0
-        else:
-            UI.exit_message_and_bottom_line("\nSORRY: Community server seems to be down or struggling: "+str(r))
-            return 0
-    except Exception as e:
-        UI.exit_message_and_bottom_line("\nERROR: Network or server unreachable:\n"+str(e))
+            UI.vprint(1,"   Download interrupted ("+str(e)+"), trying again.")
+    if status==-1:
+        UI.exit_message_and_bottom_line("\nDownload interrupted, it will be resumed next time.")
+        return 0
+    elif status//100==4:
+        UI.exit_message_and_bottom_line("\nSORRY: Community server does not propose that mesh: ["+str(status)+"]")
+        return 0
+    elif status!=200:
+        UI.exit_message_and_bottom_line("\nSORRY: Community server seems to be down or struggling: ["+str(status)+"]")
+        return 0
+    UI.vprint(0,"We've got something !")
+    manifest=read_community_manifest(base_url)
+    if manifest is None or archive_name not in manifest:
+        UI.vprint(1,"   WARNING: No SHA-256 checksum on the server for",archive_name+", the archive could not be verified.")
+    elif file_sha256(mesh_file+'.7z')!=manifest[archive_name]:
+        os.remove(mesh_file+'.7z')
+        UI.exit_message_and_bottom_line("\nERROR: The SHA-256 checksum of the downloaded archive does not match that of the server, it was removed.")
+        return 0
+    if not extract_archive(mesh_file+'.7z',tile.build_dir) or not os.path.isfile(mesh_file):
+        UI.exit_message_and_bottom_line("\nERROR: Could not extract community_mesh from archive.")
         return 0
+    os.remove(mesh_file+'.7z')
+    try: convert_mesh_file(mesh_file)
+    except: UI.vprint(1,"WARNING: Could not write the binary counterpart of the mesh, the text mesh will be used.")
+    UI.timings_and_bottom_line(timer)
+    return 1
+##############################################################################
         
         
         
@@ -90,6 +265,20 @@ def is_in_region(lat,lon,latmin,latmax,lonmin,lonmax):
     return lat>=latmin and lat<=latmax and lon>=lonmin and lon<=lonmax
 ##############################################################################
 
+##############################################################################
+def rectangles_mask(shape,rowmin,rowmax,colmin,colmax):
+    # Union of the array[rowmin:rowmax+1,colmin:colmax+1] for arrays of bounds,
+    # as a boolean array : +1/-1 at the corners of each rectangle, summed 
+    # along both axes. Empty rectangles are left aside.
+    (nrows,ncols)=shape
+    keep=(rowmin<=rowmax)&(colmin<=colmax)
+    (rowmin,rowmax,colmin,colmax)=(rowmin[keep],rowmax[keep]+1,colmin[keep],colmax[keep]+1)
+    corners=numpy.concatenate((rowmin*(ncols+1)+colmin,rowmax*(ncols+1)+colmax,rowmin*(ncols+1)+colmax,rowmax*(ncols+1)+colmin))
+    signs=numpy.repeat(numpy.array([1,1,-1,-1],dtype=numpy.int64),len(rowmin))
+    counts=numpy.bincount(corners,weights=signs,minlength=(nrows+1)*(ncols+1)).reshape((nrows+1,ncols+1))
+    return counts.cumsum(axis=0).cumsum(axis=1)[:-1,:-1]>0.5
+##############################################################################
+
 ##############################################################################
 def build_curv_tol_weight_map(tile,weight_array):
     if tile.apt_curv_tol!=tile.curvature_tol and tile.apt_curv_tol>0:
@@ -101,15 +290,16 @@ def build_curv_tol_weight_map(tile,weight_array):
         except:
             UI.vprint(1,"   WARNING: File",FNAMES.apt_file(tile),"is missing (erased after Step 1?), cannot check airport info for upgraded zoomlevel.")
             dico_airports={}
-        for airport in dico_airports:
-            (xmin,ymin,xmax,ymax)=dico_airports[airport]['boundary'].bounds
+        if dico_airports:
+            # airport boundary boxes extended by apt_curv_ext (km) 
+            (xmin,ymin,xmax,ymax)=numpy.array([dico_airports[airport]['boundary'].bounds for airport in dico_airports],dtype=numpy.float64).T
             x_shift=1000*tile.apt_curv_ext*GEO.m_to_lon(tile.lat) 
             y_shift=1000*tile.apt_curv_ext*GEO.m_to_lat
-            colmin=max(round((xmin-x_shift)*1000),0)
-            colmax=min(round((xmax+x_shift)*1000),1000)
-            rowmax=min(round(((1-ymin)+y_shift)*1000),1000)
-            rowmin=max(round(((1-ymax)-y_shift)*1000),0)
-            weight_array[rowmin:rowmax+1,colmin:colmax+1]=tile.curvature_tol/tile.apt_curv_tol 
+            colmin=numpy.maximum(numpy.round((xmin-x_shift)*1000),0).astype(numpy.int64)
+            colmax=numpy.minimum(numpy.round((xmax+x_shift)*1000),1000).astype(numpy.int64)
+            rowmax=numpy.minimum(numpy.round(((1-ymin)+y_shift)*1000),1000).astype(numpy.int64)
+            rowmin=numpy.maximum(numpy.round(((1-ymax)-y_shift)*1000),0).astype(numpy.int64)
+            weight_array[rectangles_mask(weight_array.shape,rowmin,rowmax,colmin,colmax)]=tile.curvature_tol/tile.apt_curv_tol 
     if tile.coast_curv_tol!=tile.curvature_tol:
         UI.vprint(1,"-> Modifying curv_tol weight map according to coastline location.")
         sea_layer=OSM.OSM_layer()
@@ -129,128 +319,343 @@ def build_curv_tol_weight_map(tile,weight_array):
             tags_of_interest=[]
             if not OSM.OSM_queries_to_OSM_layer(queries,sea_layer,tile.lat,tile.lon,tags_of_interest,cached_suffix='coastline'):
                 return 0
-        for nodeid in sea_layer.dicosmn:
-            (lonp,latp)=[float(x) for x in sea_layer.dicosmn[nodeid]]
-            if lonp<tile.lon or lonp>tile.lon+1 or latp<tile.lat or latp>tile.lat+1: continue
-            x_shift=1000*tile.coast_curv_ext*GEO.m_to_lon(tile.lat)
-            y_shift=tile.coast_curv_ext/(111.12)
-            colmin=max(round((lonp-tile.lon-x_shift)*1000),0)
-            colmax=min(round((lonp-tile.lon+x_shift)*1000),1000)
-            rowmax=min(round((tile.lat+1-latp+y_shift)*1000),1000)
-            rowmin=max(round((tile.lat+1-latp-y_shift)*1000),0)
-            weight_array[rowmin:rowmax+1,colmin:colmax+1]=numpy.maximum(weight_array[rowmin:rowmax+1,colmin:colmax+1],tile.curvature_tol/tile.coast_curv_tol) 
+        # a box of coast_curv_ext (km) around each coastline node of the tile
+        (lonp,latp)=numpy.array(list(sea_layer.dicosmn.values()),dtype=numpy.float64).reshape((-1,2)).T
         del(sea_layer)
+        inside=(lonp>=tile.lon)&(lonp<=tile.lon+1)&(latp>=tile.lat)&(latp<=tile.lat+1)
+        (lonp,latp)=(lonp[inside],latp[inside])
+        x_shift=1000*tile.coast_curv_ext*GEO.m_to_lon(tile.lat)
+        y_shift=tile.coast_curv_ext/(111.12)
+        colmin=numpy.maximum(numpy.round((lonp-tile.lon-x_shift)*1000),0).astype(numpy.int64)
+        colmax=numpy.minimum(numpy.round((lonp-tile.lon+x_shift)*1000),1000).astype(numpy.int64)
+        rowmax=numpy.minimum(numpy.round((tile.lat+1-latp+y_shift)*1000),1000).astype(numpy.int64)
+        rowmin=numpy.maximum(numpy.round((tile.lat+1-latp-y_shift)*1000),0).astype(numpy.int64)
+        coast=rectangles_mask(weight_array.shape,rowmin,rowmax,colmin,colmax)
+        weight_array[coast]=numpy.maximum(weight_array[coast],tile.curvature_tol/tile.coast_curv_tol) 
     # It could be of interest to write the weight file as a png for user editing    
     #from PIL import Image
     #Image.fromarray((weight_array!=1).astype(numpy.uint8)*255).save('weight.png')
     return
 ##############################################################################
 
+##############################################################################
+def smooth_sequentially(vertices,tris,passes):
+    # Same as setting, one triangle after the other in the order of tris, the
+    # altitude of the nodes of each triangle to their mean, for each pass. 
+    # The mean of a triangle only depends on the previous triangles sharing 
+    # a node with it, triangles are thus treated at once by levels of that 
+    # dependency, with the same floating point operations as one by one.
+    nbr_tris=len(tris)
+    if not nbr_tris: return
+    nodes=tris.ravel()
+    order=numpy.argsort(nodes,kind='stable')
+    same=nodes[order[1:]]==nodes[order[:-1]]
+    # previous triangle of each triangle corner, last triangle of each node
+    previous=numpy.full(3*nbr_tris,-1,dtype=numpy.int64)
+    previous[order[1:][same]]=order[:-1][same]//3
+    last=order[numpy.append(~same,True)]
+    previous=previous.reshape((nbr_tris,3))
+    has_previous=previous>=0
+    levels=numpy.zeros(nbr_tris,dtype=numpy.int64)
+    while True:
+        new_levels=numpy.where(has_previous,levels[previous]+1,0).max(axis=1)
+        if numpy.array_equal(new_levels,levels): break
+        levels=new_levels
+    by_level=numpy.argsort(levels,kind='stable')
+    bounds=numpy.searchsorted(levels[by_level],numpy.arange(levels.max()+2))
+    alt=vertices[2::6]
+    for j in range(passes):
+        means=numpy.zeros(nbr_tris)
+        for level in range(len(bounds)-1):
+            idx=by_level[bounds[level]:bounds[level+1]]
+            corners=numpy.where(has_previous[idx],means[previous[idx]],alt[tris[idx]])
+            means[idx]=(corners[:,0]+corners[:,1]+corners[:,2])/3
+        alt[nodes[last]]=means[last//3]
+    return
+##############################################################################
+
 ##############################################################################
 def post_process_nodes_altitudes(tile):
     dico_attributes=VECT.Vector_Map.dico_attributes 
-    f_node = open(FNAMES.output_node_file(tile),'r')
-    init_line_f_node=f_node.readline()
-    nbr_pt=int(init_line_f_node.split()[0])
-    vertices=numpy.zeros(6*nbr_pt)   
     UI.vprint(1,"-> Loading of the mesh computed by Triangle4XP.")
-    for i in range(0,nbr_pt):
-        vertices[6*i:6*i+6]=[float(x) for x in f_node.readline().split()[1:7]]
-    end_line_f_node=f_node.readline()
-    f_node.close()
+    (nodes,init_line_f_node,end_line_f_node)=TRI.read_node_file(FNAMES.output_node_file(tile))
+    vertices=nodes[:,:6].flatten()
     UI.vprint(1,"-> Post processing of altitudes according to vector data")
-    f_ele  = open(FNAMES.output_ele_file(tile),'r')
-    nbr_tri= int(f_ele.readline().split()[0])
-    water_tris=set()
-    sea_tris=set()
-    interp_alt_tris=set()
-    for i in range(nbr_tri):
-        line = f_ele.readline()
-        # triangle attributes are powers of 2, except for the dummy attributed which doesn't require post-treatment
-        if line[-2]=='0': continue  
-        (v1,v2,v3,attr)=[int(x)-1 for x in line.split()[1:5]]
-        attr+=1
-        if attr >= dico_attributes['INTERP_ALT']: 
-            interp_alt_tris.add((v1,v2,v3))
-        elif attr & dico_attributes['SEA']:
-            sea_tris.add((v1,v2,v3))
-        elif attr & dico_attributes['WATER'] or attr & dico_attributes['SEA_EQUIV']:
-            water_tris.add((v1,v2,v3))
+    (tris,attr)=TRI.read_ele_file(FNAMES.output_ele_file(tile))
+    # triangle attributes are powers of 2, except for the dummy attributed which doesn't require post-treatment
+    # (recognized by the last digit of the attribute)
+    treated=attr%10!=0
+    interp_alt=treated & (attr>=dico_attributes['INTERP_ALT'])
+    sea=treated & ~interp_alt & ((attr & dico_attributes['SEA'])>0)
+    water=treated & ~interp_alt & ~sea & ((attr & (dico_attributes['WATER']|dico_attributes['SEA_EQUIV']))>0)
+    # triangles are treated one at a time in the order of a set of them
+    water_tris=numpy.array(list(set(zip(*tris[water].T.tolist()))),dtype=numpy.int64).reshape((-1,3))
+    sea_tris=numpy.array(list(set(zip(*tris[sea].T.tolist()))),dtype=numpy.int64).reshape((-1,3))
+    interp_alt_nodes=numpy.unique(tris[interp_alt])
+    del(nodes,tris,attr)
     if tile.water_smoothing:
         UI.vprint(1,"   Smoothing inland water.")
-        for j in range(tile.water_smoothing):   
-            for (v1,v2,v3) in water_tris:
-                    zmean=(vertices[6*v1+2]+vertices[6*v2+2]+vertices[6*v3+2])/3
-                    vertices[6*v1+2]=zmean
-                    vertices[6*v2+2]=zmean
-                    vertices[6*v3+2]=zmean
+        smooth_sequentially(vertices,water_tris,tile.water_smoothing)
     UI.vprint(1,"   Smoothing of sea water.")
-    for (v1,v2,v3) in sea_tris:
-            if tile.sea_smoothing_mode=='zero':
-                vertices[6*v1+2]=0
-                vertices[6*v2+2]=0
-                vertices[6*v3+2]=0
-            elif tile.sea_smoothing_mode=='mean':
-                zmean=(vertices[6*v1+2]+vertices[6*v2+2]+vertices[6*v3+2])/3
-                vertices[6*v1+2]=zmean
-                vertices[6*v2+2]=zmean
-                vertices[6*v3+2]=zmean
-            else:
-                vertices[6*v1+2]=max(vertices[6*v1+2],0)
-                vertices[6*v2+2]=max(vertices[6*v2+2],0)
-                vertices[6*v3+2]=max(vertices[6*v3+2],0)
+    sea_nodes=numpy.unique(sea_tris)
+    if tile.sea_smoothing_mode=='zero':
+        vertices[6*sea_nodes+2]=0
+    elif tile.sea_smoothing_mode=='mean':
+        smooth_sequentially(vertices,sea_tris,1)
+    else:
+        vertices[6*sea_nodes+2]=numpy.maximum(vertices[6*sea_nodes+2],0)
     UI.vprint(1,"   Treatment of airports, roads and patches.")
-    for (v1,v2,v3) in interp_alt_tris:
-            vertices[6*v1+2]=vertices[6*v1+5]
-            vertices[6*v2+2]=vertices[6*v2+5]
-            vertices[6*v3+2]=vertices[6*v3+5]
-            vertices[6*v1+3]=0
-            vertices[6*v2+3]=0
-            vertices[6*v3+3]=0
-            vertices[6*v1+4]=0
-            vertices[6*v2+4]=0
-            vertices[6*v3+4]=0
+    vertices[6*interp_alt_nodes+2]=vertices[6*interp_alt_nodes+5]
+    vertices[6*interp_alt_nodes+3]=0
+    vertices[6*interp_alt_nodes+4]=0
     UI.vprint(1,"-> Writing output nodes file.")        
-    f_node = open(FNAMES.output_node_file(tile),'w')
-    f_node.write(init_line_f_node)
-    for i in range(0,nbr_pt):
-        f_node.write(str(i+1)+" "+' '.join(('{:.15f}'.format(x) for x in vertices[6*i:6*i+6]))+"\n")
-    f_node.write(end_line_f_node)
-    f_node.close()
+    TRI.write_node_file(FNAMES.output_node_file(tile),vertices.reshape((-1,6)),init_line_f_node,end_line_f_node)
     return vertices
 ##############################################################################
 
 ##############################################################################
-def write_mesh_file(tile,vertices):
-    UI.vprint(1,"-> Writing final mesh to the file "+FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))
-    f_ele  = open(FNAMES.output_ele_file(tile),'r')
-    nbr_vert=len(vertices)//6
-    nbr_tri=int(f_ele.readline().split()[0])
-    f=open(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon),"w")
+def as_written(values,decimals):
+    # values as read back from their '%.<decimals>f' text, the few within 
+    # rounding distance of a half unit (where numpy may round otherwise) 
+    # going through the text
+    scaled=values*10**decimals
+    rounded=numpy.round(scaled)/10**decimals
+    for i in numpy.flatnonzero(numpy.abs(scaled-numpy.floor(scaled)-0.5)<1e-6).tolist():
+        rounded.flat[i]=float('%.*f' % (decimals,values.flat[i]))
+    return rounded
+##############################################################################
+
+##############################################################################
+def write_mesh_file(tile,vertices,chunk_size=100000):
+    mesh_file=FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)
+    UI.vprint(1,"-> Writing final mesh to the file "+mesh_file)
+    (triangles,tri_attributes)=TRI.read_ele_file(FNAMES.output_ele_file(tile))
+    vertices=vertices.reshape((-1,6))
+    coords=numpy.column_stack((vertices[:,0]+tile.lon,vertices[:,1]+tile.lat,vertices[:,2]/100000))
+    normals=vertices[:,3:5]
+    nbr_vert=len(vertices)
+    nbr_tri=len(triangles)
+    f=open(mesh_file,"w")
     f.write("MeshVersionFormatted "+O4_Version.version+"\n")
     f.write("Dimension 3\n\n")
     f.write("Vertices\n")
     f.write(str(nbr_vert)+"\n")
-    for i in range(0,nbr_vert):
-        f.write('{:.7f}'.format(vertices[6*i]+tile.lon)+" "+\
-                '{:.7f}'.format(vertices[6*i+1]+tile.lat)+" "+\
-                '{:.7f}'.format(vertices[6*i+2]/100000)+" 0\n") 
+    for first in range(0,nbr_vert,chunk_size):
+        rows=coords[first:first+chunk_size]
+        f.write(("%.7f %.7f %.7f 0\n"*len(rows)) % tuple(rows.ravel().tolist()))
     f.write("\n")
     f.write("Normals\n")
     f.write(str(nbr_vert)+"\n")
-    for i in range(0,nbr_vert):
-        f.write('{:.2f}'.format(vertices[6*i+3])+" "+\
-                '{:.2f}'.format(vertices[6*i+4])+"\n")
+    for first in range(0,nbr_vert,chunk_size):
+        rows=normals[first:first+chunk_size]
+        f.write(("%.2f %.2f\n"*len(rows)) % tuple(rows.ravel().tolist()))
     f.write("\n")
     f.write("Triangles\n")
     f.write(str(nbr_tri)+"\n")
-    for i in range(0,nbr_tri):
-       f.write(' '.join(f_ele.readline().split()[1:])+"\n")
-    f_ele.close()
+    for first in range(0,nbr_tri,chunk_size):
+        rows=numpy.column_stack((triangles[first:first+chunk_size]+1,tri_attributes[first:first+chunk_size]))
+        f.write(("%d %d %d %d\n"*len(rows)) % tuple(rows.ravel().tolist()))
     f.close()
+    # the binary counterpart from the arrays in hand, with the values of the
+    # text mesh (convert_mesh_file is for existing text meshes only)
+    UI.vprint(1,"-> Writing its binary counterpart and triangle index.")
+    (coords,normals)=(as_written(coords,7),as_written(normals,2))
+    write_binary_mesh_file(mesh_file,float(O4_Version.version),coords,normals,triangles,tri_attributes)
+    write_mesh_index_file(mesh_file,*build_mesh_index(coords,triangles))
     return
 ##############################################################################
 
+##############################################################################
+def read_mesh_file(mesh_file):
+    # Returns (mesh_version,vertices,normals,triangles,tri_attributes) as numpy arrays,
+    # vertices are (lon,lat,alt/100000) and triangles are zero based node indices.
+    # Each section is parsed in a single numpy call rather than line by line.
+    f_mesh=open(mesh_file,"r")
+    mesh_version=float(f_mesh.readline().strip().split()[-1])
+    data=f_mesh.read()
+    f_mesh.close()
+    idx_vert=data.find('Vertices')
+    idx_norm=data.find('Normals',idx_vert)
+    idx_tri=data.find('Triangles',idx_norm)
+    idx_end=data.find('End',idx_tri)
+    if idx_end==-1: idx_end=len(data)
+    tmp=numpy.fromstring(data[idx_vert+8:idx_norm],dtype=numpy.float64,sep=' ')
+    nbr_nodes=int(tmp[0])
+    vertices=tmp[1:].reshape((nbr_nodes,-1))[:,:3].copy()
+    tmp=numpy.fromstring(data[idx_norm+7:idx_tri],dtype=numpy.float64,sep=' ')
+    normals=tmp[1:].reshape((nbr_nodes,-1))[:,:2].copy()
+    tmp=numpy.fromstring(data[idx_tri+9:idx_end],dtype=numpy.int64,sep=' ')
+    del(data)
+    nbr_tris=int(tmp[0])
+    tmp=tmp[1:].reshape((nbr_tris,-1))
+    triangles=(tmp[:,:3]-1).astype(numpy.int32)
+    tri_attributes=tmp[:,3].astype(numpy.int32)
+    return (mesh_version,vertices,normals,triangles,tri_attributes)
+##############################################################################
+
+##############################################################################
+# Binary sidecar of the .mesh file (same content, memory mappable) :
+# a 64 bytes header followed by the float64 vertices (N,3) and normals (N,2)
+# blocks and the int32 triangles (M,3) and attributes (M) blocks.
+# The size and mtime of the text mesh are recorded in the header so that a
+# sidecar which does not match its text mesh anymore is simply ignored.
+##############################################################################
+binary_mesh_magic=b'O4XPMESH'
+binary_mesh_format=1
+binary_mesh_header=struct.Struct('<8sIIdqqqq8x')
+
+def write_binary_mesh_file(mesh_file,mesh_version,vertices,normals,triangles,tri_attributes):
+    mesh_stat=os.stat(mesh_file)
+    bin_file=FNAMES.binary_mesh_file(mesh_file)
+    f=open(bin_file+'.tmp','wb')
+    f.write(binary_mesh_header.pack(binary_mesh_magic,binary_mesh_format,binary_mesh_header.size,mesh_version,
+            len(vertices),len(triangles),mesh_stat.st_size,mesh_stat.st_mtime_ns))
+    f.write(numpy.ascontiguousarray(vertices,dtype='<f8').tobytes())
+    f.write(numpy.ascontiguousarray(normals,dtype='<f8').tobytes())
+    f.write(numpy.ascontiguousarray(triangles,dtype='<i4').tobytes())
+    f.write(numpy.ascontiguousarray(tri_attributes,dtype='<i4').tobytes())
+    f.close()
+    os.replace(bin_file+'.tmp',bin_file)
+    return 1
+
+def read_binary_mesh_file(mesh_file):
+    # Same output as read_mesh_file but with read-only memory maps, or None if
+    # there is no (valid) sidecar for this mesh.
+    bin_file=FNAMES.binary_mesh_file(mesh_file)
+    try:
+        f=open(bin_file,'rb')
+        (magic,version,header_size,mesh_version,nbr_nodes,nbr_tris,size,mtime_ns)=binary_mesh_header.unpack(f.read(binary_mesh_header.size))
+        f.close()
+    except:
+        return None
+    if magic!=binary_mesh_magic or version!=binary_mesh_format:
+        return None
+    if os.path.isfile(mesh_file):
+        mesh_stat=os.stat(mesh_file)
+        if (mesh_stat.st_size,mesh_stat.st_mtime_ns)!=(size,mtime_ns):
+            UI.vprint(2,"   Binary mesh",bin_file,"is outdated, using the text mesh instead.")
+            return None
+    if os.path.getsize(bin_file)!=header_size+40*nbr_nodes+16*nbr_tris or not (nbr_nodes and nbr_tris):
+        return None
+    offset=header_size
+    vertices=numpy.memmap(bin_file,dtype='<f8',mode='r',offset=offset,shape=(nbr_nodes,3))
+    offset+=24*nbr_nodes
+    normals=numpy.memmap(bin_file,dtype='<f8',mode='r',offset=offset,shape=(nbr_nodes,2))
+    offset+=16*nbr_nodes
+    triangles=numpy.memmap(bin_file,dtype='<i4',mode='r',offset=offset,shape=(nbr_tris,3))
+    offset+=12*nbr_tris
+    tri_attributes=numpy.memmap(bin_file,dtype='<i4',mode='r',offset=offset,shape=(nbr_tris,))
+    return (mesh_version,vertices,normals,triangles,tri_attributes)
+
+def load_mesh(mesh_file):
+    # The binary sidecar if available, the text mesh (interchange format) otherwise.
+    mesh_data=read_binary_mesh_file(mesh_file)
+    if mesh_data is None:
+        mesh_data=read_mesh_file(mesh_file)
+    return mesh_data
+
+def convert_mesh_file(mesh_file):
+    # (Re)creates the binary sidecar and the triangle index of an existing 
+    # text mesh.
+    (mesh_version,vertices,normals,triangles,tri_attributes)=read_mesh_file(mesh_file)
+    write_binary_mesh_file(mesh_file,mesh_version,vertices,normals,triangles,tri_attributes)
+    write_mesh_index_file(mesh_file,*build_mesh_index(vertices,triangles))
+    return 1
+
+def remove_mesh_file(mesh_file):
+    for f in (mesh_file,FNAMES.binary_mesh_file(mesh_file),FNAMES.mesh_index_file(mesh_file)):
+        try: os.remove(f)
+        except: pass
+##############################################################################
+
+##############################################################################
+# Triangle index of the .mesh file : the triangles grouped by the orthogrid 
+# cell (at mesh_index_zl) of their barycenter, in CSR form, i.e. the ids of 
+# the triangles of the cell k (numbered row by row in a box of nx by ny 
+# cells from (til_x0,til_y0)) are ids[offsets[k]:offsets[k+1]], in 
+# increasing order. Stored beside the mesh after a 64 bytes header, and 
+# ignored when it does not match its text mesh anymore, as the sidecar.
+##############################################################################
+mesh_index_zl=16
+mesh_index_magic=b'O4XPMIDX'
+mesh_index_format=1
+mesh_index_header=struct.Struct('<8sIIqqqqqq')
+
+def build_mesh_index(vertices,triangles,zoomlevel=None):
+    # Returns (zoomlevel,til_x0,til_y0,nx,ny,offsets,ids)
+    zoomlevel=zoomlevel or mesh_index_zl
+    bary_lon=(vertices[triangles[:,0],0]+vertices[triangles[:,1],0]+vertices[triangles[:,2],0])/3
+    bary_lat=(vertices[triangles[:,0],1]+vertices[triangles[:,1],1]+vertices[triangles[:,2],1])/3
+    (til_x,til_y)=GEO.wgs84_to_orthogrid_array(bary_lat,bary_lon,zoomlevel)
+    if not len(til_x):
+        return (zoomlevel,0,0,0,0,numpy.zeros(1,dtype=numpy.int64),numpy.zeros(0,dtype=numpy.int32))
+    (til_x0,til_y0)=(int(til_x.min()),int(til_y.min()))
+    (nx,ny)=((int(til_x.max())-til_x0)//16+1,(int(til_y.max())-til_y0)//16+1)
+    cells=(til_y-til_y0)//16*nx+(til_x-til_x0)//16
+    ids=numpy.argsort(cells,kind='stable').astype(numpy.int32)
+    offsets=numpy.zeros(nx*ny+1,dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(cells,minlength=nx*ny),out=offsets[1:])
+    return (zoomlevel,til_x0,til_y0,nx,ny,offsets,ids)
+
+def write_mesh_index_file(mesh_file,zoomlevel,til_x0,til_y0,nx,ny,offsets,ids):
+    mesh_stat=os.stat(mesh_file)
+    index_file=FNAMES.mesh_index_file(mesh_file)
+    f=open(index_file+'.tmp','wb')
+    f.write(mesh_index_header.pack(mesh_index_magic,mesh_index_format,zoomlevel,til_x0,til_y0,nx,ny,mesh_stat.st_size,mesh_stat.st_mtime_ns))
+    f.write(numpy.ascontiguousarray(offsets,dtype='<i8').tobytes())
+    f.write(numpy.ascontiguousarray(ids,dtype='<i4').tobytes())
+    f.close()
+    os.replace(index_file+'.tmp',index_file)
+    return 1
+
+def read_mesh_index_file(mesh_file):
+    # Same output as build_mesh_index with read-only memory maps, or None if
+    # there is no (valid) index for this mesh.
+    index_file=FNAMES.mesh_index_file(mesh_file)
+    try:
+        f=open(index_file,'rb')
+        (magic,version,zoomlevel,til_x0,til_y0,nx,ny,size,mtime_ns)=mesh_index_header.unpack(f.read(mesh_index_header.size))
+        f.close()
+    except:
+        return None
+    if magic!=mesh_index_magic or version!=mesh_index_format or not nx*ny:
+        return None
+    mesh_stat=os.stat(mesh_file)
+    if (mesh_stat.st_size,mesh_stat.st_mtime_ns)!=(size,mtime_ns):
+        UI.vprint(2,"   Triangle index",index_file,"is outdated.")
+        return None
+    offsets=numpy.memmap(index_file,dtype='<i8',mode='r',offset=mesh_index_header.size,shape=(nx*ny+1,))
+    if os.path.getsize(index_file)!=mesh_index_header.size+8*(nx*ny+1)+4*int(offsets[-1]):
+        return None
+    ids=numpy.memmap(index_file,dtype='<i4',mode='r',offset=mesh_index_header.size+8*(nx*ny+1),shape=(int(offsets[-1]),))
+    return (zoomlevel,til_x0,til_y0,nx,ny,offsets,ids)
+
+def load_mesh_index(mesh_file,vertices,triangles):
+    # The stored index if valid, otherwise built (and stored) from the mesh. 
+    index=read_mesh_index_file(mesh_file)
+    if index is None or index[0]!=mesh_index_zl:
+        index=build_mesh_index(vertices,triangles)
+        try: write_mesh_index_file(mesh_file,*index)
+        except: pass
+    return index
+
+def query_mesh_index(index,latmin,latmax,lonmin,lonmax):
+    # Ids (increasing) of a superset of the triangles whose barycenter lies 
+    # in the given box : those of the cells it meets and of the cells around,
+    # which are not to be missed because of rounding.
+    (zoomlevel,til_x0,til_y0,nx,ny,offsets,ids)=index
+    (til_x_min,til_y_min)=GEO.wgs84_to_orthogrid(latmax,lonmin,zoomlevel)
+    (til_x_max,til_y_max)=GEO.wgs84_to_orthogrid(latmin,lonmax,zoomlevel)
+    col_min=max((til_x_min-til_x0)//16-1,0)
+    col_max=min((til_x_max-til_x0)//16+1,nx-1)
+    row_min=max((til_y_min-til_y0)//16-1,0)
+    row_max=min((til_y_max-til_y0)//16+1,ny-1)
+    if col_min>col_max or row_min>row_max:
+        return numpy.zeros(0,dtype=numpy.int64)
+    selection=numpy.concatenate([ids[offsets[row*nx+col_min]:offsets[row*nx+col_max+1]] for row in range(row_min,row_max+1)])
+    return numpy.sort(selection).astype(numpy.int64)
+##############################################################################
+
 ##############################################################################
 # Build a textured .obj wavefront over the extent of an orthogrid cell
 ##############################################################################
@@ -261,34 +666,25 @@ def extract_mesh_to_obj(mesh_file,til_x_left,til_y_top,zoomlevel,provider_code):
     (latmin,lonmax)=GEO.gtile_to_wgs84(til_x_left+16,til_y_top+16,zoomlevel)
     obj_file_name=FNAMES.obj_file(til_x_left,til_y_top,zoomlevel,provider_code)
     mtl_file_name=FNAMES.mtl_file(til_x_left,til_y_top,zoomlevel,provider_code)
-    f_mesh=open(mesh_file,"r")
-    for i in range(4):
-        f_mesh.readline()
-    nbr_pt_in=int(f_mesh.readline())
-    UI.vprint(1,"    Reading nodes...")
-    pt_in=numpy.zeros(5*nbr_pt_in,'float')
-    for i in range(nbr_pt_in):
-        pt_in[5*i:5*i+3]=[float(x) for x in f_mesh.readline().split()[:3]]
-    for i in range(3):
-        f_mesh.readline()
-    for i in range(nbr_pt_in):
-        pt_in[5*i+3:5*i+5]=[float(x) for x in f_mesh.readline().split()[:2]]
-    for i in range(0,2): # skip 2 lines
-        f_mesh.readline()
+    UI.vprint(1,"    Reading nodes and triangles...")
+    (mesh_version,vertices,normals,triangles,tri_attributes)=load_mesh(mesh_file)
+    # only the triangles (and their nodes) of the cells around the region
+    selection=query_mesh_index(load_mesh_index(mesh_file,vertices,triangles),latmin,latmax,lonmin,lonmax)
+    tri_list=triangles[selection].tolist()
+    nodes=numpy.unique(triangles[selection])
+    pt_in=dict(zip(nodes.tolist(),numpy.column_stack((vertices[nodes],normals[nodes])).tolist()))
+    del(vertices,normals,triangles,tri_attributes)
     if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
-    UI.vprint(1,"    Reading triangles...")
-    nbr_tri_in=int(f_mesh.readline()) # read nbr of tris
     textured_nodes={}
     textured_nodes_inv={}
     nodes_st_coord={}
     len_textured_nodes=0
     dico_new_tri={}
     len_dico_new_tri=0
-    for i in range(0,nbr_tri_in):
-        (n1,n2,n3)=[int(x)-1 for x in f_mesh.readline().split()[:3]]
-        (lon1,lat1,z1,u1,v1)=pt_in[5*n1:5*n1+5]
-        (lon2,lat2,z2,u2,v2)=pt_in[5*n2:5*n2+5]
-        (lon3,lat3,z3,u3,v3)=pt_in[5*n3:5*n3+5]
+    for (n1,n2,n3) in tri_list:
+        (lon1,lat1,z1,u1,v1)=pt_in[n1]
+        (lon2,lat2,z2,u2,v2)=pt_in[n2]
+        (lon3,lat3,z3,u3,v3)=pt_in[n3]
         if is_in_region((lat1+lat2+lat3)/3.0,(lon1+lon2+lon3)/3.0,latmin,latmax,lonmin,lonmax):
             if n1 not in textured_nodes_inv:
                 len_textured_nodes+=1 
@@ -318,13 +714,13 @@ def extract_mesh_to_obj(mesh_file,til_x_left,til_y_top,zoomlevel,provider_code):
     f=open(obj_file_name,"w")
     for i in range(1,nbr_vert+1):
         j=textured_nodes[i]
-        f.write("v "+'{:.9f}'.format(pt_in[5*j]-lonmin)+" "+\
-                '{:.9f}'.format(pt_in[5*j+1]-latmin)+" "+\
-                '{:.9f}'.format(pt_in[5*j+2])+"\n") 
+        f.write("v "+'{:.9f}'.format(pt_in[j][0]-lonmin)+" "+\
+                '{:.9f}'.format(pt_in[j][1]-latmin)+" "+\
+                '{:.9f}'.format(pt_in[j][2])+"\n") 
     f.write("\n")
     for i in range(1,nbr_vert+1):
         j=textured_nodes[i]
-        f.write("vn "+'{:.9f}'.format(pt_in[5*j+3])+" "+'{:.9f}'.format(pt_in[5*j+4])+" "+'{:.9f}'.format(sqrt(max(1-pt_in[5*j+3]**2-pt_in[5*j+4]**2,0)))+"\n")
+        f.write("vn "+'{:.9f}'.format(pt_in[j][3])+" "+'{:.9f}'.format(pt_in[j][4])+" "+'{:.9f}'.format(sqrt(max(1-pt_in[j][3]**2-pt_in[j][4]**2,0)))+"\n")
     f.write("\n")
     for i in range(1,nbr_vert+1):
         j=textured_nodes[i]
@@ -335,7 +731,6 @@ def extract_mesh_to_obj(mesh_file,til_x_left,til_y_top,zoomlevel,provider_code):
     for i in range(0,nbr_tri):
         (one,two,three)=dico_new_tri[i]
         f.write("f "+str(one)+"/"+str(one)+"/"+str(one)+" "+str(two)+"/"+str(two)+"/"+str(two)+" "+str(three)+"/"+str(three)+"/"+str(three)+"\n")
-    f_mesh.close()
     f.close()
     # then the mtl file
     f=open(mtl_file_name,'w')
@@ -346,6 +741,344 @@ def extract_mesh_to_obj(mesh_file,til_x_left,til_y_top,zoomlevel,provider_code):
 ##############################################################################
 
 
+##############################################################################
+def available_ram():
+    # in GB, None when it cannot be determined
+    try:
+        with open('/proc/meminfo','r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'): return int(line.split()[1])/2**20
+    except:
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available/2**30
+    except:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')/2**30
+    except:
+        return None
+##############################################################################
+
+##############################################################################
+def run_mesh_cmd(mesh_cmd):
+    # Triangle4XP with its output printed, returns its exit code
+    fingers_crossed=subprocess.Popen(mesh_cmd,stdout=subprocess.PIPE,bufsize=0)
+    while True:
+        line = fingers_crossed.stdout.readline()
+        if not line: 
+            break
+        else:
+            try:
+                print(line.decode("utf-8")[:-1])
+            except:
+                pass
+    return fingers_crossed.wait()
+##############################################################################
+
+##############################################################################
+def start_speculative_mesh(tile,mesh_cmd):
+    # Starts mesh_cmd silently in a sub directory of the build dir, on links 
+    # to the input files, returns the process or None when there is not 
+    # enough RAM available for two runs.
+    ram=available_ram()
+    if ram is None or ram<speculative_mesh_min_ram:
+        UI.vprint(1,"   Not enough available RAM ("+('unknown' if ram is None else '{:.1f}'.format(ram)+' GB')+\
+                ") for a speculative run of Triangle4XP with min_angle=0.")
+        return None
+    speculative_dir=FNAMES.speculative_mesh_dir(tile)
+    if os.path.isdir(speculative_dir): shutil.rmtree(speculative_dir)
+    os.makedirs(speculative_dir)
+    for file_name in (FNAMES.input_poly_file(tile),FNAMES.input_node_file(tile),FNAMES.input_ele_file(tile)):
+        if not os.path.isfile(file_name): continue
+        try: os.link(file_name,os.path.join(speculative_dir,os.path.basename(file_name)))
+        except: shutil.copy(file_name,speculative_dir)
+    UI.vprint(1,"   Speculative run of Triangle4XP with min_angle=0 in parallel.")
+    speculative=subprocess.Popen(mesh_cmd[:-1]+[os.path.join(speculative_dir,os.path.basename(mesh_cmd[-1]))],\
+            stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    # its duration, even when it ends before anyone waits for it
+    speculative.timer=time.time()
+    speculative.watcher=threading.Thread(target=time_process,args=[speculative],daemon=True)
+    speculative.watcher.start()
+    return speculative
+##############################################################################
+
+##############################################################################
+def time_process(process):
+    process.wait()
+    process.elapsed=time.time()-process.timer
+##############################################################################
+
+##############################################################################
+def finish_speculative_mesh(tile,speculative,keep):
+    # Waits for the speculative run and moves its output in place if it is 
+    # to be kept, kills it otherwise. Returns its exit code. 
+    if keep:
+        returncode=speculative.wait()
+        if not returncode:
+            for file_name in (FNAMES.output_node_file(tile),FNAMES.output_ele_file(tile),FNAMES.output_poly_file(tile)):
+                speculative_file=os.path.join(FNAMES.speculative_mesh_dir(tile),os.path.basename(file_name))
+                if os.path.isfile(speculative_file): os.replace(speculative_file,file_name)
+    else:
+        speculative.kill()
+        returncode=speculative.wait()
+    speculative.watcher.join()
+    shutil.rmtree(FNAMES.speculative_mesh_dir(tile),ignore_errors=True)
+    return returncode
+##############################################################################
+
+##############################################################################
+def run_triangle4xp(tile,mesh_cmd,fallback_cmd):
+    # Runs mesh_cmd, and fallback_cmd if it fails. With speculative_mesh the
+    # fallback is started at once alongside, and only used if mesh_cmd fails.
+    # Returns the exit code of the last run.
+    speculative=start_speculative_mesh(tile,fallback_cmd) if speculative_mesh and fallback_cmd!=mesh_cmd else None
+    mesh_timer=time.time()
+    returncode=run_mesh_cmd(mesh_cmd)
+    failed_after=time.time()-mesh_timer
+    if speculative:
+        speculative_mesh_stats['runs']+=1
+    if returncode:
+        UI.vprint(0,"\nWARNING: Triangle4XP could not achieve the requested quality (min_angle), most probably due to an uncatched OSM error.\n"+\
+                    "It will be tempted now with no angle constraint (i.e. min_angle=0).")
+        if speculative:
+            returncode=finish_speculative_mesh(tile,speculative,keep=True)
+            if not returncode:
+                # the sequential retry would only have started now
+                saved_time=min(failed_after,speculative.elapsed)
+                speculative_mesh_stats['saves']+=1
+                speculative_mesh_stats['saved_time']+=saved_time
+                UI.vprint(1,"   The speculative run was used, it saved about",UI.nicer_timer(saved_time)+".")
+                UI.logprint("Step 2 for tile lat=",tile.lat,", lon=",tile.lon,": speculative Triangle4XP run used, saved about",round(saved_time),"sec.")
+        else:
+            returncode=run_mesh_cmd(fallback_cmd)
+    elif speculative:
+        finish_speculative_mesh(tile,speculative,keep=False)
+        UI.logprint("Step 2 for tile lat=",tile.lat,", lon=",tile.lon,": speculative Triangle4XP run not needed.")
+    if speculative:
+        UI.vprint(1,"   Speculative runs of Triangle4XP which saved time : "+str(speculative_mesh_stats['saves'])+" / "+\
+                str(speculative_mesh_stats['runs'])+" (about "+UI.nicer_timer(speculative_mesh_stats['saved_time'])+" in total).")
+    return returncode
+##############################################################################
+
+##############################################################################
+def dem_curvature(alt,pixx,pixy,nodata):
+    # Largest absolute eigenvalue of the Hessian of the DEM (in 1/m) at its 
+    # interior nodes, zero next to no_data, as in Triangle4XP.
+    centre=alt[1:-1,1:-1]
+    hxx=(alt[1:-1,2:]-2*centre+alt[1:-1,:-2])/numpy.float32(pixx**2)
+    hyy=(alt[2:,1:-1]-2*centre+alt[:-2,1:-1])/numpy.float32(pixy**2)
+    hxy=(alt[2:,2:]-alt[2:,:-2]-alt[:-2,2:]+alt[:-2,:-2])/numpy.float32(4*pixx*pixy)
+    curvature=numpy.abs(hxx+hyy)/2+numpy.sqrt(((hxx-hyy)/2)**2+hxy**2)
+    del(hxx,hyy,hxy)
+    missing=alt==nodata
+    if missing.any():
+        near_missing=missing[1:-1,1:-1].copy()
+        for (rows,cols) in ((slice(2,None),slice(1,-1)),(slice(None,-2),slice(1,-1)),(slice(1,-1),slice(2,None)),(slice(1,-1),slice(None,-2)),\
+                            (slice(2,None),slice(2,None)),(slice(2,None),slice(None,-2)),(slice(None,-2),slice(2,None)),(slice(None,-2),slice(None,-2))):
+            near_missing|=missing[rows,cols]
+        curvature[near_missing]=0
+    return curvature
+##############################################################################
+
+##############################################################################
+def curvature_density(curvature,weights,cell_area,curv_tol,hmin):
+    # Triangle4XP refines triangles whose longest edge is above curv_tol over
+    # the (weighted) curvature, i.e. about (curvature/curv_tol)**2 triangles
+    # per square meter, and at most 1/hmin**2. 
+    return float(numpy.minimum(numpy.square(curvature*weights/numpy.float32(curv_tol)),numpy.float32(1/hmin**2)).sum(dtype=numpy.float64)*cell_area)
+##############################################################################
+
+##############################################################################
+def curvature_map(tile,weight_array):
+    # The inputs of curvature_density for the DEM of the tile (tile.dem with 
+    # its extent only) and the weight map of build_curv_tol_weight_map, and
+    # the scaling of curvature_tol in the mesh command.
+    dem=tile.dem
+    alt=numpy.fromfile(FNAMES.alt_file(tile),dtype=numpy.float32).reshape((dem.nydem,dem.nxdem))
+    pixx=(dem.x1-dem.x0)*GEO.lon_to_m(tile.lat)/(dem.nxdem-1)
+    pixy=(dem.y1-dem.y0)*GEO.lat_to_m/(dem.nydem-1)
+    curvature=dem_curvature(alt,pixx,pixy,dem.nodata)
+    del(alt)
+    cols=numpy.rint(1000*numpy.clip(numpy.linspace(dem.x0,dem.x1,dem.nxdem)[1:-1],0,1)).astype(numpy.int64)
+    rows=numpy.rint(1000*(1-numpy.clip(numpy.linspace(dem.y1,dem.y0,dem.nydem)[1:-1],0,1))).astype(numpy.int64)
+    weights=weight_array[rows[:,None],cols[None,:]]
+    hmin_effective=max(tile.hmin,(dem.y1-dem.y0)*GEO.lat_to_m/dem.nydem/2)
+    curv_tol_scaling=sqrt(dem.nxdem/(1000*(dem.x1-dem.x0))) 
+    return (curvature,weights,pixx*pixy,hmin_effective,curv_tol_scaling)
+##############################################################################
+
+##############################################################################
+def read_mesh_history():
+    try:
+        with open(FNAMES.Mesh_history_file,'rb') as f:
+            return pickle.load(f)
+    except:
+        return []
+##############################################################################
+
+##############################################################################
+def record_mesh_history(tile,features,nbr_tris):
+    # One entry per tile and settings, the latest being kept
+    history=[entry for entry in read_mesh_history() if entry['features']!=features]
+    history.append({'lat':tile.lat,'lon':tile.lon,'features':features,'limit_tris':tile.limit_tris,'triangles':nbr_tris})
+    try:
+        with open(FNAMES.Mesh_history_file+'.tmp','wb') as f:
+            pickle.dump(history[-mesh_history_size:],f)
+        os.replace(FNAMES.Mesh_history_file+'.tmp',FNAMES.Mesh_history_file)
+    except Exception as e:
+        UI.vprint(2,"   Could not record the mesh history:",e)
+##############################################################################
+
+##############################################################################
+def estimate_coefficients(history):
+    # Least squares fit of triangles ~ a*curvature+b*nodes (in relative 
+    # error) on the builds not stopped by limit_tris when there are enough of
+    # them and the fit makes sense, the default coefficients scaled to their
+    # median ratio otherwise.
+    samples=numpy.array([(entry['features']['curvature'],entry['features']['nodes'],entry['triangles']) for entry in history\
+            if not entry['limit_tris'] or entry['triangles']<0.95*entry['limit_tris']],dtype=numpy.float64).reshape((-1,3))
+    if len(samples)>=mesh_history_min_fit:
+        coefficients=numpy.linalg.lstsq(samples[:,:2]/samples[:,2:],numpy.ones(len(samples)),rcond=None)[0]
+        if (coefficients>0).all():
+            return tuple(coefficients.tolist())
+    if len(samples):
+        default_estimates=samples[:,:2]@numpy.array(default_estimate_coefficients)
+        scale=float(numpy.median(samples[:,2]/numpy.maximum(default_estimates,1)))
+        return tuple(scale*c for c in default_estimate_coefficients)
+    return default_estimate_coefficients
+##############################################################################
+
+##############################################################################
+def estimate_triangles(tile,weight_array,input_nodes,history=None):
+    # Returns the features of the coming Triangle4XP run, the predicted 
+    # number of triangles, and when it exceeds limit_tris the curvature_tol 
+    # which would give about limit_tris triangles (None otherwise).
+    (curvature,weights,cell_area,hmin,curv_tol_scaling)=curvature_map(tile,weight_array)
+    (a,b)=estimate_coefficients(read_mesh_history() if history is None else history)
+    density=lambda curv_tol: curvature_density(curvature,weights,cell_area,curv_tol*curv_tol_scaling,hmin)
+    predict=lambda curv_tol: a*density(curv_tol)+b*input_nodes
+    features={'curvature':density(tile.curvature_tol),'nodes':input_nodes}
+    estimate=a*features['curvature']+b*input_nodes
+    suggested_curv_tol=None
+    if tile.limit_tris and estimate>tile.limit_tris and predict(1e6*tile.curvature_tol)<tile.limit_tris:
+        # the prediction decreases with curv_tol, bisection in log scale
+        (low,high)=(tile.curvature_tol,1e6*tile.curvature_tol)
+        while high/low>1.01:
+            middle=sqrt(low*high)
+            (low,high)=(middle,high) if predict(middle)>tile.limit_tris else (low,middle)
+        suggested_curv_tol=high
+    return (features,estimate,suggested_curv_tol)
+##############################################################################
+
+##############################################################################
+def report_estimate(tile,estimate,suggested_curv_tol):
+    UI.vprint(1,"   Predicted number of triangles :",int(round(estimate,-3)) if estimate>=10000 else int(estimate),\
+            "(curvature_tol="+str(tile.curvature_tol)+").")
+    if tile.limit_tris and estimate>tile.limit_tris:
+        UI.vprint(1,"   This is more than limit_tris="+str(tile.limit_tris)+", Triangle4XP will stop refining before it is done."+\
+                (" About curvature_tol={:.3g} would fit.".format(suggested_curv_tol) if suggested_curv_tol else ""))
+##############################################################################
+
+##############################################################################
+def estimate_mesh(tile):
+    # The prediction made at the start of Step 2, alone, so that curvature_tol
+    # and limit_tris can be adjusted beforehand. Needs the outputs of Step 1.
+    # Returns (estimate,suggested_curv_tol), see estimate_triangles.
+    (node_file,alt_file)=(FNAMES.input_node_file(tile),FNAMES.alt_file(tile))
+    if not os.path.isfile(node_file) or not os.path.isfile(alt_file):
+        UI.vprint(0,"ERROR: Could not find",node_file,"or",alt_file,". You must run Step 1 first.")
+        return None
+    try:
+        source=((";" in tile.custom_dem) and tile.custom_dem.split(";")[tile.iterate]) or tile.custom_dem
+        tile.dem=DEM.DEM(tile.lat,tile.lon,source,fill_nodata=False,info_only=True)
+    except Exception as e:
+        print(e)
+        UI.vprint(0,"ERROR: Could not determine the appropriate source. Please check your custom_dem entry.")
+        return None
+    if os.path.getsize(alt_file)!=4*tile.dem.nxdem*tile.dem.nydem:
+        UI.vprint(0,"ERROR: Cached raster elevation does not match the current custom DEM specs.")
+        return None
+    with open(node_file,'r') as f:
+        input_nodes=int(f.readline().split()[0])
+    weight_array=numpy.ones((1001,1001),dtype=numpy.float32)
+    build_curv_tol_weight_map(tile,weight_array)
+    (features,estimate,suggested_curv_tol)=estimate_triangles(tile,weight_array,input_nodes)
+    report_estimate(tile,estimate,suggested_curv_tol)
+    tile.dem=None
+    return (estimate,suggested_curv_tol)
+##############################################################################
+
+##############################################################################
+def file_md5(file_name,chunk_size=2**24):
+    md5=hashlib.md5()
+    with open(file_name,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def file_sha256(file_name,chunk_size=2**24):
+    sha256=hashlib.sha256()
+    with open(file_name,'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size),b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+##############################################################################
+
+##############################################################################
+def mesh_manifest(tile,mesh_cmd,weight_array):
+    # Hashes of the inputs of Step 2 : the files read by Triangle4XP, the 
+    # weight map and the settings (the mesh command without its file names).
+    inputs={}
+    for (label,file_name) in (('poly file',FNAMES.input_poly_file(tile)),('node file',FNAMES.input_node_file(tile)),\
+                              ('ele file',FNAMES.input_ele_file(tile)),('DEM file',FNAMES.alt_file(tile))):
+        inputs[label]=file_md5(file_name) if os.path.isfile(file_name) else None
+    inputs['weight map']=hashlib.md5(weight_array.tobytes()).hexdigest()
+    settings=[getattr(tile,var,None) for var in mesh_tile_vars]+mesh_cmd[2:-3]
+    inputs['settings']=hashlib.md5(repr(settings).encode()).hexdigest()
+    return {'version':mesh_manifest_version,'inputs':inputs,'mesh':None}
+##############################################################################
+
+##############################################################################
+def read_mesh_manifest(tile):
+    # The manifest of the last completed mesh, if any
+    try:
+        with open(FNAMES.mesh_manifest_file(tile),'rb') as f:
+            manifest=pickle.load(f)
+        return manifest if manifest['version']==mesh_manifest_version else None
+    except:
+        return None
+##############################################################################
+
+##############################################################################
+def write_mesh_manifest(tile,manifest):
+    manifest['mesh']=file_md5(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))
+    with open(FNAMES.mesh_manifest_file(tile)+'.tmp','wb') as f:
+        pickle.dump(manifest,f)
+    os.replace(FNAMES.mesh_manifest_file(tile)+'.tmp',FNAMES.mesh_manifest_file(tile))
+##############################################################################
+
+##############################################################################
+def mesh_is_up_to_date(tile,manifest):
+    # True when the mesh on disk was built from the very same inputs
+    if not use_mesh_cache: 
+        return False
+    if force_mesh_rebuild:
+        UI.vprint(1,"   Mesh rebuild forced.")
+        return False
+    old_manifest=read_mesh_manifest(tile)
+    if not old_manifest:
+        UI.vprint(1,"   No manifest of a previous mesh, the mesh is built from scratch.")
+        return False
+    changes=[label for label in manifest['inputs'] if old_manifest['inputs'].get(label)!=manifest['inputs'][label]]
+    mesh_file=FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)
+    if not changes and (not os.path.isfile(mesh_file) or file_md5(mesh_file)!=old_manifest['mesh']):
+        changes.append('mesh file')
+    UI.vprint(1,"   Changes since the previous mesh : "+(", ".join(changes) if changes else "none")+".")
+    return not changes
+##############################################################################
+
 ##############################################################################
 def build_mesh(tile):
     if UI.is_working: return 0
@@ -410,7 +1143,6 @@ def build_mesh(tile):
     weight_array=numpy.ones((1001,1001),dtype=numpy.float32)
     build_curv_tol_weight_map(tile,weight_array)
     weight_array.tofile(weight_file)
-    del(weight_array)
     
     curv_tol_scaling=sqrt(tile.dem.nxdem/(1000*(tile.dem.x1-tile.dem.x0))) 
     hmin_effective=max(tile.hmin,(tile.dem.y1-tile.dem.y0)*GEO.lat_to_m/tile.dem.nydem/2)
@@ -428,52 +1160,51 @@ def build_mesh(tile):
               '{:.9g}'.format(tile.curvature_tol*curv_tol_scaling),
               '{:.9g}'.format(tile.min_angle),str(hmin_effective),alt_file,weight_file,poly_file]
     
+    manifest=mesh_manifest(tile,mesh_cmd,weight_array)
+    if mesh_is_up_to_date(tile,manifest):
+        UI.vprint(1,"-> The mesh is up to date, Triangle4XP and its post-processing are skipped.")
+        mesh_file=FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)
+        if read_binary_mesh_file(mesh_file) is None or read_mesh_index_file(mesh_file) is None:
+            UI.vprint(1,"-> Writing its binary counterpart and triangle index.")
+            convert_mesh_file(mesh_file)
+        if UI.cleaning_level:
+            try: os.remove(FNAMES.weight_file(tile))
+            except: pass
+        del(tile.dem) # as below
+        tile.dem=None
+        UI.timings_and_bottom_line(timer)
+        UI.logprint("Step 2 for tile lat=",tile.lat,", lon=",tile.lon,": mesh up to date, normal exit.")
+        return 1
+    try: os.remove(FNAMES.mesh_manifest_file(tile))
+    except: pass
+    (features,estimate,suggested_curv_tol)=estimate_triangles(tile,weight_array,input_nodes)
+    report_estimate(tile,estimate,suggested_curv_tol)
+    del(weight_array)
     del(tile.dem) # for machines with not much RAM, we do not need it anymore
     tile.dem=None
     UI.vprint(1,"-> Start of the mesh algorithm Triangle4XP.")
     UI.vprint(2,'   Mesh command:',' '.join(mesh_cmd))
-    fingers_crossed=subprocess.Popen(mesh_cmd,stdout=subprocess.PIPE,bufsize=0)
-    while True:
-        line = fingers_crossed.stdout.readline()
-        if not line: 
-            break
-        else:
-            try:
-                print(line.decode("utf-8")[:-1])
-            except:
-                pass
-    time.sleep(0.3)
-    fingers_crossed.poll()        
-    if fingers_crossed.returncode:
-        UI.vprint(0,"\nWARNING: Triangle4XP could not achieve the requested quality (min_angle), most probably due to an uncatched OSM error.\n"+\
-                    "It will be tempted now with no angle constraint (i.e. min_angle=0).")
-        mesh_cmd[-5]='{:.9g}'.format(0)
-        fingers_crossed=subprocess.Popen(mesh_cmd,stdout=subprocess.PIPE,bufsize=0)
-        while True:
-            line = fingers_crossed.stdout.readline()
-            if not line: 
-                break
-            else:
-                try:
-                    print(line.decode("utf-8")[:-1])
-                except:
-                    pass
-        time.sleep(0.3)
-        fingers_crossed.poll()
-        if fingers_crossed.returncode:
-            UI.exit_message_and_bottom_line("\nERROR: Triangle4XP really couldn't make it !\n\n"+\
-                                        "If the reason is not due to the limited amount of RAM please\n"+\
-                                        "file a bug including the .node and .poly files that you\n"+\
-                                        "will find in "+str(tile.build_dir)+".\n")
-            return 0
+    fallback_cmd=mesh_cmd[:-5]+['{:.9g}'.format(0)]+mesh_cmd[-4:]
+    if run_triangle4xp(tile,mesh_cmd,fallback_cmd):
+        UI.exit_message_and_bottom_line("\nERROR: Triangle4XP really couldn't make it !\n\n"+\
+                                    "If the reason is not due to the limited amount of RAM please\n"+\
+                                    "file a bug including the .node and .poly files that you\n"+\
+                                    "will find in "+str(tile.build_dir)+".\n")
+        return 0
+    with open(FNAMES.output_ele_file(tile),'r') as f:
+        nbr_tris=int(f.readline().split()[0])
+    UI.vprint(1,"   Triangle4XP made",nbr_tris,"triangles,",int(estimate),"were predicted"+(" without limit_tris." if tile.limit_tris and estimate>tile.limit_tris else "."))
+    record_mesh_history(tile,features,nbr_tris)
         
     if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
     
     vertices=post_process_nodes_altitudes(tile)
 
-    if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
+    if UI.red_flag: TRI.clear_cache(); UI.exit_message_and_bottom_line(); return 0
     
     write_mesh_file(tile,vertices)
+    TRI.clear_cache() # the parsed .1.ele file, for machines with not much RAM
+    write_mesh_manifest(tile,manifest)
     #
     if UI.cleaning_level:
         try: os.remove(FNAMES.weight_file(tile))
@@ -514,6 +1245,7 @@ def sort_mesh(tile):
             break
         else:
             print(line.decode("utf-8")[:-1])
+    convert_mesh_file(mesh_file)
     UI.timings_and_bottom_line(timer)
     UI.logprint("Moulinette applied for tile lat=",tile.lat,", lon=",tile.lon," and ZL",tile.default_zl)
     return 1
@@ -536,3 +1268,26 @@ def triangulate(name,path_to_Ortho4XP_dir):
         return 0
     return 1
 ##############################################################################   
+
+if __name__ == '__main__':
+    Syntax='Syntax :\n--------\n(PYTHON) src/O4_Mesh_Utils.py convert [mesh_file_or_directory ...]\n\nCreates (or refreshes) the binary sidecar of existing text meshes,\ndirectories are searched recursively, the default is the Tiles directory.'
+    if len(sys.argv)<2 or sys.argv[1]!='convert':
+        print(Syntax)
+        sys.exit(1)
+    targets=sys.argv[2:] or [FNAMES.Tile_dir]
+    mesh_files=[]
+    for target in targets:
+        if os.path.isdir(target):
+            for (dirpath,dirnames,filenames) in os.walk(target):
+                mesh_files+=[os.path.join(dirpath,f) for f in sorted(filenames) if f[-5:]=='.mesh']
+        else:
+            mesh_files.append(target)
+    for mesh_file in mesh_files:
+        if read_binary_mesh_file(mesh_file) is not None:
+            print("Up to date :",mesh_file)
+            continue
+        try:
+            convert_mesh_file(mesh_file)
+            print("Converted  :",mesh_file)
+        except Exception as e:
+            print("ERROR      :",mesh_file,e)
@@ -18,18 +18,52 @@ skip_downloads=False
 skip_converts=False
 
 ##############################################################################
-def download_textures(tile,download_queue,convert_queue):
+class slot_timer():
+    # Counts how many of nbr_slots are running a task, and records when one 
+    # of them and then all of them got busy for the first time (in seconds
+    # since tinit), to tell how soon Step 3 keeps its threads supplied.
+    def __init__(self,nbr_slots,tinit):
+        self.nbr_slots=nbr_slots
+        self.tinit=tinit
+        self.busy=0
+        self.first_busy=None
+        self.saturated=None
+        self.lock=threading.Lock()
+    def wrap(self,task):
+        def timed_task(*args):
+            with self.lock:
+                self.busy+=1
+                if self.first_busy is None: self.first_busy=time.time()-self.tinit
+                if self.saturated is None and self.busy>=self.nbr_slots: self.saturated=time.time()-self.tinit
+            try:
+                return task(*args)
+            finally:
+                with self.lock: self.busy-=1
+        return timed_task
+    def report(self,label):
+        if self.first_busy is None:
+            UI.vprint(2,"     "+label+" : never used.")
+            return
+        UI.vprint(2,"     "+label+" : first busy after "+UI.nicer_timer(self.first_busy)+", "+\
+                (str(self.nbr_slots)+" slot(s) saturated after "+UI.nicer_timer(self.saturated) if self.saturated is not None else "never saturated")+".")
+##############################################################################
+
+##############################################################################
+def download_textures(tile,download_queue,convert_queue,download_timer=None,failed_textures=None):
     UI.vprint(1,"-> Opening download queue.")
+    build_jpeg_ortho=download_timer.wrap(IMG.build_jpeg_ortho) if download_timer else IMG.build_jpeg_ortho
     done=0
     while True:
         texture_attributes=download_queue.get()
         if isinstance(texture_attributes,str) and texture_attributes=='quit':
             UI.progress_bar(2,100)
             break
-        if IMG.build_jpeg_ortho(tile,*texture_attributes):
+        if build_jpeg_ortho(tile,*texture_attributes):
             done+=1
             UI.progress_bar(2,int(100*done/(done+download_queue.qsize()))) 
             convert_queue.put((tile,*texture_attributes))
+        elif failed_textures is not None:
+            failed_textures.append(texture_attributes)
         if UI.red_flag: UI.vprint(1,"Download process interrupted."); return 0
     if done: UI.vprint(1," *Download of textures completed.") 
     return 1
@@ -79,16 +113,29 @@ def build_tile(tile):
     
     download_queue=queue.Queue()
     convert_queue=queue.Queue()
+    download_timer=slot_timer(1,time.time())
+    convert_timer=slot_timer(max_convert_slots,download_timer.tinit)
+    # textures which could not be downloaded or converted
+    failed_textures=[]
+    def convert_texture(tile,*texture_attributes):
+        try:
+            converted=IMG.convert_texture(tile,*texture_attributes)
+        except Exception as e:
+            UI.lvprint(1,"ERROR: Could not convert texture",FNAMES.dds_file_name_from_attributes(*texture_attributes),":",e)
+            converted=0
+        if not converted: failed_textures.append(texture_attributes)
+        return 1
     build_dsf_thread=threading.Thread(target=DSF.build_dsf,args=[tile,download_queue])
-    download_thread=threading.Thread(target=download_textures,args=[tile,download_queue,convert_queue])
+    download_thread=threading.Thread(target=download_textures,args=[tile,download_queue,convert_queue,download_timer,failed_textures])
     build_dsf_thread.start()
     if not skip_downloads:
         download_thread.start()
         if not skip_converts:
             UI.vprint(1,"-> Opening convert queue and",max_convert_slots,"conversion workers.")
             dico_conv_progress={'done':0,'bar':3}
-            convert_workers=parallel_launch(IMG.convert_texture,convert_queue,max_convert_slots,progress=dico_conv_progress)
+            convert_workers=parallel_launch(convert_timer.wrap(convert_texture),convert_queue,max_convert_slots,progress=dico_conv_progress)
     build_dsf_thread.join()
+    UI.vprint(2,"     DSF encoded after "+UI.nicer_timer(time.time()-download_timer.tinit)+".")
     if not skip_downloads:
         download_queue.put('quit')
         download_thread.join()
@@ -99,13 +146,31 @@ def build_tile(tile):
                 UI.vprint(1,"DDS conversion process interrupted.")
             elif dico_conv_progress['done']>=1: 
                 UI.vprint(1," *DDS conversion of textures completed.")
+        else:
+            # downloaded but left unconverted
+            while not convert_queue.empty():
+                failed_textures.append(convert_queue.get()[1:])
+        download_timer.report("Download thread")
+        if not skip_converts: convert_timer.report("Convert slots")
+    else:
+        # queued but left undownloaded
+        while not download_queue.empty():
+            texture_attributes=download_queue.get()
+            if texture_attributes!='quit': failed_textures.append(texture_attributes)
     UI.vprint(1," *Activating DSF file.")
     dsf_file_name=os.path.join(tile.build_dir,'Earth nav data',FNAMES.long_latlon(tile.lat,tile.lon)+'.dsf')
+    dsf_activated=True
     try:
         os.rename(dsf_file_name+'.tmp',dsf_file_name)
     except:
         UI.vprint(0,"ERROR : could not rename DSF file, tile is not actived.")
+        dsf_activated=False
     if UI.red_flag: UI.exit_message_and_bottom_line(); return 0
+    if dsf_activated:
+        DSF.activate_manifest(tile,failed_textures)
+    else:
+        try: os.remove(FNAMES.build_manifest_file(tile)+'.tmp')
+        except: pass
     if UI.cleaning_level>1:
         try: os.remove(FNAMES.alt_file(tile))
         except: pass
@@ -114,7 +179,10 @@ def build_tile(tile):
         try: os.remove(FNAMES.input_poly_file(tile))
         except: pass
     if UI.cleaning_level>2:
-        try: os.remove(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))
+        MESH.remove_mesh_file(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon))
+        try: os.remove(FNAMES.mesh_manifest_file(tile))
+        except: pass
+        try: os.remove(FNAMES.dsf_cache_file(tile))
         except: pass
         try: os.remove(FNAMES.apt_file(tile))
         except: pass
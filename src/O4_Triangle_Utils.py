@@ -0,0 +1,117 @@
+import os
+import numpy
+
+##############################################################################
+# Readers and writer of the .node and .ele files of Triangle(4XP). Files are
+# parsed in bulk to numpy arrays from the sizes given in their header line,
+# and the last parsed files are kept in memory (keyed by name, size and
+# modification time) so that the parts of a step which need the same file
+# do not parse it twice. Cached arrays are read-only, copy them to modify.
+# Steps call clear_cache once done, not to hold the arrays of a large mesh
+# through the next steps and tiles.
+##############################################################################
+
+cache_size=4
+parsed_files={}
+
+##############################################################################
+def file_stamp(file_name):
+    file_stat=os.stat(file_name)
+    return (file_stat.st_size,file_stat.st_mtime_ns)
+##############################################################################
+
+##############################################################################
+def cached(file_name,parser):
+    file_name=os.path.abspath(file_name)
+    stamp=file_stamp(file_name)
+    entry=parsed_files.pop(file_name,None)
+    if not entry or entry[0]!=stamp:
+        entry=(stamp,parser(file_name))
+    store(file_name,entry)
+    return entry[1]
+##############################################################################
+
+##############################################################################
+def store(file_name,entry):
+    parsed_files[file_name]=entry
+    while len(parsed_files)>cache_size:
+        del(parsed_files[next(iter(parsed_files))])
+##############################################################################
+
+##############################################################################
+def clear_cache():
+    parsed_files.clear()
+##############################################################################
+
+##############################################################################
+def read_only(*arrays):
+    for array in arrays:
+        array.flags.writeable=False
+    return arrays
+##############################################################################
+
+##############################################################################
+def split_file(file_name):
+    # header line (of integers), body, and the comment line which ends the
+    # files written by Triangle
+    with open(file_name,'r') as f:
+        header=f.readline()
+        data=f.read()
+    idx_end=data.find('#')
+    trailer=data[idx_end:].split('\n')[0]+'\n' if idx_end!=-1 else ''
+    return (header,[int(x) for x in header.split()],data[:idx_end] if idx_end!=-1 else data,trailer)
+##############################################################################
+
+##############################################################################
+def parse_node_file(file_name):
+    (header,sizes,body,trailer)=split_file(file_name)
+    (nbr_nodes,dimension,nbr_attributes,nbr_markers)=(sizes+[0,0,0])[:4]
+    width=1+dimension+nbr_attributes+nbr_markers
+    values=numpy.fromstring(body,dtype=numpy.float64,sep=' ',count=nbr_nodes*width).reshape((nbr_nodes,width))
+    # node numbers and boundary markers are left aside
+    nodes=values[:,1:1+dimension+nbr_attributes].copy()
+    return read_only(nodes)+(header,trailer)
+##############################################################################
+
+##############################################################################
+def parse_ele_file(file_name):
+    (header,sizes,body,trailer)=split_file(file_name)
+    (nbr_tris,nbr_corners,nbr_attributes)=(sizes+[3,0])[:3]
+    width=1+nbr_corners+nbr_attributes
+    values=numpy.fromstring(body,dtype=numpy.int64,sep=' ',count=nbr_tris*width).reshape((nbr_tris,width))
+    # Triangle numbers nodes from 1
+    triangles=(values[:,1:4]-1).astype(numpy.int32)
+    attributes=values[:,1+nbr_corners] if nbr_attributes else numpy.zeros(nbr_tris,dtype=numpy.int64)
+    return read_only(triangles,attributes.copy())
+##############################################################################
+
+##############################################################################
+def read_node_file(file_name):
+    # Returns (nodes,header,trailer), nodes being a (N,dimension+attributes)
+    # float64 array.
+    return cached(file_name,parse_node_file)
+##############################################################################
+
+##############################################################################
+def read_ele_file(file_name):
+    # Returns (triangles,attributes), triangles being a (M,3) int32 array of
+    # zero based node indices and attributes the first triangle attribute
+    # (int64) when there is one, zero otherwise.
+    return cached(file_name,parse_ele_file)
+##############################################################################
+
+##############################################################################
+def write_node_file(file_name,nodes,header,trailer,chunk_size=100000):
+    # Nodes numbered from 1, values written with 15 decimals.
+    (nbr_nodes,width)=nodes.shape
+    line_format='%d'+' %.15f'*width+'\n'
+    with open(file_name,'w') as f:
+        f.write(header)
+        for first in range(0,nbr_nodes,chunk_size):
+            last=min(first+chunk_size,nbr_nodes)
+            rows=numpy.column_stack((numpy.arange(first+1,last+1),nodes[first:last]))
+            f.write((line_format*(last-first)) % tuple(rows.ravel().tolist()))
+        f.write(trailer)
+    parsed_files.pop(os.path.abspath(file_name),None)
+    return
+##############################################################################
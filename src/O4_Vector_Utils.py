@@ -851,6 +851,23 @@ def point_in_polygon(point,polygon):
         return True
 ##############################################################################
 
+##############################################################################
+def points_in_polygon(x,y,polygon):
+    # Same as above for numpy arrays of points, with the even-odd rule (a 
+    # point is inside when a ray from it crosses the boundary an odd number
+    # of times) as in PIL's polygon filling, and points of the boundary in.
+    inside=numpy.zeros(numpy.shape(x),dtype=bool)
+    on_boundary=numpy.zeros(numpy.shape(x),dtype=bool)
+    (poly_x,poly_y)=(polygon[::2],polygon[1::2])
+    for k in range(len(poly_x)):
+        (x0,y0,x1,y1)=(poly_x[k-1],poly_y[k-1],poly_x[k],poly_y[k])
+        on_boundary|=((x-x0)*(y1-y0)==(y-y0)*(x1-x0)) & (x>=min(x0,x1)) & (x<=max(x0,x1)) & (y>=min(y0,y1)) & (y<=max(y0,y1))
+        if y0==y1: continue
+        crosses=(y0>y)!=(y1>y)
+        inside^=crosses & (x<x0+(y-y0)*(x1-x0)/(y1-y0))
+    return inside|on_boundary
+##############################################################################
+
 #############################################################################
 def dummy_alt(way):
         return numpy.zeros(way.shape[0])
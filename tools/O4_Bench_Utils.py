@@ -0,0 +1,454 @@
+import os
+import sys
+import time
+import io
+import queue
+import shutil
+import array
+import struct
+import hashlib
+import pickle
+import bz2
+import multiprocessing
+from collections import defaultdict
+import numpy
+from shapely import geometry
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','src'))
+import O4_UI_Utils as UI
+import O4_Geo_Utils as GEO
+import O4_File_Names as FNAMES
+import O4_Mesh_Utils as MESH
+import O4_DSF_Utils as DSF
+import O4_Config_Utils as CFG
+try:
+    import resource
+except:
+    resource=None
+
+##############################################################################
+# Synthetic data and helpers shared by the benchmarks (O4_Benchmarks.py) and
+# the correctness checks (O4_Checks.py) of the performance sensitive parts of
+# Ortho4XP, neither of which is imported by Ortho4XP itself. Run them from 
+# the Ortho4XP directory, e.g. :
+#   python3 tools/O4_Benchmarks.py mesh_loader 3000000
+#   python3 tools/O4_Checks.py
+##############################################################################
+
+##############################################################################
+def synthetic_mesh(mesh_file,nbr_tris,lat=45,lon=5,seed=0):
+    # A jittered regular grid over the tile with some sea, inland water and
+    # flattened (airport/road like) triangles, written in the .mesh text format.
+    rng=numpy.random.RandomState(seed)
+    n=int(numpy.ceil(numpy.sqrt(nbr_tris/2)))+1
+    (x,y)=numpy.meshgrid(numpy.linspace(0,1,n),numpy.linspace(0,1,n))
+    x=x.ravel(); y=y.ravel()
+    inner=(x>0)*(x<1)*(y>0)*(y<1)
+    x+=inner*rng.uniform(-0.3,0.3,x.size)/n
+    y+=inner*rng.uniform(-0.3,0.3,y.size)/n
+    z=500+300*numpy.sin(6*x)*numpy.cos(4*y)+rng.uniform(0,10,x.size)
+    z[x+y<0.6]=0
+    (i,j)=numpy.meshgrid(numpy.arange(n-1),numpy.arange(n-1),indexing='ij')
+    a=(i*n+j).ravel()
+    tris=numpy.empty((2*len(a),3),dtype=numpy.int64)
+    tris[0::2]=numpy.column_stack((a,a+1,a+n+1))
+    tris[1::2]=numpy.column_stack((a,a+n+1,a+n))
+    bx=x[tris].mean(axis=1); by=y[tris].mean(axis=1)
+    attr=numpy.zeros(len(tris),dtype=numpy.int64)
+    attr[bx+by<0.6]=2
+    attr[((bx-0.7)**2+(by-0.7)**2)<0.01]=1
+    attr[((bx-0.3)**2+(by-0.8)**2)<0.005]=4
+    attr[numpy.abs(bx-0.5)<0.01]|=8
+    f=open(mesh_file,'w')
+    f.write("MeshVersionFormatted "+MESH.O4_Version.version+"\n")
+    f.write("Dimension 3\n\n")
+    f.write("Vertices\n")
+    f.write(str(x.size)+"\n")
+    numpy.savetxt(f,numpy.column_stack((x+lon,y+lat,z/100000,numpy.zeros(x.size))),fmt='%.7f %.7f %.7f %d')
+    f.write("\n")
+    f.write("Normals\n")
+    f.write(str(x.size)+"\n")
+    numpy.savetxt(f,rng.uniform(-0.3,0.3,(x.size,2)),fmt='%.2f')
+    f.write("\n")
+    f.write("Triangles\n")
+    f.write(str(len(tris))+"\n")
+    numpy.savetxt(f,numpy.column_stack((tris+1,attr)),fmt='%d')
+    f.close()
+    return (x.size,len(tris))
+##############################################################################
+
+##############################################################################
+def peak_rss():
+    # in bytes, None if the platform does not tell us
+    if not resource: return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if 'dar' in sys.platform else 1024*peak
+##############################################################################
+
+##############################################################################
+def _isolated_worker(task,args,result_queue):
+    timer=time.time()
+    task(*args)
+    result_queue.put((time.time()-timer,peak_rss()))
+##############################################################################
+
+##############################################################################
+def run_isolated(task,*args):
+    # Runs task(*args) in a fresh process so that its peak RSS is not polluted
+    # by previous runs, returns (elapsed time,peak rss).
+    result_queue=multiprocessing.Queue()
+    worker=multiprocessing.Process(target=_isolated_worker,args=(task,args,result_queue))
+    worker.start()
+    result=result_queue.get()
+    worker.join()
+    return result
+##############################################################################
+
+##############################################################################
+def bench_logprint(*args):
+    # UI.logprint during benchmarks : to Tmp_dir rather than to the Ortho4XP 
+    # directory, so that they leave no Ortho4XP.log behind
+    try:
+        with open(os.path.join(FNAMES.Tmp_dir,'Bench.log'),'a') as f:
+            f.write(time.strftime("%c")+' | '+' '.join([str(x) for x in args])+"\n")
+    except:
+        pass
+##############################################################################
+
+##############################################################################
+def print_result(label,elapsed,peak):
+    UI.vprint(0,'   {:<32}'.format(label),'{:>10.2f}'.format(elapsed),'sec',
+              '   peak RSS '+(UI.human_print(peak,'B') if peak else 'n/a'))
+##############################################################################
+
+##############################################################################
+class call_counter:
+    # Counts the calls to some file system functions while in use, an strace
+    # free way to compare the system calls made by two implementations.
+    def __init__(self,functions):
+        self.functions=functions
+        self.counts=defaultdict(int)
+    def __enter__(self):
+        self.originals=[]
+        for (module,name) in self.functions:
+            original=getattr(module,name)
+            self.originals.append((module,name,original))
+            setattr(module,name,self.wrap(module.__name__+'.'+name,original))
+        return self
+    def wrap(self,label,original):
+        def counted(*args,**kwargs):
+            self.counts[label]+=1
+            return original(*args,**kwargs)
+        return counted
+    def __exit__(self,*args):
+        for (module,name,original) in self.originals:
+            setattr(module,name,original)
+##############################################################################
+
+##############################################################################
+def synthetic_nodes(nbr_nodes,seed=0):
+    # uniform nodes plus a few dense clusters and some nodes on the tile edges
+    rng=numpy.random.RandomState(seed)
+    x=rng.uniform(0,1,nbr_nodes); y=rng.uniform(0,1,nbr_nodes)
+    for k in range(5):
+        sel=rng.uniform(0,1,nbr_nodes)<0.05
+        (cx,cy)=rng.uniform(0,1,2)
+        x[sel]=numpy.clip(cx+rng.normal(0,1e-3,sel.sum()),0,1)
+        y[sel]=numpy.clip(cy+rng.normal(0,1e-3,sel.sum()),0,1)
+    x[rng.uniform(0,1,nbr_nodes)<0.01]=1
+    y[rng.uniform(0,1,nbr_nodes)<0.01]=0
+    return (x,y)
+##############################################################################
+
+##############################################################################
+def synthetic_dsf_content(nbr_tris,pool_nbr=20,nbr_terrains=50,seed=0):
+    # Random pools and terrain patches shaped like those of build_dsf
+    rng=numpy.random.RandomState(seed)
+    dsf_pool_plane=[7]*pool_nbr+[9]*pool_nbr+[5]*pool_nbr
+    dsf_pools=[array.array('H',rng.randint(0,65536,plane*rng.randint(0,3*nbr_tris//(3*pool_nbr)+2)).tolist()) for plane in dsf_pool_plane]
+    pool_param={k:tuple(rng.uniform(-1000,1000,18).tolist()) for k in range(pool_nbr)}
+    non_empty=[k for k in range(3*pool_nbr) if dsf_pools[k]]
+    dico_new_dsf_pool={k:idx for (idx,k) in enumerate(non_empty)}
+    textured_tris={}
+    for terrain_idx in range(nbr_terrains):
+        textured_tris[terrain_idx]=defaultdict(lambda: array.array('H'))
+        for k in rng.choice(non_empty,3):
+            textured_tris[terrain_idx][int(k)].extend(rng.randint(0,65536,3*rng.randint(1,2*nbr_tris//nbr_terrains)).tolist())
+        pairs=rng.randint(1,nbr_tris//nbr_terrains//10+2)*3
+        textured_tris[terrain_idx]['cross-pool'].extend(numpy.column_stack((rng.choice(non_empty,pairs),rng.randint(0,65536,pairs))).ravel().tolist())
+    overlay_terrains=set(range(0,nbr_terrains,7))
+    return (dsf_pools,dsf_pool_plane,pool_param,pool_nbr,textured_tris,overlay_terrains,dico_new_dsf_pool)
+##############################################################################
+
+##############################################################################
+def encoded_textured_tris(textured_tris,strips=False):
+    # textured_tris with in-pool blocks turned into commands, as in build_dsf
+    return {terrain_idx:{idx_dsfpool:tris if idx_dsfpool=='cross-pool' else \
+            DSF.in_pool_commands(numpy.frombuffer(tris,dtype=numpy.uint16).reshape(-1,3),strips) \
+            for (idx_dsfpool,tris) in textured_tris[terrain_idx].items()} for terrain_idx in textured_tris}
+##############################################################################
+
+##############################################################################
+def bulk_dsf_writer(content):
+    (dsf_pools,dsf_pool_plane,pool_param,pool_nbr,textured_tris,overlay_terrains,dico_new_dsf_pool)=content
+    f=io.BytesIO()
+    for k in range(len(dsf_pools)):
+        if dsf_pools[k]: f.write(DSF.pool_atom(dsf_pools[k],dsf_pool_plane[k]))
+    for k in range(len(dsf_pools)):
+        if dsf_pools[k]: f.write(DSF.scal_atom(pool_param[k%pool_nbr],dsf_pool_plane[k]))
+    f.write(DSF.terrain_commands(encoded_textured_tris(textured_tris),overlay_terrains,dico_new_dsf_pool,25000))
+    return f.getvalue()
+##############################################################################
+
+##############################################################################
+def synthetic_dsf_file(content):
+    # A minimal DSF around the bulk writer output, without properties nor
+    # definitions. 
+    (dsf_pools,dsf_pool_plane,pool_param,pool_nbr,textured_tris,overlay_terrains,dico_new_dsf_pool)=content
+    geod=b''.join(DSF.pool_atom(dsf_pools[k],dsf_pool_plane[k]) for k in range(len(dsf_pools)) if dsf_pools[k])+\
+         b''.join(DSF.scal_atom(pool_param[k%pool_nbr],dsf_pool_plane[k]) for k in range(len(dsf_pools)) if dsf_pools[k])
+    cmds=DSF.terrain_commands(encoded_textured_tris(textured_tris),overlay_terrains,dico_new_dsf_pool,25000)
+    data=b'XPLNEDSF'+struct.pack('<I',1)+b'DOEG'+struct.pack('<I',8+len(geod))+geod+b'SDMC'+struct.pack('<I',8+len(cmds))+cmds
+    return data+hashlib.md5(data).digest()
+##############################################################################
+
+##############################################################################
+def synthetic_tile(nbr_tris,lat=45,lon=5):
+    # A tile build dir with a synthetic mesh, as left by Step 2
+    build_dir=os.path.join(FNAMES.Tmp_dir,'Bench_tile')
+    if os.path.isdir(build_dir):
+        shutil.rmtree(build_dir)
+    for sub_dir in (os.path.join('Earth nav data',FNAMES.round_latlon(lat,lon)),'textures','terrain'):
+        os.makedirs(os.path.join(build_dir,sub_dir))
+    synthetic_mesh(FNAMES.mesh_file(build_dir,lat,lon),nbr_tris,lat,lon)
+    return CFG.Tile(lat,lon,build_dir)
+##############################################################################
+
+##############################################################################
+def dsf_file(tile):
+    # The DSF written by build_dsf, before the end of Step 3
+    return os.path.join(tile.build_dir,'Earth nav data',FNAMES.long_latlon(tile.lat,tile.lon)+'.dsf.tmp')
+##############################################################################
+
+##############################################################################
+def build_dsf_with_workers(tile,workers=1):
+    DSF.max_dsf_workers=workers
+    DSF.build_dsf(tile,queue.Queue())
+##############################################################################
+
+##############################################################################
+def zones_tile(nbr_tris,lat=45,lon=5):
+    # A synthetic tile with three custom zones of various providers
+    zone=lambda lat0,lon0,lat1,lon1: [lat0,lon0,lat0,lon1,lat1,lon1,lat1,lon0,lat0,lon0]
+    tile=synthetic_tile(nbr_tris,lat,lon)
+    tile.zone_list=[(zone(lat+0.1,lon+0.1,lat+0.3,lon+0.3),17,'GO2'),(zone(lat+0.5,lon+0.5,lat+0.6,lon+0.7),16,'EOX'),\
+                    (zone(lat+0.7,lon+0.2,lat+0.9,lon+0.3),17,'BI')]
+    return tile
+##############################################################################
+
+##############################################################################
+def incremental_build(tile,failed_textures=()):
+    # build_dsf followed by the activation of its manifest, as in build_tile,
+    # failed_textures taken as not downloaded. Returns the build time, the 
+    # DSF md5, the cached pools and the textures queued for download.
+    verbosity=UI.verbosity
+    UI.verbosity=0
+    timer=time.time()
+    download_queue=queue.Queue()
+    DSF.build_dsf(tile,download_queue)
+    elapsed=time.time()-timer
+    queued=[]
+    while not download_queue.empty():
+        queued.append(download_queue.get())
+    DSF.activate_manifest(tile,failed_textures)
+    UI.verbosity=verbosity
+    with open(dsf_file(tile),'rb') as f:
+        dsf_md5=hashlib.md5(f.read()).hexdigest()
+    with open(FNAMES.dsf_cache_file(tile),'rb') as f:
+        pools=set(pickle.load(f))
+    return (elapsed,dsf_md5,pools,queued[:-1])
+##############################################################################
+
+##############################################################################
+def synthetic_terrains(nbr_terrains,seed=0):
+    # Terrain definitions as collected by build_dsf : texture attributes, 
+    # triangle type and overlay flag, a mix of land, inland water and sea.
+    rng=numpy.random.RandomState(seed)
+    terrains=[]
+    for (til_x,til_y,tri_type) in zip(rng.randint(0,2**12,nbr_terrains)*16,rng.randint(0,2**12,nbr_terrains)*16,rng.choice(3,nbr_terrains,p=[0.6,0.2,0.2])):
+        texture_attributes=(int(til_x),int(til_y),17,'BI')
+        is_overlay=bool(tri_type)
+        terrains.append((FNAMES.dds_file_name_from_attributes(*texture_attributes),texture_attributes,int(tri_type),is_overlay))
+    return terrains
+##############################################################################
+
+##############################################################################
+def write_terrains(tile,terrains):
+    # The .ter files of terrains (as given by synthetic_terrains) written in 
+    # a batch from templates, as in build_dsf
+    (templates,terrain_files,assets)=({},[],set())
+    for (texture_file_name,texture_attributes,tri_type,is_overlay) in terrains:
+        if (tri_type,is_overlay) not in templates:
+            templates[(tri_type,is_overlay)]=DSF.terrain_template(tile,tri_type,is_overlay)
+        assets.update(templates[(tri_type,is_overlay)][1])
+        terrain_files.append(DSF.terrain_file(tile,templates[(tri_type,is_overlay)][0],texture_file_name,*texture_attributes,tri_type,is_overlay))
+    DSF.write_terrain_files(tile,terrain_files,assets)
+##############################################################################
+
+##############################################################################
+def synthetic_zones(tile,nbr_zones,nbr_airports,seed=0):
+    # Random star shaped zones over the tile, and an airport file with small
+    # boundaries for cover_airports_with_highres.
+    rng=numpy.random.RandomState(seed)
+    zone_list=[]
+    for k in range(nbr_zones):
+        (lat_c,lon_c)=rng.uniform(0,1,2)
+        nbr_vertices=rng.randint(3,12)
+        angles=numpy.sort(rng.uniform(0,2*numpy.pi,nbr_vertices))
+        radii=rng.uniform(0.02,0.3,nbr_vertices)
+        lats=numpy.clip(tile.lat+lat_c+radii*numpy.sin(angles),tile.lat,tile.lat+1)
+        lons=numpy.clip(tile.lon+lon_c+radii*numpy.cos(angles),tile.lon,tile.lon+1)
+        zone=[coord for (lat,lon) in zip(lats.tolist()+lats[:1].tolist(),lons.tolist()+lons[:1].tolist()) for coord in (lat,lon)]
+        zone_list.append((zone,int(rng.randint(15,20)),rng.choice(['BI','GO2','EOX','FR'])))
+    dico_airports={}
+    for k in range(nbr_airports):
+        (x,y)=rng.uniform(0,1,2)
+        dico_airports['A'+str(k)]={'key_type':'icao' if k%2 else 'local','boundary':geometry.box(x,y,x+0.01,y+0.01)}
+    with open(FNAMES.apt_file(tile),'wb') as f:
+        pickle.dump(dico_airports,f)
+    return zone_list
+##############################################################################
+
+##############################################################################
+def synthetic_triangulation(tile,nbr_tris,seed=0):
+    # A jittered grid triangulated as Triangle4XP would, written to the 
+    # output .node and .ele files of the tile : nodes with altitude, normal 
+    # and DEM altitude, triangles in random order with water, sea, sea 
+    # equivalent, interpolated altitude (roads, airports) and dummy attributes.
+    rng=numpy.random.RandomState(seed)
+    n=int(numpy.ceil(numpy.sqrt(nbr_tris/2)))+1
+    (x,y)=[a.ravel() for a in numpy.meshgrid(numpy.linspace(0,1,n),numpy.linspace(0,1,n))]
+    inner=(x>0)&(x<1)&(y>0)&(y<1)
+    x[inner]+=rng.uniform(-0.3,0.3,inner.sum())/n
+    y[inner]+=rng.uniform(-0.3,0.3,inner.sum())/n
+    alt=1000*numpy.sin(3*x)*numpy.cos(2*y)+rng.uniform(-5,5,n*n)
+    nodes=numpy.column_stack((x,y,alt,rng.uniform(-0.2,0.2,(n*n,2)),alt+rng.uniform(-1,1,n*n)))
+    # dyadic values, written exactly by %.17g : the files do not depend on 
+    # the last bits of sin and cos on the platform
+    nodes=numpy.round(nodes*2**20)/2**20
+    with open(FNAMES.output_node_file(tile),'w') as f:
+        f.write(str(n*n)+'  2  4  1\n')
+        f.write(''.join('%d  %.17g  %.17g  %.17g  %.17g  %.17g  %.17g    1\n' % ((i+1,)+tuple(row)) for (i,row) in enumerate(nodes.tolist())))
+        f.write('# Generated by Triangle4XP\n')
+    idx=numpy.arange(n*n).reshape((n,n))[:-1,:-1].ravel()
+    tris=numpy.concatenate((numpy.column_stack((idx,idx+1,idx+n+1)),numpy.column_stack((idx,idx+n+1,idx+n))))
+    tris=tris[rng.permutation(len(tris))]
+    (bx,by)=(x[tris].mean(axis=1),y[tris].mean(axis=1))
+    attr=numpy.zeros(len(tris),dtype=numpy.int64)
+    attr[(bx-0.3)**2+(by-0.6)**2<0.04]=1
+    attr[bx>0.8]=2
+    attr[(bx>0.7)&(bx<=0.8)&(by<0.2)]=4
+    attr[(numpy.abs(by-0.3)<0.01)|(numpy.abs(bx-0.5)<0.005)]=8
+    attr[(numpy.abs(bx-0.2)<0.05)&(numpy.abs(by-0.2)<0.03)]=24
+    attr[(numpy.abs(bx-0.25)<0.02)&(numpy.abs(by-0.8)<0.02)]=9
+    with open(FNAMES.output_ele_file(tile),'w') as f:
+        f.write(str(len(tris))+'  3  1\n')
+        f.write(''.join('%d  %d  %d  %d  %d\n' % ((i+1,)+tuple(row)) for (i,row) in enumerate(numpy.column_stack((tris+1,attr)).tolist())))
+        f.write('# Generated by Triangle4XP\n')
+    return
+##############################################################################
+
+##############################################################################
+def synthetic_mesh_input(tile,dem_size=301,relief=1,nbr_road_nodes=0,seed=0):
+    # The inputs of Step 2 for a tile made of a square with a lake and a road
+    # of nbr_road_nodes nodes, over a hilly dem_size x dem_size DEM (also 
+    # given as custom_dem for its size), and the mesh command that 
+    # build_mesh makes of them.
+    (nx,ny)=(dem_size,dem_size)
+    tile.custom_dem=os.path.join(tile.build_dir,'Bench.hgt')
+    numpy.zeros(nx*ny,dtype='>i2').tofile(tile.custom_dem)
+    (tile.apt_curv_tol,tile.coast_curv_tol,tile.min_angle)=(tile.curvature_tol,tile.curvature_tol,5)
+    (x,y)=numpy.meshgrid(numpy.linspace(0,1,nx),numpy.linspace(1,0,ny))
+    rng=numpy.random.RandomState(seed)
+    (500+relief*(300*numpy.sin(60*x)*numpy.cos(40*y)+rng.uniform(0,50,(ny,nx)))).astype(numpy.float32).tofile(FNAMES.alt_file(tile))
+    numpy.ones((1001,1001),dtype=numpy.float32).tofile(FNAMES.weight_file(tile))
+    # the road goes up the left of the tile, away from the lake
+    road=list(zip(0.05+0.15*rng.uniform(0,1,nbr_road_nodes),numpy.linspace(0.02,0.98,nbr_road_nodes)))
+    nodes=[(0,0),(1,0),(1,1),(0,1),(0.3,0.3),(0.6,0.3),(0.6,0.6),(0.3,0.6)]+road
+    segments=[(4*(i//4)+i%4+1,4*(i//4)+(i+1)%4+1,i//4) for i in range(8)]+[(i,i+1,0) for i in range(9,8+nbr_road_nodes)]
+    with open(FNAMES.input_node_file(tile),'w') as f:
+        f.write(str(len(nodes))+' 2 1 0\n'+''.join('%d %.15f %.15f 0\n' % (i+1,px,py) for (i,(px,py)) in enumerate(nodes)))
+    with open(FNAMES.input_poly_file(tile),'w') as f:
+        f.write('0 2 1 0\n'+str(len(segments))+' 1\n'+''.join('%d %d %d %d\n' % ((i+1,)+segment) for (i,segment) in enumerate(segments)))
+        f.write('0\n2 1\n1 0.5 0.5 1 0\n2 0.1 0.1 0 0\n')
+    return [MESH.Triangle4XP_cmd.strip(),'-pAuYBQ','{:.9g}'.format(GEO.lon_to_m(tile.lat)),'{:.9g}'.format(GEO.lat_to_m),
+            str(nx),str(ny),'0','0','1','1','-32768','2','10','0',
+            FNAMES.alt_file(tile),FNAMES.weight_file(tile),FNAMES.input_poly_file(tile)]
+##############################################################################
+
+##############################################################################
+def mesh_outputs(tile,remove=True):
+    hashes=[]
+    for file_name in (FNAMES.output_node_file(tile),FNAMES.output_ele_file(tile)):
+        if not os.path.isfile(file_name): return None
+        # the comment line at the end holds the command, hence the path
+        with open(file_name,'rb') as f:
+            hashes.append(hashlib.md5(f.read().split(b'#')[0]).hexdigest())
+        if remove: os.remove(file_name)
+    return hashes
+##############################################################################
+
+##############################################################################
+def synthetic_weight_map_input(tile,nbr_airports,nbr_coast_nodes,seed=0):
+    # Airport boundaries (some across the tile edges) in the .apt file and a
+    # coastline (partly outside of the tile) as the custom coastline.
+    rng=numpy.random.RandomState(seed)
+    dico_airports={}
+    for i in range(nbr_airports):
+        (x,y)=rng.uniform(-0.01,1.01,2)
+        (dx,dy)=rng.uniform(0.001,0.02,2)
+        dico_airports['AP'+str(i)]={'boundary':geometry.Polygon([(x-dx,y-dy),(x+dx,y-dy+dy*rng.uniform()),(x+dx,y+dy),(x-dx,y+dy)])}
+    with open(FNAMES.apt_file(tile),'wb') as f:
+        pickle.dump(dico_airports,f)
+    t=numpy.linspace(0,1,nbr_coast_nodes)
+    lon=tile.lon-0.05+1.1*t
+    lat=tile.lat+0.5+0.3*numpy.sin(12*t)+rng.uniform(-0.01,0.01,nbr_coast_nodes)
+    custom_coastline=FNAMES.custom_coastline(tile.lat,tile.lon)
+    if not os.path.isdir(os.path.dirname(custom_coastline)): os.makedirs(os.path.dirname(custom_coastline))
+    f=bz2.open(custom_coastline,'wt',encoding='utf-8')
+    f.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version='0.6' generator='Ortho4XP'>\n")
+    for i in range(nbr_coast_nodes):
+        f.write(" <node id='"+str(i+1)+"' lat='"+'{:.7f}'.format(lat[i])+"' lon='"+'{:.7f}'.format(lon[i])+"'/>\n")
+    f.write(" <way id='1'>\n")
+    for i in range(nbr_coast_nodes):
+        f.write("  <nd ref='"+str(i+1)+"'/>\n")
+    f.write("  <tag k='natural' v='coastline'/>\n </way>\n</osm>\n")
+    f.close()
+    return custom_coastline
+##############################################################################
+
+##############################################################################
+def archipelago_triangles(nbr_tris,size=6144,seed=0):
+    # Water triangles of a jittered grid over a size x size mask, around many
+    # small islands, as integer pixel vertices (px,py) of shape (N,3).
+    rng=numpy.random.RandomState(seed)
+    n=int(numpy.ceil(numpy.sqrt(nbr_tris/2)))+1
+    (x,y)=numpy.meshgrid(numpy.linspace(-64,size+64,n),numpy.linspace(-64,size+64,n))
+    step=(size+128)/(n-1)
+    x=numpy.round(x.ravel()+rng.uniform(-0.4,0.4,x.size)*step).astype(numpy.int64)
+    y=numpy.round(y.ravel()+rng.uniform(-0.4,0.4,y.size)*step).astype(numpy.int64)
+    (i,j)=numpy.meshgrid(numpy.arange(n-1),numpy.arange(n-1),indexing='ij')
+    a=(i*n+j).ravel()
+    tris=numpy.concatenate((numpy.column_stack((a,a+1,a+n+1)),numpy.column_stack((a,a+n+1,a+n))))
+    (bx,by)=(x[tris].mean(axis=1)/size,y[tris].mean(axis=1)/size)
+    islands=numpy.sin(37*bx+3*numpy.sin(11*by))*numpy.sin(41*by+2*numpy.cos(13*bx))
+    tris=tris[islands<0.3]
+    return (x[tris],y[tris])
+##############################################################################
+
+##############################################################################
+def start():
+    # Common setup of the benchmarks and checks
+    if not os.path.isdir(FNAMES.Tmp_dir):
+        os.makedirs(FNAMES.Tmp_dir)
+    UI.logprint=bench_logprint
+##############################################################################
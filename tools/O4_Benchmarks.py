@@ -0,0 +1,423 @@
+import os
+import sys
+import io
+import time
+import queue
+import shutil
+import builtins
+import contextlib
+import multiprocessing
+import numpy
+from PIL import Image, ImageDraw
+import O4_Bench_Utils as BENCH
+import O4_UI_Utils as UI
+import O4_Geo_Utils as GEO
+import O4_File_Names as FNAMES
+import O4_Mesh_Utils as MESH
+import O4_DSF_Utils as DSF
+import O4_Mask_Utils as MASK
+import O4_Triangle_Utils as TRI
+
+##############################################################################
+# Timings of the current code on the synthetic data of O4_Bench_Utils, their
+# results are checked by O4_Checks.py.
+##############################################################################
+
+##############################################################################
+def bench_mesh_loader(nbr_tris=3000000):
+    mesh_file=os.path.join(FNAMES.Tmp_dir,'Bench_mesh_loader.mesh')
+    UI.vprint(0,"-> Writing a synthetic mesh with",nbr_tris,"triangles.")
+    (nbr_nodes,nbr_tris)=BENCH.synthetic_mesh(mesh_file,nbr_tris)
+    UI.vprint(0,"   ",nbr_nodes,"nodes,",nbr_tris,"triangles, file size",UI.human_print(os.path.getsize(mesh_file),'B'))
+    BENCH.print_result('numpy loader',*BENCH.run_isolated(MESH.read_mesh_file,mesh_file))
+    MESH.convert_mesh_file(mesh_file)
+    BENCH.print_result('binary sidecar',*BENCH.run_isolated(MESH.load_mesh,mesh_file))
+    MESH.remove_mesh_file(mesh_file)
+##############################################################################
+
+##############################################################################
+def bench_pool_quadtree(nbr_nodes=1000000):
+    (x,y)=BENCH.synthetic_nodes(nbr_nodes)
+    capacity=DSF.quad_capacity_high//50
+    UI.vprint(0,"-> Pool quadtree for",nbr_nodes,"nodes with bucket capacity",capacity)
+    BENCH.print_result('Morton code quadtree',*BENCH.run_isolated(DSF.pool_quadtree,DSF.quad_coords(x),DSF.quad_coords(y),DSF.quad_init_level,capacity))
+##############################################################################
+
+##############################################################################
+def bench_dsf_writer(nbr_tris=1000000):
+    content=BENCH.synthetic_dsf_content(nbr_tris)
+    UI.vprint(0,"-> Writing pools and commands for about",nbr_tris,"triangles.")
+    BENCH.print_result('bulk numpy writer',*BENCH.run_isolated(BENCH.bulk_dsf_writer,content))
+##############################################################################
+
+##############################################################################
+def decode_dsf(data):
+    DSF.decode_dsf(memoryview(data)[:-16])
+##############################################################################
+
+##############################################################################
+def bench_dsf_reader(nbr_tris=1000000):
+    content=BENCH.synthetic_dsf_content(nbr_tris)
+    data=BENCH.synthetic_dsf_file(content)
+    UI.vprint(0,"-> Writing and decoding pools and commands for about",nbr_tris,"triangles ("+UI.human_print(len(data),'B')+").")
+    (elapsed,peak)=BENCH.run_isolated(BENCH.bulk_dsf_writer,content)
+    BENCH.print_result('bulk numpy writer ('+UI.human_print(len(data)/elapsed,'B')+'/s)',elapsed,peak)
+    (elapsed,peak)=BENCH.run_isolated(decode_dsf,data)
+    BENCH.print_result('reader ('+UI.human_print(len(data)/elapsed,'B')+'/s)',elapsed,peak)
+##############################################################################
+
+##############################################################################
+def bench_build_dsf(nbr_tris=1000000):
+    UI.vprint(0,"-> Building the DSF of a synthetic tile with",nbr_tris,"triangles.")
+    tile=BENCH.synthetic_tile(nbr_tris)
+    BENCH.print_result('build_dsf',*BENCH.run_isolated(BENCH.build_dsf_with_workers,tile))
+    UI.vprint(0,"   DSF size",UI.human_print(os.path.getsize(BENCH.dsf_file(tile)),'B'))
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_dsf_workers(nbr_tris=1000000):
+    # Peak RSS only accounts for the parent process.
+    UI.vprint(0,"-> Building the DSF of a synthetic tile with",nbr_tris,"triangles.")
+    tile=BENCH.synthetic_tile(nbr_tris)
+    for workers in sorted({1,2,min(8,max(2,multiprocessing.cpu_count()))}):
+        BENCH.print_result('build_dsf with '+str(workers)+' worker(s)',*BENCH.run_isolated(BENCH.build_dsf_with_workers,tile,workers))
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_hilbert_pools(nbr_tris=1000000):
+    # Quadtree against Hilbert curve pools over synthetic meshes, at the
+    # default capacity and at a capacity which forces the split of initial
+    # cells, as would denser meshes at the default one. Load time is the
+    # decoding time of the DSF reader.
+    (capacity_high,verbosity)=(DSF.quad_capacity_high,UI.verbosity)
+    UI.vprint(0,"   {:<30}{:>8}{:>10}{:>12}{:>10}{:>10}".format('mesh / pools','pools','cross-pool','DSF size','build','load'))
+    for size in (nbr_tris//4,nbr_tris):
+        tile=BENCH.synthetic_tile(size)
+        cell_size=size//2//4**DSF.quad_init_level
+        for capacity in (capacity_high,max(100,2*cell_size//3)):
+            for hilbert in (False,True):
+                (DSF.quad_capacity_high,UI.verbosity,tile.hilbert_pools)=(capacity,0,hilbert)
+                timer=time.time()
+                DSF.build_dsf(tile,queue.Queue())
+                elapsed=time.time()-timer
+                UI.verbosity=verbosity
+                dsf=DSF.read_dsf(BENCH.dsf_file(tile))
+                UI.vprint(0,"   {:<30}{:>8}{:>10}{:>12}{:>10.2f}{:>10.2f}".format(str(size)+' tris, '+str(capacity)+', '+('hilbert' if hilbert else 'quadtree'),\
+                        len(dsf['pools'])//3,int(dsf['tri_cross_pool'].sum()),dsf['size'],elapsed,dsf['decode_time']))
+        shutil.rmtree(tile.build_dir)
+    DSF.quad_capacity_high=capacity_high
+##############################################################################
+
+##############################################################################
+def bench_triangle_strips(nbr_tris=1000000):
+    # CMDS atom size, DSF size, build and load time with and without
+    # triangle strips.
+    verbosity=UI.verbosity
+    tile=BENCH.synthetic_tile(nbr_tris)
+    UI.vprint(0,"-> Building the DSF of a synthetic tile with",nbr_tris,"triangles, with and without strips.")
+    UI.vprint(0,"   {:<20}{:>12}{:>12}{:>10}{:>10}".format('','CMDS atom','DSF size','build','load'))
+    for strips in (False,True):
+        (tile.use_triangle_strips,UI.verbosity)=(strips,0)
+        timer=time.time()
+        DSF.build_dsf(tile,queue.Queue())
+        elapsed=time.time()-timer
+        UI.verbosity=verbosity
+        dsf=DSF.read_dsf(BENCH.dsf_file(tile))
+        with open(BENCH.dsf_file(tile),'rb') as f:
+            data=f.read()
+        cmds_size=sum(end-start+8 for (atom_id,start,end) in DSF.dsf_atoms(data,12,len(data)-16) if atom_id==b'SDMC')
+        UI.vprint(0,"   {:<20}{:>12}{:>12}{:>10.2f}{:>10.2f}".format('triangle strips' if strips else 'triangle lists',cmds_size,dsf['size'],elapsed,dsf['decode_time']))
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_build_cache(nbr_tris=1000000):
+    # Rebuilds of a synthetic tile with three custom zones : unchanged, then
+    # with one zone at another zoomlevel, and the latter from scratch.
+    tile=BENCH.zones_tile(nbr_tris)
+    UI.vprint(0,"-> Building the DSF of a synthetic tile with",nbr_tris,"triangles and",len(tile.zone_list),"zones.")
+    (use_dsf_cache,DSF.use_dsf_cache)=(DSF.use_dsf_cache,True)
+    (elapsed,full_md5,full_pools,queued)=BENCH.incremental_build(tile)
+    BENCH.print_result('build from scratch',elapsed,None)
+    (elapsed,same_md5,same_pools,_)=BENCH.incremental_build(tile)
+    BENCH.print_result('no change, '+str(len(same_pools&full_pools))+'/'+str(len(same_pools))+' pools reused',elapsed,None)
+    tile.zone_list[1]=(tile.zone_list[1][0],17,'EOX')
+    (elapsed,zone_md5,zone_pools,_)=BENCH.incremental_build(tile)
+    BENCH.print_result('one zone, '+str(len(zone_pools&same_pools))+'/'+str(len(zone_pools))+' pools reused',elapsed,None)
+    os.remove(FNAMES.build_manifest_file(tile))
+    (elapsed,scratch_md5,scratch_pools,_)=BENCH.incremental_build(tile)
+    BENCH.print_result('one zone, from scratch',elapsed,None)
+    DSF.use_dsf_cache=use_dsf_cache
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_terrain_files(nbr_terrains=5000):
+    # The .ter files of a tile written in a batch, with the number of file
+    # system calls made.
+    tile=BENCH.synthetic_tile(2)
+    tile.imprint_masks_to_dds=False
+    tile.mask_zl=14
+    terrains=BENCH.synthetic_terrains(nbr_terrains)
+    functions=[(os.path,'exists'),(os.path,'isdir'),(os,'makedirs'),(os,'mkdir'),(os,'stat'),(os,'listdir'),(shutil,'copy'),(builtins,'open')]
+    UI.vprint(0,"-> Writing",nbr_terrains,"terrain files.")
+    with BENCH.call_counter(functions) as counter:
+        timer=time.time()
+        BENCH.write_terrains(tile,terrains)
+        elapsed=time.time()-timer
+    BENCH.print_result('batched',elapsed,None)
+    UI.vprint(0,"     file system calls :",sum(counter.counts.values()),dict(sorted(counter.counts.items())))
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_zone_list(nbr_sets=20):
+    # zone_list_to_ortho_dico on random zone sets
+    tile=BENCH.synthetic_tile(2)
+    tile.cover_extent=0
+    (elapsed,cells)=(0,0)
+    UI.vprint(0,"-> Orthogrid cells of",nbr_sets,"random zone sets.")
+    UI.verbosity,verbosity=0,UI.verbosity
+    for seed in range(nbr_sets):
+        tile.zone_list=BENCH.synthetic_zones(tile,1+seed%8,seed%5,seed)
+        tile.mesh_zl=18+seed%3
+        tile.cover_airports_with_highres=('False','True','ICAO')[seed%3]
+        timer=time.time()
+        cells+=len(DSF.zone_list_to_ortho_dico(tile))
+        elapsed+=time.time()-timer
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+    BENCH.print_result(str(cells)+' cells',elapsed,None)
+##############################################################################
+
+##############################################################################
+def bench_nodes_altitudes(nbr_tris=1000000):
+    # post_process_nodes_altitudes on a synthetic triangulation for each sea
+    # smoothing mode.
+    tile=BENCH.synthetic_tile(2)
+    UI.vprint(0,"-> Post processing the altitudes of a synthetic triangulation with",nbr_tris,"triangles.")
+    BENCH.synthetic_triangulation(tile,nbr_tris)
+    with open(FNAMES.output_node_file(tile)) as f:
+        node_data=f.read()
+    verbosity=UI.verbosity
+    for (mode,water_smoothing) in (('zero',10),('mean',3),('none',0)):
+        (tile.sea_smoothing_mode,tile.water_smoothing)=(mode,water_smoothing)
+        with open(FNAMES.output_node_file(tile),'w') as f:
+            f.write(node_data)
+        TRI.clear_cache()
+        UI.verbosity=0
+        timer=time.time()
+        MESH.post_process_nodes_altitudes(tile)
+        elapsed=time.time()-timer
+        UI.verbosity=verbosity
+        BENCH.print_result('sea '+mode+', '+str(water_smoothing)+' passes',elapsed,None)
+    TRI.clear_cache()
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_triangle_files(nbr_nodes=2000000):
+    # Parsing of the .node and .ele outputs of Triangle4XP with TRI, then
+    # through its cache, and the users of the parsed files.
+    tile=BENCH.synthetic_tile(2)
+    UI.vprint(0,"-> Writing a synthetic triangulation with",nbr_nodes,"nodes.")
+    BENCH.synthetic_triangulation(tile,2*nbr_nodes)
+    (node_file,ele_file)=(FNAMES.output_node_file(tile),FNAMES.output_ele_file(tile))
+    TRI.clear_cache()
+    timer=time.time()
+    nodes=TRI.read_node_file(node_file)[0]
+    TRI.read_ele_file(ele_file)
+    BENCH.print_result('bulk parsing',time.time()-timer,None)
+    timer=time.time()
+    (TRI.read_node_file(node_file),TRI.read_ele_file(ele_file))
+    BENCH.print_result('cached',time.time()-timer,None)
+    UI.verbosity,verbosity=0,UI.verbosity
+    timer=time.time()
+    MESH.write_mesh_file(tile,nodes.ravel())
+    BENCH.print_result('write_mesh_file',time.time()-timer,None)
+    UI.verbosity=verbosity
+    timer=time.time()
+    MASK.triangulation_to_image(node_file[:-7],1/2048,(0,0,1,1))
+    BENCH.print_result('triangulation_to_image',time.time()-timer,None)
+    TRI.clear_cache()
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_speculative_mesh(delay=3):
+    # A primary run of Triangle4XP that fails (a stand in giving up after
+    # delay seconds), followed by the min_angle=0 fallback or run alongside
+    # it. Needs Triangle4XP in Utils.
+    tile=BENCH.synthetic_tile(2)
+    mesh_cmd=BENCH.synthetic_mesh_input(tile)
+    if not os.path.isfile(mesh_cmd[0]):
+        UI.vprint(0,"ERROR: could not find",mesh_cmd[0])
+        shutil.rmtree(tile.build_dir)
+        return
+    fallback_cmd=mesh_cmd[:-5]+['0']+mesh_cmd[-4:]
+    failing_cmd=[sys.executable,'-c','import time,sys; time.sleep(%g); sys.exit(1)' % delay,mesh_cmd[-1]]
+    MESH.speculative_mesh_min_ram=0
+    UI.verbosity,verbosity=0,UI.verbosity
+    for speculative in (False,True):
+        MESH.speculative_mesh=speculative
+        timer=time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.run_triangle4xp(tile,failing_cmd,fallback_cmd)
+        elapsed=time.time()-timer
+        UI.verbosity=verbosity
+        BENCH.print_result('speculative fallback' if speculative else 'sequential retry',elapsed,None)
+        UI.verbosity=0
+        BENCH.mesh_outputs(tile)
+    UI.verbosity=verbosity
+    (MESH.speculative_mesh,MESH.speculative_mesh_min_ram)=(False,8)
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_mesh_cache(dem_size=601):
+    # Step 2 on a synthetic tile, from scratch then with unchanged inputs.
+    tile=BENCH.synthetic_tile(2)
+    BENCH.synthetic_mesh_input(tile,dem_size)
+    (MESH.speculative_mesh,cleaning_level,UI.cleaning_level)=(False,UI.cleaning_level,0)
+    (history_file,FNAMES.Mesh_history_file)=(FNAMES.Mesh_history_file,os.path.join(FNAMES.Tmp_dir,'Bench_mesh_history'))
+    UI.verbosity,verbosity=0,UI.verbosity
+    for label in ('no manifest','same inputs'):
+        timer=time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.build_mesh(tile)
+        elapsed=time.time()-timer
+        UI.verbosity=verbosity
+        BENCH.print_result(label,elapsed,None)
+        UI.verbosity=0
+    (UI.verbosity,UI.cleaning_level)=(verbosity,cleaning_level)
+    os.remove(FNAMES.Mesh_history_file)
+    FNAMES.Mesh_history_file=history_file
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_mesh_index(nbr_tris=2000000):
+    # OBJ extraction of a single ZL16 region of a synthetic mesh through the
+    # triangle index, built on the fly or read from the disk.
+    mesh_file=os.path.join(FNAMES.Tmp_dir,'Bench_mesh_index.mesh')
+    UI.vprint(0,"-> Writing a synthetic mesh with",nbr_tris,"triangles.")
+    BENCH.synthetic_mesh(mesh_file,nbr_tris)
+    MESH.convert_mesh_file(mesh_file)
+    (mesh_version,vertices,normals,triangles,tri_attributes)=MESH.load_mesh(mesh_file)
+    timer=time.time()
+    index=MESH.build_mesh_index(vertices,triangles)
+    BENCH.print_result('index build ('+str(index[3]*index[4])+' cells)',time.time()-timer,None)
+    UI.vprint(0,"   index file size",UI.human_print(os.path.getsize(FNAMES.mesh_index_file(mesh_file)),'B'))
+    del(vertices,normals,triangles,tri_attributes)
+    if not os.path.isdir(FNAMES.Geotiff_dir): os.makedirs(FNAMES.Geotiff_dir)
+    (til_x,til_y)=GEO.wgs84_to_orthogrid(45.5,5.5,16)
+    output_files=(FNAMES.obj_file(til_x,til_y,16,'BI'),FNAMES.mtl_file(til_x,til_y,16,'BI'))
+    UI.verbosity,verbosity=0,UI.verbosity
+    for label in ('index built on the fly','index read'):
+        if label=='index built on the fly': os.remove(FNAMES.mesh_index_file(mesh_file))
+        timer=time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.extract_mesh_to_obj(mesh_file,til_x,til_y,16,'BI')
+        BENCH.print_result(label,time.time()-timer,None)
+    UI.verbosity=verbosity
+    for f in output_files: os.remove(f)
+    MESH.remove_mesh_file(mesh_file)
+##############################################################################
+
+##############################################################################
+def bench_weight_map(nbr_coast_nodes=100000):
+    # The weight map of a synthetic tile with airports and a long coastline,
+    # for a few apt/coast curv_tol and extents.
+    tile=BENCH.synthetic_tile(2)
+    custom_coastline=FNAMES.custom_coastline(tile.lat,tile.lon)
+    if os.path.exists(custom_coastline):
+        UI.vprint(0,"ERROR:",custom_coastline,"already exists, it would be overwritten.")
+        shutil.rmtree(tile.build_dir)
+        return
+    BENCH.synthetic_weight_map_input(tile,50,nbr_coast_nodes)
+    UI.verbosity,verbosity=0,UI.verbosity
+    UI.vprint(0,"   (curvature_tol,apt_curv_tol,apt_curv_ext,coast_curv_tol,coast_curv_ext)")
+    for parameters in ((2,0.5,0.5,1,0.5),(2,1,2,0.5,2),(1,4,0.5,1,0.5),(2,2,0.5,0.25,0.05)):
+        (tile.curvature_tol,tile.apt_curv_tol,tile.apt_curv_ext,tile.coast_curv_tol,tile.coast_curv_ext)=parameters
+        weight_array=numpy.ones((1001,1001),dtype=numpy.float32)
+        timer=time.time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.build_curv_tol_weight_map(tile,weight_array)
+        BENCH.print_result(str(parameters),time.time()-timer,None)
+    UI.verbosity=verbosity
+    os.remove(custom_coastline)
+    try: os.rmdir(os.path.dirname(custom_coastline))
+    except: pass
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_mask_buckets(nbr_tris=1000000):
+    # Water triangles of a synthetic coastal tile and two of its neighbours
+    # bucketed per mask tile, for a few mask_zl and use_masks_for_inland.
+    tile=BENCH.synthetic_tile(nbr_tris)
+    mesh_file_name_list=[FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)]
+    for (lat,lon,seed) in ((tile.lat,tile.lon-1,1),(tile.lat-1,tile.lon,2)):
+        mesh_file_name_list.append(FNAMES.mesh_file(tile.build_dir,lat,lon))
+        BENCH.synthetic_mesh(mesh_file_name_list[-1],nbr_tris//4,lat,lon,seed)
+    for mesh_file_name in mesh_file_name_list: MESH.convert_mesh_file(mesh_file_name)
+    UI.verbosity,verbosity=0,UI.verbosity
+    for (mask_zl,use_masks_for_inland) in ((14,False),(14,True),(16,False),(17,False)):
+        (tile.mask_zl,tile.use_masks_for_inland)=(mask_zl,use_masks_for_inland)
+        [til_x_min,til_y_min]=GEO.wgs84_to_orthogrid(tile.lat+1,tile.lon,tile.mask_zl)
+        [til_x_max,til_y_max]=GEO.wgs84_to_orthogrid(tile.lat,tile.lon+1,tile.mask_zl)
+        timer=time.time()
+        (dico_masks,dico_masks_inland)=MASK.water_triangle_buckets(tile,mesh_file_name_list,til_x_min,til_y_min,til_x_max,til_y_max)
+        UI.verbosity=verbosity
+        BENCH.print_result('ZL'+str(mask_zl)+(', inland masks' if use_masks_for_inland else ''),time.time()-timer,None)
+        UI.vprint(0,"    ",len(dico_masks),"mask tiles,",sum(len(tris) for tris in dico_masks.values()),"water triangles,",\
+                sum(len(tris) for tris in dico_masks_inland.values()),"inland ones.")
+        UI.verbosity=0
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+##############################################################################
+
+##############################################################################
+def bench_mask_raster(nbr_tris=500000):
+    # Water triangles (lat/lon) of a dense archipelago converted to pixels,
+    # one GEO.wgs84_to_pix at a time and with MASK.triangles_to_pixels, then
+    # drawn on a mask.
+    (size,zoomlevel,px0,py0)=(6144,16,8390656,5570560)
+    (px,py)=BENCH.archipelago_triangles(nbr_tris,size)
+    lon=((px+0.5+px0)/2**(zoomlevel+7)-1)*180
+    lat=360/numpy.pi*numpy.arctan(numpy.exp(numpy.pi*(1-(py+0.5+py0)/2**(zoomlevel+7))))-90
+    triangles=numpy.column_stack((lat[:,0],lon[:,0],lat[:,1],lon[:,1],lat[:,2],lon[:,2])).tolist()
+    UI.vprint(0,"-> ",len(triangles),"water triangles on a",size,"x",size,"mask.")
+    timer=time.time()
+    for (lat1,lon1,lat2,lon2,lat3,lon3) in triangles:
+        (GEO.wgs84_to_pix(lat1,lon1,zoomlevel),GEO.wgs84_to_pix(lat2,lon2,zoomlevel),GEO.wgs84_to_pix(lat3,lon3,zoomlevel))
+    BENCH.print_result('wgs84_to_pix',time.time()-timer,None)
+    timer=time.time()
+    (tri_px,tri_py)=MASK.triangles_to_pixels(triangles,zoomlevel,px0,py0)
+    BENCH.print_result('triangles_to_pixels',time.time()-timer,None)
+    timer=time.time()
+    mask_draw=ImageDraw.Draw(Image.new("L",(size,size),'white'))
+    MASK.draw_triangles(mask_draw,tri_px,tri_py,'black')
+    BENCH.print_result('draw_triangles',time.time()-timer,None)
+##############################################################################
+
+benchmarks={'mesh_loader':bench_mesh_loader,'pool_quadtree':bench_pool_quadtree,'dsf_writer':bench_dsf_writer,
+            'dsf_reader':bench_dsf_reader,'build_dsf':bench_build_dsf,'dsf_workers':bench_dsf_workers,
+            'hilbert_pools':bench_hilbert_pools,'triangle_strips':bench_triangle_strips,'build_cache':bench_build_cache,
+            'terrain_files':bench_terrain_files,'zone_list':bench_zone_list,'nodes_altitudes':bench_nodes_altitudes,
+            'triangle_files':bench_triangle_files,'speculative_mesh':bench_speculative_mesh,'mesh_cache':bench_mesh_cache,
+            'mesh_index':bench_mesh_index,'weight_map':bench_weight_map,
+            'mask_buckets':bench_mask_buckets,'mask_raster':bench_mask_raster}
+
+if __name__ == '__main__':
+    Syntax='Syntax :\n--------\n(PYTHON) tools/O4_Benchmarks.py benchmark_name [size]\n\nAvailable benchmarks : '+', '.join(sorted(benchmarks))
+    if len(sys.argv) not in (2,3) or sys.argv[1] not in benchmarks:
+        print(Syntax)
+        sys.exit(1)
+    BENCH.start()
+    if len(sys.argv)==3:
+        benchmarks[sys.argv[1]](int(sys.argv[2]))
+    else:
+        benchmarks[sys.argv[1]]()
@@ -0,0 +1,816 @@
+import os
+import sys
+import io
+import time
+import json
+import queue
+import shutil
+import struct
+import hashlib
+import pickle
+import pathlib
+import threading
+import contextlib
+import http.server
+import numpy
+from PIL import Image, ImageDraw
+import O4_Bench_Utils as BENCH
+import O4_UI_Utils as UI
+import O4_Geo_Utils as GEO
+import O4_File_Names as FNAMES
+import O4_Mesh_Utils as MESH
+import O4_DSF_Utils as DSF
+import O4_Mask_Utils as MASK
+import O4_Triangle_Utils as TRI
+import O4_Imagery_Utils as IMG
+import O4_Config_Utils as CFG
+try:
+    import py7zr
+except:
+    py7zr=None
+
+##############################################################################
+# Correctness checks of the performance sensitive parts of Ortho4XP, on the
+# synthetic data of O4_Bench_Utils. Outputs which used to come from other 
+# implementations are compared to the digests in fixtures/former_outputs.json,
+# those of the former implementations on the same inputs, recorded when they
+# were replaced. Run from the Ortho4XP directory :
+#   python3 tools/O4_Checks.py [check_name ...]
+##############################################################################
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),'fixtures','former_outputs.json')) as f:
+    fixtures=json.load(f)
+
+##############################################################################
+def arrays_md5(*arrays):
+    # md5 of arrays of numbers (shapes included), as little endian int64 or 
+    # float64 whatever their dtype
+    md5=hashlib.md5()
+    for a in arrays:
+        a=numpy.asarray(a)
+        md5.update(str(a.shape).encode())
+        md5.update(numpy.ascontiguousarray(a,dtype='<f8' if a.dtype.kind=='f' else '<i8').tobytes())
+    return md5.hexdigest()
+##############################################################################
+
+##############################################################################
+def text_md5(file_name,skip_lines=0):
+    # md5 of a text file, whatever the line endings of the platform
+    with open(file_name) as f:
+        return hashlib.md5(''.join(f.readlines()[skip_lines:]).encode()).hexdigest()
+##############################################################################
+
+##############################################################################
+def directory_md5(directory):
+    # md5 of the names and contents of the text files of directory
+    md5=hashlib.md5()
+    for file_name in sorted(os.listdir(directory)):
+        md5.update((file_name+'\n'+text_md5(os.path.join(directory,file_name))+'\n').encode())
+    return md5.hexdigest()
+##############################################################################
+
+##############################################################################
+def compare_to_fixture(errors,name,label,digest):
+    if fixtures[name].get(label)!=digest:
+        errors.append(label+": not the output of the former implementation.")
+##############################################################################
+
+##############################################################################
+def check_mesh_loader():
+    # The text and binary mesh loaders against the former line by line one
+    errors=[]
+    mesh_file=os.path.join(FNAMES.Tmp_dir,'Check_mesh_loader.mesh')
+    BENCH.synthetic_mesh(mesh_file,20000)
+    (mesh_version,vertices,normals,triangles,tri_attributes)=MESH.read_mesh_file(mesh_file)
+    compare_to_fixture(errors,'mesh_loader','mesh',arrays_md5(numpy.column_stack((vertices,normals)),numpy.column_stack((triangles,tri_attributes))))
+    MESH.convert_mesh_file(mesh_file)
+    (mesh_version,vertices,normals,triangles,tri_attributes)=MESH.load_mesh(mesh_file)
+    compare_to_fixture(errors,'mesh_loader','mesh',arrays_md5(numpy.column_stack((vertices,normals)),numpy.column_stack((triangles,tri_attributes))))
+    del(vertices,normals,triangles,tri_attributes)
+    MESH.remove_mesh_file(mesh_file)
+    return errors
+##############################################################################
+
+##############################################################################
+def morton_pool_quadtree(x,y,init_level,capacity):
+    (node_pool,pool_keys)=DSF.pool_quadtree(DSF.quad_coords(x),DSF.quad_coords(y),init_level,capacity)
+    nodes=numpy.argsort(node_pool,kind='stable')
+    starts=numpy.searchsorted(node_pool[nodes],numpy.arange(len(pool_keys)+1))
+    return [(pool_keys[k],nodes[starts[k]:starts[k+1]].tolist()) for k in range(len(pool_keys))]
+##############################################################################
+
+##############################################################################
+def pools_md5(pools):
+    return arrays_md5([key for (key,nodes) in pools],[len(nodes) for (key,nodes) in pools],[node for (key,nodes) in pools for node in nodes])
+##############################################################################
+
+##############################################################################
+def check_pool_quadtree():
+    # The pools of the Morton code quadtree, and their order
+    errors=[]
+    for (size,capacity,seed) in ((2000,7,1),(20000,50,2),(100000,1000,3)):
+        (x,y)=BENCH.synthetic_nodes(size,seed)
+        for init_level in (0,3):
+            label=str(size)+' nodes, capacity '+str(capacity)+', initial level '+str(init_level)
+            compare_to_fixture(errors,'pool_quadtree',label,pools_md5(morton_pool_quadtree(x,y,init_level,capacity)))
+    return errors
+##############################################################################
+
+##############################################################################
+def check_dsf_writer():
+    # Pools and commands written in bulk, against the former struct.pack writer
+    errors=[]
+    for seed in range(3):
+        content=BENCH.synthetic_dsf_content(3000,pool_nbr=4,nbr_terrains=10,seed=seed)
+        compare_to_fixture(errors,'dsf_writer','seed '+str(seed),hashlib.md5(BENCH.bulk_dsf_writer(content)).hexdigest())
+    return errors
+##############################################################################
+
+##############################################################################
+def expected_dsf_triangles(content):
+    # The (terrain,pool,point) of the vertices written for textured_tris 
+    (dsf_pools,dsf_pool_plane,pool_param,pool_nbr,textured_tris,overlay_terrains,dico_new_dsf_pool)=content
+    (terrains,pools,points)=([],[],[])
+    for terrain_idx in textured_tris:
+        for idx_dsfpool in textured_tris[terrain_idx]:
+            tris=numpy.array(textured_tris[terrain_idx][idx_dsfpool],dtype=numpy.int64)
+            if idx_dsfpool=='cross-pool':
+                pools.append(numpy.array([dico_new_dsf_pool[k] for k in tris[0::2].tolist()],dtype=numpy.int64))
+                points.append(tris[1::2])
+            else:
+                pools.append(numpy.full(len(tris),dico_new_dsf_pool[idx_dsfpool]))
+                points.append(tris)
+            terrains.append(numpy.full(len(points[-1]),terrain_idx))
+    return (numpy.concatenate(terrains),numpy.concatenate(pools),numpy.concatenate(points))
+##############################################################################
+
+##############################################################################
+def dsf_round_trip(content):
+    # True if decoding the bulk writer output gives back content
+    (dsf_pools,dsf_pool_plane,pool_param,pool_nbr,textured_tris,overlay_terrains,dico_new_dsf_pool)=content
+    dsf=DSF.decode_dsf(memoryview(BENCH.synthetic_dsf_file(content))[:-16])
+    non_empty=[k for k in range(len(dsf_pools)) if dsf_pools[k]]
+    if len(dsf['pools'])!=len(non_empty) or len(dsf['scalings'])!=len(non_empty):
+        return False
+    for (pool,scaling,k) in zip(dsf['pools'],dsf['scalings'],non_empty):
+        if not numpy.array_equal(pool.ravel(),numpy.array(dsf_pools[k],dtype=numpy.uint16)) or \
+           not numpy.array_equal(scaling.ravel(),numpy.array(pool_param[k%pool_nbr][:2*dsf_pool_plane[k]],dtype=numpy.float32)):
+            return False
+    (terrains,pools,points)=expected_dsf_triangles(content)
+    patch_terrains=numpy.concatenate([numpy.full(3*(end-first),terrain) for (terrain,flags,near,far,first,end) in dsf['patches']])
+    return numpy.array_equal(patch_terrains,terrains) and numpy.array_equal(dsf['tri_pools'].ravel(),pools) and \
+           numpy.array_equal(dsf['tri_points'].ravel(),points)
+##############################################################################
+
+##############################################################################
+def check_dsf_reader():
+    # The reader has to give back what the writer was fed with, and a DSF 
+    # built from a synthetic mesh has to pass the validation.
+    errors=[]
+    for seed in range(3):
+        if not dsf_round_trip(BENCH.synthetic_dsf_content(3000,pool_nbr=4,nbr_terrains=10,seed=seed)):
+            errors.append("the decoded DSF differs from the written content for seed "+str(seed)+".")
+    tile=BENCH.synthetic_tile(50000)
+    UI.verbosity,verbosity=0,UI.verbosity
+    DSF.build_dsf(tile,queue.Queue())
+    UI.verbosity=verbosity
+    dsf=DSF.read_dsf(BENCH.dsf_file(tile))
+    shutil.rmtree(tile.build_dir)
+    errors.extend(DSF.validate_dsf(dsf))
+    return errors
+##############################################################################
+
+##############################################################################
+def check_dsf_workers():
+    # The DSF must not depend on the number of workers (each build is run in
+    # a process of its own, max_dsf_workers being global).
+    tile=BENCH.synthetic_tile(200000)
+    digests=set()
+    UI.verbosity,verbosity=0,UI.verbosity
+    for workers in (1,2):
+        BENCH.run_isolated(BENCH.build_dsf_with_workers,tile,workers)
+        with open(BENCH.dsf_file(tile),'rb') as f:
+            digests.add(hashlib.md5(f.read()).hexdigest())
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+    return [] if len(digests)==1 else ["the DSF depends on the number of workers."]
+##############################################################################
+
+##############################################################################
+def canonical_triangles(vertices):
+    # (nbr_tris,3) vertex ids (below 2**24) rotated so that their smallest
+    # (first,second) pair comes first, which keeps their winding, then sorted
+    vertices=numpy.asarray(vertices,dtype=numpy.int64)
+    rotations=numpy.stack([numpy.roll(vertices,-k,axis=1) for k in range(3)])
+    best=numpy.argmin((rotations[:,:,0]<<24)|rotations[:,:,1],axis=0)
+    vertices=rotations[best,numpy.arange(len(vertices))]
+    return vertices[numpy.lexsort(vertices.T[::-1])]
+##############################################################################
+
+##############################################################################
+def strip_round_trip(tris):
+    # True if decoding the in-pool commands of tris gives back the same 
+    # triangles, up to their order and to a rotation of their vertices
+    cmds=struct.pack('<BHBHBBff',4,0,1,0,18,1,0,-1)+DSF.in_pool_commands(numpy.asarray(tris,dtype=numpy.uint16),True)
+    (patches,tri_pools,tri_points,tri_cross_pool)=DSF.decode_commands(cmds,0,len(cmds))
+    return numpy.array_equal(canonical_triangles(tri_points),canonical_triangles(tris)) and not tri_pools.any()
+##############################################################################
+
+##############################################################################
+def grid_triangles(width,height,seed=0):
+    # Consistently oriented triangles of a width x height grid, shuffled and
+    # with their vertices randomly rotated
+    rng=numpy.random.RandomState(seed)
+    corners=(numpy.arange(height)[:,None]*(width+1)+numpy.arange(width)).ravel()
+    tris=numpy.concatenate((numpy.column_stack((corners,corners+1,corners+width+2)),numpy.column_stack((corners,corners+width+2,corners+width+1))))
+    tris=tris[rng.permutation(len(tris))]
+    return numpy.stack([numpy.roll(tri,-k) for (tri,k) in zip(tris,rng.randint(0,3,len(tris)))])
+##############################################################################
+
+##############################################################################
+def check_triangle_strips():
+    # Triangle strips against plain triangle lists : the decoded triangles 
+    # have to be the same, first on small meshes (long strips cut in pieces,
+    # random and degenerate triangles) then on the DSF of a synthetic mesh.
+    errors=[]
+    rng=numpy.random.RandomState(0)
+    for (label,tris) in (('grid',grid_triangles(300,200)),('strip',grid_triangles(600,1)),('random',rng.randint(0,50,(3000,3))),\
+                         ('degenerate',numpy.concatenate((grid_triangles(20,20),[[5,5,6],[6,5,5],[7,7,7],[0,1,22],[0,1,22]])))):
+        if not strip_round_trip(tris):
+            errors.append("triangle strips do not decode to the "+label+" triangles.")
+    tile=BENCH.synthetic_tile(200000)
+    UI.verbosity,verbosity=0,UI.verbosity
+    decoded=[]
+    for strips in (False,True):
+        tile.use_triangle_strips=strips
+        DSF.build_dsf(tile,queue.Queue())
+        decoded.append(DSF.read_dsf(BENCH.dsf_file(tile)))
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+    (lists,strips)=decoded
+    if lists['patches']!=strips['patches']:
+        return errors+["terrain patches differ with triangle strips."]
+    for (terrain,flags,near,far,first,end) in lists['patches']:
+        if not numpy.array_equal(*(canonical_triangles((dsf['tri_pools'][first:end]<<16)|dsf['tri_points'][first:end]) for dsf in decoded)):
+            errors.append("triangles of a patch of terrain "+str(terrain)+" differ with triangle strips.")
+    return errors
+##############################################################################
+
+##############################################################################
+def check_build_cache():
+    # Rebuilds of a synthetic tile with three custom zones : unchanged, then
+    # with one zone at another zoomlevel, which has to give the very same DSF 
+    # as a build from scratch. Then, the provider of one zone is modified and
+    # only its (placeholder) textures should be removed. Last, a texture to
+    # be downloaded again fails, and should be queued again by the next build
+    # although its former file is still there.
+    errors=[]
+    tile=BENCH.zones_tile(200000)
+    (use_dsf_cache,DSF.use_dsf_cache)=(DSF.use_dsf_cache,True)
+    (elapsed,full_md5,full_pools,queued)=BENCH.incremental_build(tile)
+    (elapsed,same_md5,same_pools,_)=BENCH.incremental_build(tile)
+    tile.zone_list[1]=(tile.zone_list[1][0],17,'EOX')
+    (elapsed,zone_md5,zone_pools,_)=BENCH.incremental_build(tile)
+    os.remove(FNAMES.build_manifest_file(tile))
+    (elapsed,scratch_md5,scratch_pools,_)=BENCH.incremental_build(tile)
+    if same_md5!=full_md5 or zone_md5!=scratch_md5:
+        errors.append("incremental builds differ from builds from scratch.")
+    if not zone_pools&same_pools:
+        errors.append("no pool reused after a zone change.")
+    with open(FNAMES.build_manifest_file(tile),'rb') as f:
+        textures=list(pickle.load(f)['textures'])
+    for texture_file_name in textures:
+        open(os.path.join(tile.build_dir,'textures',texture_file_name),'wb').close()
+    go2_provider=IMG.providers_dict.get('GO2')
+    IMG.providers_dict['GO2']=dict(go2_provider or {},max_zl=18)
+    BENCH.incremental_build(tile)
+    if go2_provider is None: del(IMG.providers_dict['GO2'])
+    else: IMG.providers_dict['GO2']=go2_provider
+    removed=sorted(texture_file_name for texture_file_name in textures if not os.path.isfile(os.path.join(tile.build_dir,'textures',texture_file_name)))
+    # a texture to be downloaded, which fails and is left as it was
+    failed=queued[:1]
+    failed_file_name=os.path.join(tile.build_dir,'textures',FNAMES.dds_file_name_from_attributes(*failed[0]))
+    os.remove(failed_file_name)
+    BENCH.incremental_build(tile,failed)
+    open(failed_file_name,'wb').close()
+    queued_again=BENCH.incremental_build(tile)[3]
+    DSF.use_dsf_cache=use_dsf_cache
+    shutil.rmtree(tile.build_dir)
+    if not removed or any('GO2' not in texture_file_name for texture_file_name in removed) or \
+       len(removed)!=len([texture_file_name for texture_file_name in textures if 'GO2' in texture_file_name]):
+        errors.append("a provider change should remove its textures only, "+str(len(removed))+" of "+str(len(textures))+" removed.")
+    if queued_again!=failed:
+        errors.append("the next build should download again the texture which failed, and it only, "+str(len(queued_again))+" queued.")
+    return errors
+##############################################################################
+
+##############################################################################
+def check_terrain_files():
+    # The .ter files written in a batch from templates, against those written
+    # one by one as before
+    errors=[]
+    tile=BENCH.synthetic_tile(2)
+    (tile.imprint_masks_to_dds,tile.mask_zl)=(False,14)
+    BENCH.write_terrains(tile,BENCH.synthetic_terrains(500))
+    compare_to_fixture(errors,'terrain_files','terrain',directory_md5(os.path.join(tile.build_dir,'terrain')))
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def dico_md5(dico):
+    # md5 of an ortho dico, cells in order
+    return hashlib.md5(repr([(int(til_x),int(til_y),int(til_x_text),int(til_y_text),int(zoomlevel),str(provider_code)) for \
+            ((til_x,til_y),(til_x_text,til_y_text,zoomlevel,provider_code)) in dico.items()]).encode()).hexdigest()
+##############################################################################
+
+##############################################################################
+def check_zone_list():
+    # zone_list_to_ortho_dico on random zone sets, against the former 
+    # 4096x4096 rasterization (cells near the edges of the zones included)
+    errors=[]
+    tile=BENCH.synthetic_tile(2)
+    tile.cover_extent=0
+    UI.verbosity,verbosity=0,UI.verbosity
+    for seed in range(20):
+        tile.zone_list=BENCH.synthetic_zones(tile,1+seed%8,seed%5,seed)
+        tile.mesh_zl=18+seed%3
+        tile.cover_airports_with_highres=('False','True','ICAO')[seed%3]
+        compare_to_fixture(errors,'zone_list','set '+str(seed),dico_md5(DSF.zone_list_to_ortho_dico(tile)))
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_nodes_altitudes():
+    # The node file of post_process_nodes_altitudes for each sea smoothing 
+    # mode, against the former line by line version
+    errors=[]
+    tile=BENCH.synthetic_tile(2)
+    BENCH.synthetic_triangulation(tile,20000)
+    with open(FNAMES.output_node_file(tile)) as f:
+        node_data=f.read()
+    UI.verbosity,verbosity=0,UI.verbosity
+    for (mode,water_smoothing) in (('zero',10),('mean',3),('none',0)):
+        (tile.sea_smoothing_mode,tile.water_smoothing)=(mode,water_smoothing)
+        with open(FNAMES.output_node_file(tile),'w') as f:
+            f.write(node_data)
+        MESH.post_process_nodes_altitudes(tile)
+        compare_to_fixture(errors,'nodes_altitudes','sea '+mode+', '+str(water_smoothing)+' passes',text_md5(FNAMES.output_node_file(tile)))
+    UI.verbosity=verbosity
+    TRI.clear_cache()
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_triangle_files():
+    # The Triangle4XP outputs parsed by TRI (directly and through its cache),
+    # and their users, against the former line by line versions.
+    errors=[]
+    tile=BENCH.synthetic_tile(2)
+    BENCH.synthetic_triangulation(tile,100000)
+    (node_file,ele_file)=(FNAMES.output_node_file(tile),FNAMES.output_ele_file(tile))
+    TRI.clear_cache()
+    for label in ('parsed','cached'):
+        (nodes,triangles,attributes)=(TRI.read_node_file(node_file)[0],*TRI.read_ele_file(ele_file))
+        if arrays_md5(nodes.reshape((-1,6)),triangles,attributes)!=fixtures['triangle_files']['parsed']:
+            errors.append(label+": not the arrays of the former parser.")
+    UI.verbosity,verbosity=0,UI.verbosity
+    MESH.write_mesh_file(tile,nodes.ravel())
+    UI.verbosity=verbosity
+    # (but for its first line, the Ortho4XP version)
+    compare_to_fixture(errors,'triangle_files','mesh file',text_md5(FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon),1))
+    (bbox,mask_im)=MASK.triangulation_to_image(node_file[:-7],1/2048,(0,0,1,1))
+    compare_to_fixture(errors,'triangle_files','triangulation image',hashlib.md5(mask_im.tobytes()).hexdigest())
+    TRI.clear_cache()
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_speculative_mesh(delay=3):
+    # The min_angle=0 fallback of Triangle4XP run alongside a primary run that
+    # fails (a stand in for Triangle4XP giving up after delay seconds), then
+    # alongside one that succeeds, and the RAM guard. Needs Triangle4XP in 
+    # Utils.
+    tile=BENCH.synthetic_tile(2)
+    mesh_cmd=BENCH.synthetic_mesh_input(tile)
+    if not os.path.isfile(mesh_cmd[0]):
+        shutil.rmtree(tile.build_dir)
+        return ["could not find "+mesh_cmd[0]]
+    fallback_cmd=mesh_cmd[:-5]+['0']+mesh_cmd[-4:]
+    stand_in=lambda duration,returncode: [sys.executable,'-c','import time,sys; time.sleep(%g); sys.exit(%d)' % (duration,returncode),mesh_cmd[-1]]
+    (MESH.speculative_mesh,MESH.speculative_mesh_min_ram)=(True,0)
+    MESH.speculative_mesh_stats.update({'runs':0,'saves':0,'saved_time':0})
+    UI.verbosity,verbosity=0,UI.verbosity
+    with contextlib.redirect_stdout(io.StringIO()):
+        MESH.run_mesh_cmd(fallback_cmd)
+        reference=BENCH.mesh_outputs(tile)
+        results={}
+        for (label,fallback) in (('',fallback_cmd),(', slow fallback',stand_in(delay,0))):
+            for speculative in (False,True):
+                MESH.speculative_mesh=speculative
+                timer=time.time()
+                returncode=MESH.run_triangle4xp(tile,stand_in(delay,1),fallback)
+                results[label,speculative]=(time.time()-timer,returncode,BENCH.mesh_outputs(tile) if not label else reference)
+        timer=time.time()
+        kept_primary=(MESH.run_triangle4xp(tile,mesh_cmd,stand_in(10*delay,0)),time.time()-timer,BENCH.mesh_outputs(tile))
+        MESH.speculative_mesh_min_ram=1e9
+        guarded=MESH.start_speculative_mesh(tile,fallback_cmd)
+    UI.verbosity=verbosity
+    (MESH.speculative_mesh,MESH.speculative_mesh_min_ram)=(False,8)
+    errors=[]
+    if reference is None: errors.append("Triangle4XP failed on the synthetic input.")
+    if any(result[1] or result[2]!=reference for result in results.values()): errors.append("the fallback meshes differ.")
+    if kept_primary[0] or kept_primary[2] is None or kept_primary[1]>5*delay: errors.append("the successful primary run was not kept at once.")
+    if MESH.speculative_mesh_stats['saves']!=2 or MESH.speculative_mesh_stats['runs']!=3: errors.append("wrong speculative run statistics.")
+    if results[', slow fallback',True][0]>1.5*delay: errors.append("the slow fallback did not run alongside the primary run.")
+    if guarded is not None: errors.append("the RAM guard did not prevent the speculative run.")
+    if os.path.isdir(FNAMES.speculative_mesh_dir(tile)): errors.append("the speculative directory was left behind.")
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_mesh_cache(dem_size=301):
+    # Step 2 on a synthetic tile through a sequence of input changes, with 
+    # Triangle4XP expected to run or not from the mesh manifest.
+    tile=BENCH.synthetic_tile(2)
+    BENCH.synthetic_mesh_input(tile,dem_size)
+    mesh_file=FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)
+    alt_file=FNAMES.alt_file(tile)
+    with open(alt_file,'rb') as f:
+        altitudes=f.read()
+    def write_altitudes(data):
+        with open(alt_file,'wb') as f: f.write(data)
+    def modify_mesh():
+        with open(mesh_file,'a') as f: f.write('\n')
+    def set_attribute(owner,name,value):
+        return lambda: setattr(owner,name,value)
+    changed_altitudes=numpy.frombuffer(altitudes,dtype=numpy.float32).copy()
+    changed_altitudes[1000]+=100
+    steps=[('no manifest',None,False),
+           ('same inputs',None,True),
+           ('DEM file changed',lambda: write_altitudes(changed_altitudes.tobytes()),False),
+           ('same inputs',None,True),
+           ('DEM file restored',lambda: write_altitudes(altitudes),False),
+           ('min_angle changed',set_attribute(tile,'min_angle',10),False),
+           ('min_angle restored',set_attribute(tile,'min_angle',5),False),
+           ('mesh file modified',modify_mesh,False),
+           ('same inputs',None,True),
+           ('rebuild forced',set_attribute(MESH,'force_mesh_rebuild',True),False),
+           ('mesh cache disabled',lambda: (setattr(MESH,'force_mesh_rebuild',False),setattr(MESH,'use_mesh_cache',False)),False),
+           ('mesh cache enabled',set_attribute(MESH,'use_mesh_cache',True),True)]
+    (MESH.speculative_mesh,cleaning_level,UI.cleaning_level)=(False,UI.cleaning_level,0)
+    (history_file,FNAMES.Mesh_history_file)=(FNAMES.Mesh_history_file,os.path.join(FNAMES.Tmp_dir,'Check_mesh_history'))
+    UI.verbosity,verbosity=0,UI.verbosity
+    errors=[]
+    reference=None
+    for (label,change,hit) in steps:
+        if change: change()
+        previous=MESH.file_md5(mesh_file)
+        with BENCH.call_counter([(MESH,'run_triangle4xp'),(MESH,'post_process_nodes_altitudes')]) as counter:
+            with contextlib.redirect_stdout(io.StringIO()):
+                returncode=MESH.build_mesh(tile)
+        mesh=MESH.file_md5(mesh_file)
+        if not returncode: errors.append(label+": build_mesh failed.")
+        if TRI.parsed_files: errors.append(label+": parsed Triangle files left in memory.")
+        if bool(counter.counts)==hit: errors.append(label+": "+("Triangle4XP was run" if hit else "Triangle4XP was not run")+".")
+        if hit and mesh!=previous: errors.append(label+": the mesh changed on a hit.")
+        if label.endswith('restored') and mesh!=reference: errors.append(label+": not the same mesh as before the change.")
+        reference=reference or mesh
+    (UI.verbosity,UI.cleaning_level)=(verbosity,cleaning_level)
+    os.remove(FNAMES.Mesh_history_file)
+    FNAMES.Mesh_history_file=history_file
+    if MESH.read_binary_mesh_file(mesh_file) is None: errors.append("the binary mesh is outdated.")
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_mesh_estimate(dem_size=601):
+    # Step 2 on a corpus of synthetic tiles (relief, roads and curvature_tol
+    # varying), recorded in a history file of its own. Each triangle count 
+    # is then predicted with the default coefficients and with those fitted 
+    # to the rest of the corpus, and the curvature_tol suggested to fit a 
+    # limit_tris is tried out.
+    history_file=FNAMES.Mesh_history_file
+    FNAMES.Mesh_history_file=os.path.join(FNAMES.Tmp_dir,'Check_mesh_history')
+    if os.path.isfile(FNAMES.Mesh_history_file): os.remove(FNAMES.Mesh_history_file)
+    corpus=[(relief,nbr_road_nodes,curv_tol) for (relief,nbr_road_nodes) in ((1,0),(0.5,300),(0.25,1500)) for curv_tol in (1.5,3,6)]
+    (MESH.speculative_mesh,MESH.use_mesh_cache,cleaning_level,UI.cleaning_level)=(False,False,UI.cleaning_level,0)
+    UI.verbosity,verbosity=0,UI.verbosity
+    def build(relief,nbr_road_nodes,curv_tol,limit_tris=0):
+        tile=BENCH.synthetic_tile(2)
+        tile.curvature_tol=curv_tol
+        tile.limit_tris=limit_tris
+        BENCH.synthetic_mesh_input(tile,dem_size,relief,nbr_road_nodes)
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.build_mesh(tile)
+        return tile
+    for sample in corpus:
+        build(*sample)
+    history=MESH.read_mesh_history()
+    UI.verbosity=verbosity
+    errors={'default':[],'fitted':[]}
+    UI.vprint(2,"   relief roads curv_tol  triangles    default     fitted")
+    for (sample,entry) in zip(corpus,history):
+        predictions=[]
+        for (label,coefficients) in (('default',MESH.default_estimate_coefficients),('fitted',MESH.estimate_coefficients([e for e in history if e is not entry]))):
+            predictions.append(coefficients[0]*entry['features']['curvature']+coefficients[1]*entry['features']['nodes'])
+            errors[label].append(abs(predictions[-1]/entry['triangles']-1))
+        UI.vprint(2,"   {:6} {:5} {:8} {:10} {:10.0f} {:10.0f}".format(*sample,entry['triangles'],*predictions))
+    UI.vprint(2,"   Mean relative error : {:.0%} with the default coefficients (set on this corpus), {:.0%} with those fitted on the other builds.".format(\
+            numpy.mean(errors['default']),numpy.mean(errors['fitted'])))
+    UI.vprint(2,"   Fitted on the whole corpus :",MESH.estimate_coefficients(history))
+    # a limit_tris at a third of the triangles of the first build
+    UI.verbosity=0
+    limit_tris=history[0]['triangles']//3
+    tile=BENCH.synthetic_tile(2)
+    (tile.curvature_tol,tile.limit_tris)=(corpus[0][2],limit_tris)
+    BENCH.synthetic_mesh_input(tile,dem_size,*corpus[0][:2])
+    suggested_curv_tol=MESH.estimate_mesh(tile)[1]
+    tile=build(corpus[0][0],corpus[0][1],suggested_curv_tol)
+    nbr_tris=MESH.read_mesh_history()[-1]['triangles']
+    (UI.verbosity,UI.cleaning_level,MESH.use_mesh_cache)=(verbosity,cleaning_level,True)
+    os.remove(FNAMES.Mesh_history_file)
+    FNAMES.Mesh_history_file=history_file
+    shutil.rmtree(tile.build_dir)
+    UI.vprint(2,"   With limit_tris="+str(limit_tris)+" the suggested curvature_tol is {:.3g}, it gave {} triangles ({:+.0%}).".format(\
+            suggested_curv_tol,nbr_tris,nbr_tris/limit_tris-1))
+    if numpy.mean(errors['fitted'])>0.3 or abs(nbr_tris/limit_tris-1)>0.3:
+        return ["the predictions are off by more than 30%."]
+    return []
+##############################################################################
+
+##############################################################################
+def check_mesh_index():
+    # OBJ extraction of a single ZL16 region of a synthetic mesh through the
+    # triangle index (built on the fly, then read from the disk), against the
+    # former extraction through all the triangles.
+    errors=[]
+    mesh_file=os.path.join(FNAMES.Tmp_dir,'Check_mesh_index.mesh')
+    BENCH.synthetic_mesh(mesh_file,200000)
+    MESH.convert_mesh_file(mesh_file)
+    if not os.path.isdir(FNAMES.Geotiff_dir): os.makedirs(FNAMES.Geotiff_dir)
+    (til_x,til_y)=GEO.wgs84_to_orthogrid(45.5,5.5,16)
+    output_files=(FNAMES.obj_file(til_x,til_y,16,'BI'),FNAMES.mtl_file(til_x,til_y,16,'BI'))
+    UI.verbosity,verbosity=0,UI.verbosity
+    for label in ('index built on the fly','index read'):
+        if label=='index built on the fly' and os.path.isfile(FNAMES.mesh_index_file(mesh_file)): os.remove(FNAMES.mesh_index_file(mesh_file))
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.extract_mesh_to_obj(mesh_file,til_x,til_y,16,'BI')
+        if [text_md5(f) for f in output_files]!=fixtures['mesh_index']['obj and mtl']:
+            errors.append(label+": not the obj and mtl files of the former extraction.")
+    UI.verbosity=verbosity
+    for f in output_files: os.remove(f)
+    MESH.remove_mesh_file(mesh_file)
+    return errors
+##############################################################################
+
+##############################################################################
+def check_weight_map():
+    # The weight map of a synthetic tile with airports and a long coastline,
+    # for a few apt/coast curv_tol and extents, against the former one.
+    tile=BENCH.synthetic_tile(2)
+    custom_coastline=FNAMES.custom_coastline(tile.lat,tile.lon)
+    if os.path.exists(custom_coastline):
+        shutil.rmtree(tile.build_dir)
+        return [custom_coastline+" already exists, it would be overwritten."]
+    BENCH.synthetic_weight_map_input(tile,50,20000)
+    UI.verbosity,verbosity=0,UI.verbosity
+    errors=[]
+    for parameters in ((2,0.5,0.5,1,0.5),(2,1,2,0.5,2),(1,4,0.5,1,0.5),(2,2,0.5,0.25,0.05)):
+        (tile.curvature_tol,tile.apt_curv_tol,tile.apt_curv_ext,tile.coast_curv_tol,tile.coast_curv_ext)=parameters
+        weight_array=numpy.ones((1001,1001),dtype=numpy.float32)
+        with contextlib.redirect_stdout(io.StringIO()):
+            MESH.build_curv_tol_weight_map(tile,weight_array)
+        compare_to_fixture(errors,'weight_map',str(parameters),arrays_md5(weight_array))
+    UI.verbosity=verbosity
+    os.remove(custom_coastline)
+    try: os.rmdir(os.path.dirname(custom_coastline))
+    except: pass
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+class PartialContentHandler(http.server.BaseHTTPRequestHandler):
+    # Serves the files of server.root_dir, with HTTP Range requests (unless
+    # server.use_ranges is unset), closing the connection after 
+    # server.cut_after bytes of the next server.cuts responses. Requests are
+    # logged in server.requests as (path,range,status).
+
+    def do_GET(self):
+        server=self.server
+        file_name=os.path.join(server.root_dir,*self.path.strip('/').split('/'))
+        byte_range=self.headers.get('Range')
+        if not os.path.isfile(file_name):
+            server.requests.append((self.path,byte_range,404))
+            self.send_error(404)
+            return
+        with open(file_name,'rb') as f:
+            data=f.read()
+        offset=int(byte_range[6:-1]) if (byte_range and server.use_ranges) else 0
+        status=206 if (byte_range and server.use_ranges) else 200
+        if offset>=len(data):
+            server.requests.append((self.path,byte_range,416))
+            self.send_response(416)
+            self.send_header('Content-Range','bytes */'+str(len(data)))
+            self.send_header('Content-Length','0')
+            self.end_headers()
+            return
+        server.requests.append((self.path,byte_range,status))
+        self.send_response(status)
+        if status==206: self.send_header('Content-Range','bytes '+str(offset)+'-'+str(len(data)-1)+'/'+str(len(data)))
+        self.send_header('Content-Length',str(len(data)-offset))
+        self.end_headers()
+        if server.cuts:
+            server.cuts-=1
+            self.wfile.write(data[offset:offset+server.cut_after])
+            server.served+=min(server.cut_after,len(data)-offset)
+            self.close_connection=True
+            return
+        self.wfile.write(data[offset:])
+        if self.path.endswith('.7z'): server.served+=len(data)-offset
+
+    def log_message(self,*args):
+        pass
+##############################################################################
+
+##############################################################################
+def check_community_mesh(nbr_tris=50000):
+    # Community mesh downloads from a local stand-in server (broken 
+    # connections, interrupted sessions, no Range support, wrong checksum)
+    # and from file:// and directory mirrors, with checks of the requests
+    # made and of the extracted mesh.
+    if not MESH.has_py7zr:
+        return ["py7zr is needed to write the archives of the check."]
+    bench_dir=os.path.join(FNAMES.Tmp_dir,'Check_community')
+    if os.path.isdir(bench_dir): shutil.rmtree(bench_dir)
+    (server_dir,build_dir)=(os.path.join(bench_dir,'server'),os.path.join(bench_dir,'tile'))
+    os.makedirs(server_dir); os.makedirs(build_dir)
+    tile=CFG.Tile(45,5,build_dir)
+    mesh_file=FNAMES.mesh_file(build_dir,tile.lat,tile.lon)
+    archive_name=os.path.basename(mesh_file)+'.7z'
+    archive=os.path.join(server_dir,archive_name)
+    BENCH.synthetic_mesh(mesh_file,nbr_tris)
+    mesh_md5=MESH.file_md5(mesh_file)
+    with py7zr.SevenZipFile(archive,'w') as z:
+        z.write(mesh_file,'Meshes/'+os.path.basename(mesh_file))
+    os.remove(mesh_file)
+    with open(archive,'rb') as f:
+        data=f.read()
+    def write_manifest(checksum):
+        with open(os.path.join(server_dir,MESH.community_manifest),'w') as f:
+            f.write(checksum+'  '+archive_name+'\n')
+    write_manifest(hashlib.sha256(data).hexdigest())
+    server=http.server.ThreadingHTTPServer(('127.0.0.1',0),PartialContentHandler)
+    server.root_dir=server_dir
+    server_thread=threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    http_url='http://127.0.0.1:'+str(server.server_address[1])+'/'
+    def partial_download(nbr_bytes):
+        return lambda: open(mesh_file+'.7z.part','wb').write(data[:nbr_bytes])
+    (half,third)=(len(data)//2,len(data)//3)
+    # bytes kept from a broken connection, in whole chunks (at least one, 
+    # hence smaller chunks for small archives)
+    (community_chunk_size,MESH.community_chunk_size)=(MESH.community_chunk_size,max(min(MESH.community_chunk_size,third),1))
+    kept=third//MESH.community_chunk_size*MESH.community_chunk_size
+    steps=[('http, in one go',http_url,None,True,0,[None]),
+           ('http, broken twice',http_url,None,True,2,[None,'bytes='+str(kept)+'-','bytes='+str(2*kept)+'-']),
+           ('http, interrupted session',http_url,partial_download(half),True,0,['bytes='+str(half)+'-']),
+           ('http, complete .part',http_url,partial_download(len(data)),True,0,['bytes='+str(len(data))+'-']),
+           ('http, no Range support',http_url,partial_download(half),False,0,['bytes='+str(half)+'-']),
+           ('http, wrong checksum',http_url,lambda: write_manifest('0'*64),True,0,[None]),
+           ('http, no manifest',http_url,lambda: os.remove(os.path.join(server_dir,MESH.community_manifest)),True,0,[None]),
+           ('http, missing mesh',http_url+'nothing/',None,True,0,[None]),
+           ('file:// url',pathlib.Path(os.path.abspath(server_dir)).as_uri(),partial_download(half),True,0,[]),
+           ('local directory',server_dir,None,True,0,[])]
+    (community_mirror,MESH.community_mirror)=(MESH.community_mirror,'')
+    UI.verbosity,verbosity=0,UI.verbosity
+    errors=[]
+    for (label,mirror,change,use_ranges,cuts,expected_ranges) in steps:
+        MESH.community_mirror=mirror
+        (server.use_ranges,server.cuts,server.cut_after,server.requests,server.served)=(use_ranges,cuts,third,[],0)
+        if label=='http, no manifest': write_manifest(hashlib.sha256(data).hexdigest())
+        if change: change()
+        with contextlib.redirect_stdout(io.StringIO()):
+            returncode=MESH.community_mesh(tile)
+        ranges=[byte_range for (path,byte_range,status) in server.requests if path.endswith('.7z')]
+        expected=label not in ('http, wrong checksum','http, missing mesh')
+        if ranges!=expected_ranges: errors.append(label+": requested ranges "+str(ranges)+" instead of "+str(expected_ranges)+".")
+        if returncode!=expected: errors.append(label+": community_mesh returned "+str(returncode)+".")
+        if expected and (not os.path.isfile(mesh_file) or MESH.file_md5(mesh_file)!=mesh_md5): errors.append(label+": not the original mesh.")
+        if expected and MESH.read_mesh_index_file(mesh_file) is None: errors.append(label+": no triangle index.")
+        if not expected and os.path.isfile(mesh_file): errors.append(label+": a mesh was extracted.")
+        if use_ranges and server.served>len(data)+cuts*(third-kept): errors.append(label+": "+str(server.served)+" bytes served for an archive of "+str(len(data))+".")
+        if os.path.exists(mesh_file+'.7z') or os.path.exists(mesh_file+'.7z.part'): errors.append(label+": the archive was left.")
+        MESH.remove_mesh_file(mesh_file)
+    (UI.verbosity,MESH.community_mirror,MESH.community_chunk_size)=(verbosity,community_mirror,community_chunk_size)
+    server.shutdown()
+    server_thread.join()
+    server.server_close()
+    shutil.rmtree(bench_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def buckets_md5(dico):
+    # md5 of mask buckets, mask tiles and triangles in order
+    return arrays_md5(list(dico),[len(tris) for tris in dico.values()],numpy.array([tri for tris in dico.values() for tri in tris]).reshape((-1,6)))
+##############################################################################
+
+##############################################################################
+def mask_buckets_tile(nbr_tris):
+    # A synthetic coastal tile and two of its neighbours, with binary meshes
+    tile=BENCH.synthetic_tile(nbr_tris)
+    mesh_file_name_list=[FNAMES.mesh_file(tile.build_dir,tile.lat,tile.lon)]
+    for (lat,lon,seed) in ((tile.lat,tile.lon-1,1),(tile.lat-1,tile.lon,2)):
+        mesh_file_name_list.append(FNAMES.mesh_file(tile.build_dir,lat,lon))
+        BENCH.synthetic_mesh(mesh_file_name_list[-1],nbr_tris//4,lat,lon,seed)
+    for mesh_file_name in mesh_file_name_list: MESH.convert_mesh_file(mesh_file_name)
+    return (tile,mesh_file_name_list)
+##############################################################################
+
+##############################################################################
+def check_mask_buckets():
+    # Water triangles of a synthetic coastal tile and two of its neighbours 
+    # bucketed per mask tile, against the former bucketing, for a few 
+    # mask_zl and use_masks_for_inland.
+    errors=[]
+    (tile,mesh_file_name_list)=mask_buckets_tile(100000)
+    UI.verbosity,verbosity=0,UI.verbosity
+    for (mask_zl,use_masks_for_inland) in ((14,False),(14,True),(16,False),(17,False)):
+        (tile.mask_zl,tile.use_masks_for_inland)=(mask_zl,use_masks_for_inland)
+        [til_x_min,til_y_min]=GEO.wgs84_to_orthogrid(tile.lat+1,tile.lon,tile.mask_zl)
+        [til_x_max,til_y_max]=GEO.wgs84_to_orthogrid(tile.lat,tile.lon+1,tile.mask_zl)
+        label='ZL'+str(mask_zl)+(', inland masks' if use_masks_for_inland else '')
+        (dico_masks,dico_masks_inland)=MASK.water_triangle_buckets(tile,mesh_file_name_list,til_x_min,til_y_min,til_x_max,til_y_max)
+        compare_to_fixture(errors,'mask_buckets',label,[buckets_md5(dico_masks),buckets_md5(dico_masks_inland)])
+    UI.verbosity=verbosity
+    shutil.rmtree(tile.build_dir)
+    return errors
+##############################################################################
+
+##############################################################################
+def archipelago_triangles_wgs84(nbr_tris,size,zoomlevel,px0,py0):
+    # The (lat1,lon1,lat2,lon2,lat3,lon3) triangles of archipelago_triangles,
+    # vertices at the center of their pixel relative to (px0,py0)
+    (px,py)=BENCH.archipelago_triangles(nbr_tris,size)
+    lon=((px+0.5+px0)/2**(zoomlevel+7)-1)*180
+    lat=360/numpy.pi*numpy.arctan(numpy.exp(numpy.pi*(1-(py+0.5+py0)/2**(zoomlevel+7))))-90
+    return numpy.column_stack((lat[:,0],lon[:,0],lat[:,1],lon[:,1],lat[:,2],lon[:,2])).tolist()
+##############################################################################
+
+##############################################################################
+def check_mask_raster():
+    # Water triangles of a dense archipelago drawn on a mask with 
+    # MASK.triangles_to_pixels and MASK.draw_triangles, against the former 
+    # GEO.wgs84_to_pix and ImageDraw.polygon one triangle at a time, and 
+    # the pixel coordinates of triangles all over the globe against 
+    # GEO.wgs84_to_pix.
+    errors=[]
+    (size,zoomlevel,px0,py0)=(2048,16,8390656,5570560)
+    triangles=archipelago_triangles_wgs84(50000,size,zoomlevel,px0,py0)
+    mask_im=Image.new("L",(size,size),'white')
+    mask_draw=ImageDraw.Draw(mask_im)
+    MASK.draw_triangles(mask_draw,*MASK.triangles_to_pixels(triangles,zoomlevel,px0,py0),'black')
+    del(mask_draw)
+    compare_to_fixture(errors,'mask_raster','mask',hashlib.md5(mask_im.tobytes()).hexdigest())
+    rng=numpy.random.RandomState(1)
+    coords=rng.uniform(-1,1,(20000,6))*numpy.array([85,180,85,180,85,180])
+    (tri_px,tri_py)=MASK.triangles_to_pixels(coords.tolist(),zoomlevel,px0,py0)
+    expected=numpy.array([[coordinate-origin for (lat,lon) in zip(triangle[0::2],triangle[1::2]) for (coordinate,origin) in zip(GEO.wgs84_to_pix(lat,lon,zoomlevel),(px0,py0))] for triangle in coords.tolist()])
+    if (expected[:,0::2]!=tri_px).any() or (expected[:,1::2]!=tri_py).any(): errors.append("triangles_to_pixels differs from GEO.wgs84_to_pix.")
+    return errors
+##############################################################################
+
+checks={'mesh_loader':check_mesh_loader,'pool_quadtree':check_pool_quadtree,'dsf_writer':check_dsf_writer,
+        'dsf_reader':check_dsf_reader,'dsf_workers':check_dsf_workers,'triangle_strips':check_triangle_strips,
+        'build_cache':check_build_cache,'terrain_files':check_terrain_files,'zone_list':check_zone_list,
+        'nodes_altitudes':check_nodes_altitudes,'triangle_files':check_triangle_files,
+        'speculative_mesh':check_speculative_mesh,'mesh_cache':check_mesh_cache,
+        'mesh_estimate':check_mesh_estimate,'mesh_index':check_mesh_index,'weight_map':check_weight_map,
+        'community_mesh':check_community_mesh,'mask_buckets':check_mask_buckets,'mask_raster':check_mask_raster}
+
+if __name__ == '__main__':
+    Syntax='Syntax :\n--------\n(PYTHON) tools/O4_Checks.py [check_name ...]\n\nAvailable checks (all by default) : '+', '.join(checks)
+    names=sys.argv[1:] or list(checks)
+    if any(name not in checks for name in names):
+        print(Syntax)
+        sys.exit(1)
+    BENCH.start()
+    failed=[]
+    for name in names:
+        timer=time.time()
+        errors=checks[name]()
+        UI.vprint(0,'-> {:<24}'.format(name),'FAILED' if errors else 'OK','    ('+UI.nicer_timer(time.time()-timer)+')')
+        for error in errors:
+            UI.vprint(0,"   ERROR:",error)
+        if errors: failed.append(name)
+    if failed:
+        UI.vprint(0,"Failed checks :",', '.join(failed))
+        sys.exit(1)